@@ -45,7 +45,9 @@ exe = EXE(
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
+    # UPX-packed binaries are decompressed on every launch; skipping it trades
+    # disk size for a faster cold start
+    upx=False,
     console=True,
     disable_windowed_traceback=False,
     argv_emulation=False,
@@ -61,7 +63,7 @@ coll = COLLECT(
     analysis.zipfiles,
     analysis.datas,
     strip=False,
-    upx=True,
+    upx=False,
     upx_exclude=[],
     name="MyRead",
 )
@@ -1,31 +1,47 @@
 from __future__ import annotations
 import aiosqlite
 import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+from .utils.metrics import DB_ACQUIRE_SECONDS, DB_OP_SECONDS
+from .utils.zipscan import natural_sort_key
 
 DB_PATH = os.path.abspath("myread.sqlite3")
 
 SCHEMA_SQL = r"""
+PRAGMA auto_vacuum=INCREMENTAL;
 PRAGMA journal_mode=WAL;
 PRAGMA synchronous=NORMAL;
 PRAGMA temp_store=MEMORY;
 
 CREATE TABLE IF NOT EXISTS albums (
   id INTEGER PRIMARY KEY,
-  type TEXT NOT NULL CHECK(type IN ('zip','folder')),
+  type TEXT NOT NULL CHECK(type IN ('folder','zip','tar','rar','7z')),
   path TEXT NOT NULL UNIQUE,
   name TEXT NOT NULL,
   mtime INTEGER NOT NULL,
   size INTEGER NOT NULL,
   file_count INTEGER NOT NULL,
   added_at INTEGER NOT NULL,
-  cover_path TEXT NULL
+  cover_path TEXT NULL,
+  first_entry TEXT NULL,
+  -- natural_sort_key(name): memcmp order is natural order, so ORDER BY can use an index
+  name_key BLOB NULL,
+  -- hash of the image / archive names inside; with size, mtime and file_count it recognises a moved album
+  fingerprint TEXT NULL,
+  -- tiny blurred preview of the cover (data: URI), painted before the cover loads
+  placeholder TEXT NULL
 );
 
 CREATE TABLE IF NOT EXISTS thumbs (
   id INTEGER PRIMARY KEY,
   album_id INTEGER NOT NULL REFERENCES albums(id) ON DELETE CASCADE,
   key TEXT NOT NULL,
+  -- the thumbnail file, or the pack segment holding it at pack_offset (bytes long)
   file_path TEXT NOT NULL,
+  pack_offset INTEGER NULL,
   bytes INTEGER NOT NULL,
   width INTEGER NOT NULL,
   height INTEGER NOT NULL,
@@ -38,9 +54,169 @@ CREATE TABLE IF NOT EXISTS settings (
   key TEXT PRIMARY KEY,
   value TEXT NOT NULL
 );
+
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY,
+  kind TEXT NOT NULL,
+  payload TEXT NOT NULL DEFAULT '{}',
+  status TEXT NOT NULL CHECK(status IN ('queued','running','done','failed','cancelled')),
+  priority INTEGER NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL DEFAULT 3,
+  progress TEXT NULL,
+  result TEXT NULL,
+  error TEXT NULL,
+  cancel_requested INTEGER NOT NULL DEFAULT 0,
+  run_after INTEGER NOT NULL DEFAULT 0,
+  created_at INTEGER NOT NULL,
+  started_at INTEGER NULL,
+  finished_at INTEGER NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority DESC, id);
+
+-- image entries of each album, recorded at scan time; pages are read in
+-- sort_key (natural) order. width/height/format come from the image header
+-- only (no decode) and stay NULL until probed
+CREATE TABLE IF NOT EXISTS entries (
+  album_id INTEGER NOT NULL REFERENCES albums(id) ON DELETE CASCADE,
+  name TEXT NOT NULL,
+  sort_key BLOB NOT NULL,
+  width INTEGER NULL,
+  height INTEGER NULL,
+  format TEXT NULL,
+  -- tiny preview (data: URI), recorded when the entry's thumbnail is rendered
+  placeholder TEXT NULL,
+  PRIMARY KEY(album_id, name)
+) WITHOUT ROWID;
+
+-- cross-process mutual exclusion (multi-worker mode): thumbnail renders, job leader
+CREATE TABLE IF NOT EXISTS leases (
+  name TEXT PRIMARY KEY,
+  owner TEXT NOT NULL,
+  expires_at REAL NOT NULL
+);
+
+-- bus events shared between worker processes; rows are pruned after a short window
+CREATE TABLE IF NOT EXISTS event_log (
+  id INTEGER PRIMARY KEY,
+  event TEXT NOT NULL,
+  data TEXT NOT NULL,
+  created_at REAL NOT NULL
+);
+"""
+
+
+# indexes on columns that older databases only get from _migrate
+INDEX_SQL = r"""
+CREATE INDEX IF NOT EXISTS idx_albums_name_key ON albums(name_key);
+CREATE INDEX IF NOT EXISTS idx_albums_fingerprint ON albums(fingerprint);
+CREATE INDEX IF NOT EXISTS idx_entries_order ON entries(album_id, sort_key);
+CREATE INDEX IF NOT EXISTS idx_thumbs_file ON thumbs(file_path);
 """
 
 
+# bump whenever the schema or any MIGRATION_* list changes; stored in PRAGMA user_version
+SCHEMA_VERSION = 9
+
+# columns added after the first release: (table, column, definition)
+MIGRATION_COLUMNS = [
+  ("albums", "first_entry", "TEXT NULL"),
+  ("albums", "name_key", "BLOB NULL"),
+  ("albums", "fingerprint", "TEXT NULL"),
+  ("albums", "placeholder", "TEXT NULL"),
+  ("entries", "placeholder", "TEXT NULL"),
+  ("thumbs", "pack_offset", "INTEGER NULL"),
+]
+
+# derived tables whose layout changed: (table, version that changed it);
+# databases older than that drop the table and the scanner refills it
+MIGRATION_RESETS = [
+  ("entries", 5),
+]
+
+
+# album type constraints of older schemas -> current one (archive formats beyond zip)
+MIGRATION_CHECKS = [
+  ("albums", "CHECK(type IN ('zip','folder'))", "CHECK(type IN ('folder','zip','tar','rar','7z'))"),
+]
+
+
+async def _rebuild_check(db: aiosqlite.Connection, table: str, old: str, new: str) -> None:
+  """Swap a CHECK constraint, which SQLite can only do by rebuilding the table."""
+  async with db.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)) as cur:
+    row = await cur.fetchone()
+  if not row or old not in row[0]:
+    return
+  async with db.execute(f"PRAGMA table_info({table})") as cur:
+    columns = ", ".join(r[1] for r in await cur.fetchall())
+  # after a rebuild SQLite stores the name quoted: CREATE TABLE "albums"
+  ddl = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f"CREATE TABLE {table}__new", row[0].replace(old, new), count=1)
+  # foreign keys are off on this connection, so dropping the old table does
+  # not cascade into thumbs; their REFERENCES resolve to the renamed table
+  await db.execute("BEGIN")
+  await db.execute(ddl)
+  await db.execute(f"INSERT INTO {table}__new({columns}) SELECT {columns} FROM {table}")
+  await db.execute(f"DROP TABLE {table}")
+  await db.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+  await db.commit()
+
+
+async def _enable_incremental_vacuum(db: aiosqlite.Connection) -> None:
+  """Switch older databases to auto_vacuum=INCREMENTAL (see services/maintenance.py).
+
+  New files get it from SCHEMA_SQL; an existing file only changes mode with
+  a one-time VACUUM, which rewrites it.
+  """
+  async with db.execute("PRAGMA auto_vacuum") as cur:
+    (mode,) = await cur.fetchone()
+  if mode == 2:
+    return
+  await db.commit()
+  await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+  await db.execute("VACUUM")
+
+
+async def _migrate(db: aiosqlite.Connection) -> None:
+  """Add columns missing from databases created by older versions."""
+  for table, column, ddl in MIGRATION_COLUMNS:
+    async with db.execute(f"PRAGMA table_info({table})") as cur:
+      existing = {row[1] for row in await cur.fetchall()}
+    if column not in existing:
+      await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+  await db.commit()
+  for table, old, new in MIGRATION_CHECKS:
+    await _rebuild_check(db, table, old, new)
+  async with db.execute("SELECT id, name FROM albums WHERE name_key IS NULL") as cur:
+    missing = await cur.fetchall()
+  await db.executemany(
+    "UPDATE albums SET name_key=? WHERE id=?", [(natural_sort_key(name), album_id) for album_id, name in missing]
+  )
+
+
+@asynccontextmanager
+async def _init_lock():
+  """Serialize schema upgrades between processes (multi-worker startups).
+
+  The upgrade itself cannot run in one transaction on the database: the
+  schema script commits, and journal_mode / VACUUM refuse to run inside a
+  transaction. An exclusive transaction on a small sidecar file holds the
+  other workers back until the upgrade is done.
+  """
+  async with aiosqlite.connect(DB_PATH + "-init", timeout=600) as lock:
+    await lock.execute("BEGIN EXCLUSIVE")
+    try:
+      yield
+    finally:
+      await lock.rollback()
+
+
+async def _schema_version(db: aiosqlite.Connection) -> int:
+  async with db.execute("PRAGMA user_version") as cur:
+    (version,) = await cur.fetchone()
+  return version
+
+
 async def init_db() -> None:
   """Initialize database schema and pragmas.
 
@@ -50,19 +226,63 @@ async def init_db() -> None:
   connection.
   """
   async with aiosqlite.connect(DB_PATH) as db:
+    # the schema script and column probes cost several statements per start;
+    # skip them when the file already carries the current schema version
+    if await _schema_version(db) >= SCHEMA_VERSION:
+      return
+  async with _init_lock(), aiosqlite.connect(DB_PATH) as db:
+    # another worker may have finished the upgrade while we waited for the lock
+    version = await _schema_version(db)
+    if version >= SCHEMA_VERSION:
+      return
+    for table, changed_in in MIGRATION_RESETS:
+      if 0 < version < changed_in:
+        await db.execute(f"DROP TABLE IF EXISTS {table}")
     # It's safe to run PRAGMAs and schema creation on a transient connection
     # to avoid lingering file locks on Windows during dev reload.
     await db.executescript(SCHEMA_SQL)
+    await _migrate(db)
+    await db.executescript(INDEX_SQL)
+    await _enable_incremental_vacuum(db)
+    await db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
     await db.commit()
-    # enable foreign keys for this connection as well (not strictly needed
-    # for schema creation, but keeps behavior consistent if reused later)
-    await db.execute("PRAGMA foreign_keys=ON;")
   # connection is closed here
 
-async def get_db():
+def _instrument(db: aiosqlite.Connection) -> None:
+    """Time every operation aiosqlite ships to its connection thread.
+
+    All aiosqlite calls funnel through the private `_execute`; if a future
+    version drops it the connection simply stays uninstrumented.
+    """
+    inner = getattr(db, "_execute", None)
+    if inner is None:
+        return
+
+    async def timed(fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await inner(fn, *args, **kwargs)
+        finally:
+            DB_OP_SECONDS.observe(time.perf_counter() - start, op=getattr(fn, "__name__", "other"))
+
+    db._execute = timed  # type: ignore[method-assign]
+
+
+@asynccontextmanager
+async def open_db():
+    """Open a connection outside of request scope (jobs, streaming responses)."""
+    start = time.perf_counter()
     db = await aiosqlite.connect(DB_PATH)
+    _instrument(db)
     await db.execute("PRAGMA foreign_keys=ON;")
+    DB_ACQUIRE_SECONDS.observe(time.perf_counter() - start)
     try:
         yield db
     finally:
         await db.close()
+
+
+async def get_db():
+    async with open_db() as db:
+        yield db
+
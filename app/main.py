@@ -1,12 +1,69 @@
 from __future__ import annotations
+import time
+from .utils import startup
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from .db import init_db
-from .routers import health, albums, settings as settings_router, images, events as events_router
+from .db import init_db, open_db
+from .settings import settings
+from .services.jobs import jobs
+from .services import leases, maintenance, runtime_config, thumbstore
+from .services.eventlog import EventLogBridge
+from .utils.compression import CompressionMiddleware
+from .utils.events import events
+from .utils.metrics import HTTP_IN_FLIGHT, HTTP_REQUEST_SECONDS
+from .routers import health, albums, settings as settings_router, images, events as events_router, jobs as jobs_router
+from .routers import metrics as metrics_router, admin as admin_router
+
+
+class TimingMiddleware:
+    """Record per-route latency and add a Server-Timing header.
+
+    Plain ASGI rather than BaseHTTPMiddleware: no extra task per request and
+    streaming responses pass through untouched.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_timed(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", f"app;dur={elapsed_ms:.1f}".encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        maintenance.touch()
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            if not startup.marked("first_request"):
+                startup.mark("first_request")
+                print(f"⏱️ 启动耗时: {startup.format_report()}")
+            # route template keeps label cardinality bounded (ids are not labels)
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "static"
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, method=scope.get("method", ""), route=route_path, status=status
+            )
 
 app = FastAPI(title="myread", version="0.1.0")
+# innermost, so Server-Timing and the latency histogram include compression
+app.add_middleware(CompressionMiddleware, minimum_size=settings.compress_min_bytes)
+app.add_middleware(TimingMiddleware)
 
 # CORS: allow local dev
 app.add_middleware(
@@ -18,9 +75,33 @@ app.add_middleware(
 )
 
 
+# multi-worker mode: SSE subscribers in every process see every process's events
+_event_bridge = EventLogBridge(events)
+
+
 @app.on_event("startup")
 async def on_startup():
     await init_db()
+    startup.mark("init_db")
+    async with open_db() as db:
+        await runtime_config.load(db)
+    startup.mark("settings")
+    if leases.multi_worker():
+        await _event_bridge.start()
+        runtime_config.start_follower()
+    await jobs.start(settings.job_workers)
+    maintenance.maintenance.start()
+    startup.mark("ready")
+    print(f"⏱️ 启动耗时: {startup.format_report()}")
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await jobs.stop()
+    await maintenance.maintenance.stop()
+    await runtime_config.stop_follower()
+    await _event_bridge.stop()
+    thumbstore.close()
 
 
 # Routers
@@ -29,6 +110,9 @@ app.include_router(albums.router, prefix="/api")
 app.include_router(settings_router.router, prefix="/api")
 app.include_router(images.router, prefix="/api")
 app.include_router(events_router.router, prefix="/api")
+app.include_router(jobs_router.router, prefix="/api")
+app.include_router(metrics_router.router, prefix="/api")
+app.include_router(admin_router.router, prefix="/api")
 
 static_path = Path(__file__).parent.parent / "frontend"
 print(f"🔧 静态文件路径: {static_path}")
@@ -37,4 +121,6 @@ try:
     app.mount("/", StaticFiles(directory=str(static_path), html=True), name="frontend")
 except Exception:
     # ignore if folder missing in some environments
-    pass
\ No newline at end of file
+    pass
+
+startup.mark("import")
\ No newline at end of file
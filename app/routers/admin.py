@@ -0,0 +1,52 @@
+from __future__ import annotations
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+import aiosqlite
+
+from ..db import get_db
+from ..settings import settings as runtime_settings
+from ..services import maintenance as db_maintenance
+from ..services.profiler import profile
+
+router = APIRouter(tags=["admin"])
+
+
+@router.get("/admin/profile")
+async def run_profile(
+    seconds: float = 5.0,
+    interval_ms: float = 10.0,
+    block_ms: float = 100.0,
+    format: Literal["json", "collapsed"] = "json",
+):
+    """Sample all threads for `seconds` (max 60) and report event-loop stalls.
+
+    `format=collapsed` returns only the collapsed stacks as text, ready for
+    flamegraph.pl or speedscope. Requires APP_ENABLE_PROFILER=true.
+    """
+    if not runtime_settings.enable_profiler:
+        raise HTTPException(status_code=403, detail="profiler disabled; set APP_ENABLE_PROFILER=true")
+    result = await profile(seconds, interval_ms / 1000, block_ms / 1000)
+    if format == "collapsed":
+        return PlainTextResponse(result["collapsed"] + "\n")
+    return result
+
+
+@router.get("/admin/db")
+async def db_stats(db: aiosqlite.Connection = Depends(get_db)):
+    """Database/WAL file sizes, page counts and the last result of each maintenance task."""
+    return {**await db_maintenance.stats(db), "last": db_maintenance.maintenance.last}
+
+
+@router.post("/admin/db/maintenance")
+async def run_db_maintenance(
+    task: Literal["checkpoint", "analyze", "vacuum", "all"] = "all",
+    db: aiosqlite.Connection = Depends(get_db),
+):
+    """Run maintenance now: `checkpoint` (WAL truncate), `analyze`, `vacuum` (incremental, not waiting for idle)."""
+    force = db_maintenance.TASKS if task == "all" else (task,)
+    try:
+        results = await db_maintenance.maintenance.run_once(db, force=force)
+    except aiosqlite.OperationalError as e:
+        raise HTTPException(status_code=409, detail=f"database busy: {e}")
+    return {"results": results, "stats": await db_maintenance.stats(db)}
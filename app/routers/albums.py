@@ -1,16 +1,26 @@
 from __future__ import annotations
 from typing import Literal, Optional
+import asyncio
+import json
 import os
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 import aiosqlite
 
-from ..db import get_db
-from ..services.scanner import scan_paths, ScanOptions, normalize_album_path
+from ..db import get_db, open_db
+from ..services.scanner import normalize_album_path, scan_paths, ScanOptions
 from ..services.entries import list_entries
+from ..services.jobs import jobs
+from ..services import covers
+from ..services.admission import DecodeRejected
+from ..utils import archives
+from ..utils.jsonresp import FastJSONResponse
 import subprocess
 from ..settings import settings as runtime_settings
 
-router = APIRouter(tags=["albums"])
+# dict results still go through jsonable_encoder; the listings below return
+# FastJSONResponse themselves to skip it
+router = APIRouter(tags=["albums"], default_response_class=FastJSONResponse)
 
 def _split_segments(norm_path: str) -> list[str]:
     if not norm_path:
@@ -46,13 +56,15 @@ def _parent_path(norm_path: str) -> str | None:
 
 def _public_album(rec: dict) -> dict:
     """Return the public view of an album record (stable output used by API)."""
-    keys = ("id", "type", "path", "name", "mtime", "size", "file_count", "added_at", "cover_path")
+    keys = ("id", "type", "path", "name", "mtime", "size", "file_count", "added_at", "cover_path", "placeholder")
     return {k: rec.get(k) for k in keys}
 
 
-async def _load_all_albums(db: aiosqlite.Connection) -> list[dict]:
+async def _load_all_albums(db: aiosqlite.Connection, order_by: str = "name_key, id") -> list[dict]:
+    """Load every album in `order_by` order (name_key is natural name order, indexed)."""
     async with db.execute(
-        "SELECT id, type, path, name, mtime, size, file_count, added_at, cover_path FROM albums"
+        "SELECT id, type, path, name, mtime, size, file_count, added_at, cover_path, placeholder"
+        f" FROM albums ORDER BY {order_by}"
     ) as cur:
         rows = await cur.fetchall()
     records: list[dict] = []
@@ -67,6 +79,7 @@ async def _load_all_albums(db: aiosqlite.Connection) -> list[dict]:
             "file_count": row[6],
             "added_at": row[7],
             "cover_path": row[8],
+            "placeholder": row[9],
         }
         norm_path = normalize_album_path(rec["path"])
         rec["_norm_path"] = norm_path
@@ -108,11 +121,6 @@ def _gather_ancestors(rec: dict, by_key: dict[str, dict]) -> list[dict]:
     return chain
 
 
-def _sort_children(records: list[dict], sort_by: str, order: Literal["ASC", "DESC"]) -> list[dict]:
-    reverse = order == "DESC"
-    return sorted(records, key=lambda r: (r.get(sort_by), r["name"], r["id"]), reverse=reverse)
-
-
 def _build_tree(records: list[dict]) -> tuple[list[dict], dict[str, dict]]:
     nodes: dict[str, dict] = {}
     for rec in records:
@@ -123,6 +131,7 @@ def _build_tree(records: list[dict]) -> tuple[list[dict], dict[str, dict]]:
         }
         nodes[rec["_key_path"]] = node
 
+    # records arrive in natural name order, so every branch is already sorted
     roots: list[dict] = []
     for rec in records:
         node = nodes[rec["_key_path"]]
@@ -131,13 +140,6 @@ def _build_tree(records: list[dict]) -> tuple[list[dict], dict[str, dict]]:
             nodes[parent_key]["children"].append(node)
         else:
             roots.append(node)
-
-    def sort_branch(children: list[dict]) -> None:
-        children.sort(key=lambda n: n["path"].lower())
-        for child in children:
-            sort_branch(child["children"])
-
-    sort_branch(roots)
     return roots, nodes
 
 
@@ -169,16 +171,53 @@ def _filter_tree(nodes: list[dict], keyword: str) -> list[dict]:
     return result
 
 
+def _stream_scan(paths: list[str], options: ScanOptions) -> StreamingResponse:
+    """Run a scan inside the request and stream NDJSON records.
+
+    One `{"event": "album", ...}` line per upserted album, then a final
+    `{"event": "done", "count": n}` line. The queue between scanner and client
+    is bounded, so a slow reader throttles the scan instead of buffering it.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+
+    async def produce() -> None:
+        async def on_album(info: dict) -> None:
+            await queue.put({"event": "album", **info})
+
+        try:
+            async with open_db() as db:
+                result = await scan_paths(db, paths, options, on_album=on_album)
+            await queue.put({"event": "done", **result})
+        except Exception as e:
+            await queue.put({"event": "error", "detail": str(e)})
+
+    async def gen():
+        task = asyncio.create_task(produce())
+        try:
+            while True:
+                record = await queue.get()
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+                if record["event"] != "album":
+                    break
+        finally:
+            task.cancel()
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+
 @router.post("/albums/scan")
-async def scan_albums(body: dict, db: aiosqlite.Connection = Depends(get_db)):
+async def scan_albums(body: dict, stream: bool = False, db: aiosqlite.Connection = Depends(get_db)):
     # body: { paths: [...], options?: { folder: { recursive: false } } }
     paths = body.get("paths") or []
     if not isinstance(paths, list) or not paths:
         raise HTTPException(status_code=400, detail="paths is required and must be a non-empty list")
     options_dict = (body.get("options") or {}).get("folder") or {}
     recursive = bool(options_dict.get("recursive", False))
-    result = await scan_paths(db, paths, ScanOptions(recursive=recursive))
-    return result
+    if stream:
+        return _stream_scan(paths, ScanOptions(recursive=recursive))
+    # scans can take minutes: run them as a background job, poll /api/jobs/{id}
+    job_id = await jobs.enqueue(db, "scan", {"paths": paths, "recursive": recursive})
+    return {"job_id": job_id, "status": "queued"}
 
 
 @router.get("/albums")
@@ -190,11 +229,15 @@ async def list_albums(
     parent_path: str | None = None,
     db: aiosqlite.Connection = Depends(get_db),
 ):
-    sort_col = sort_by
     order_sql = "ASC" if order == "asc" else "DESC"
     scope_val = (scope or "children").lower()
+    # ties fall back to the (natural) name, then id, in the same direction
+    if sort_by == "name":
+        order_by = f"name_key {order_sql}, id {order_sql}"
+    else:
+        order_by = f"{sort_by} {order_sql}, name_key {order_sql}, id {order_sql}"
 
-    records = await _load_all_albums(db)
+    records = await _load_all_albums(db, order_by if scope_val == "children" else "name_key, id")
     by_key = {rec["_key_path"]: rec for rec in records}
     keyword_lower = keyword.lower() if keyword else None
 
@@ -218,19 +261,21 @@ async def list_albums(
                 or (rec.get("_norm_path") and keyword_lower in rec["_norm_path"].lower())
             ]
 
-        ordered = _sort_children(children, sort_col, order_sql)
-        items = [_public_album(rec) for rec in ordered]
+        # filtering keeps the database order
+        items = [_public_album(rec) for rec in children]
         parent_payload = _public_album(parent_rec) if parent_rec else None
         ancestors_payload = (
             [_public_album(a) for a in _gather_ancestors(parent_rec, by_key)] if parent_rec else []
         )
 
-        return {
-            "items": items,
-            "total": len(items),
-            "parent": parent_payload,
-            "ancestors": ancestors_payload,
-        }
+        return FastJSONResponse(
+            {
+                "items": items,
+                "total": len(items),
+                "parent": parent_payload,
+                "ancestors": ancestors_payload,
+            }
+        )
 
     if scope_val == "tree":
         roots, node_map = _build_tree(records)
@@ -245,7 +290,7 @@ async def list_albums(
         if keyword:
             roots = _filter_tree(roots, keyword)
 
-        return {"items": roots, "total": len(records)}
+        return FastJSONResponse({"items": roots, "total": len(records)})
 
     raise HTTPException(status_code=400, detail="invalid scope value")
 
@@ -253,7 +298,7 @@ async def list_albums(
 @router.get("/albums/{album_id}")
 async def get_album(album_id: int, db: aiosqlite.Connection = Depends(get_db)):
     async with db.execute(
-        "SELECT id, type, path, name, mtime, size, file_count, added_at, cover_path FROM albums WHERE id=?",
+        "SELECT id, type, path, name, mtime, size, file_count, added_at, cover_path, placeholder FROM albums WHERE id=?",
         (album_id,),
     ) as cur:
         r = await cur.fetchone()
@@ -269,6 +314,7 @@ async def get_album(album_id: int, db: aiosqlite.Connection = Depends(get_db)):
             "file_count": r[6],
             "added_at": r[7],
             "cover_path": r[8],
+            "placeholder": r[9],
         }
 
 
@@ -281,7 +327,7 @@ async def get_album_entries(
 ):
     page = max(1, page)
     per_page = min(500, max(1, per_page))
-    return await list_entries(db, album_id, page, per_page)
+    return FastJSONResponse(await list_entries(db, album_id, page, per_page))
 
 
 class CoverBodyDefault(dict):
@@ -298,6 +344,7 @@ async def set_album_cover(
 ):
     # policy encoding: 'default' | 'internal:<entry>' | 'external:<abs_path>'
     path: str | None
+    rendered = 0
     if type == "default":
         path = None
     elif type == "internal":
@@ -307,54 +354,44 @@ async def set_album_cover(
     else:  # external
         if not file:
             raise HTTPException(status_code=400, detail="file required for external cover")
-        covers_dir = os.path.abspath(os.path.join("cache", "covers"))
-        os.makedirs(covers_dir, exist_ok=True)
-        path = os.path.join(covers_dir, file.filename)
-        content = await file.read()
-        tmp = path + ".tmp"
-        with open(tmp, "wb") as f:
-            f.write(content)
-        os.replace(tmp, path)
-
-    await db.execute("UPDATE albums SET cover_path=? WHERE id=?", (path, album_id))
+        try:
+            path = await covers.save_upload(file)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async with db.execute("SELECT cover_path FROM albums WHERE id=?", (album_id,)) as cur:
+        row = await cur.fetchone()
+    if not row:
+        if covers.is_uploaded(path):
+            await covers.release(db, [path])
+        raise HTTPException(status_code=404, detail="album not found")
+    if covers.is_uploaded(path):
+        # grid views get the standard sizes, never the uploaded original
+        try:
+            rendered = await covers.render(db, album_id, path)
+        except DecodeRejected as e:
+            await covers.release(db, [path])
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except Exception:
+            await covers.release(db, [path])
+            raise HTTPException(status_code=400, detail="uploaded cover is not a readable image")
+    # the next cover request records the new cover's placeholder
+    await db.execute("UPDATE albums SET cover_path=?, placeholder=NULL WHERE id=?", (path, album_id))
     await db.commit()
-    return {"ok": True, "cover_path": path}
+    if row[0] != path:
+        await covers.forget(db, album_id, row[0])
+    await covers.release(db, [row[0]])
+    return {"ok": True, "cover_path": path, "rendered": rendered}
 
 @router.post("/albums/refresh")
 async def refresh_albums(db: aiosqlite.Connection = Depends(get_db)):
-    """Remove albums that no longer exist on disk.
+    """Enqueue a library refresh (drop vanished albums, rescan changed ones).
 
-    - For folder albums: path must be an existing directory.
-    - For zip albums: path must be an existing regular file.
-    Deletions cascade to thumbs via FK.
+    Refresh jobs jump ahead of scans so the UI's startup refresh is not stuck
+    behind a long scan. Poll /api/jobs/{job_id} for the result.
     """
-    async with db.execute("SELECT id, type, path, mtime FROM albums") as cur:
-        rows = await cur.fetchall()
-    checked = len(rows)
-    removed_ids: list[int] = []
-    for album_id, typ, p, mtime in rows:
-        try:
-            if typ == "folder":
-                ok = os.path.isdir(p)
-
-            elif typ == "zip":
-                ok = os.path.isfile(p)
-            else:
-                ok = os.path.exists(p)
-        except Exception:
-            ok = False
-        if not ok:
-            await db.execute("DELETE FROM albums WHERE id=?", (album_id,))
-            removed_ids.append(album_id)
-        else:
-            stat = os.stat(p)
-            if int(stat.st_mtime) != mtime:
-                await scan_paths(
-                    db, [p], ScanOptions(recursive=True)
-                )
-    if removed_ids:
-        await db.commit()
-    return {"checked": checked, "removed": len(removed_ids), "ids": removed_ids}
+    job_id = await jobs.enqueue(db, "refresh", priority=10)
+    return {"job_id": job_id, "status": "queued"}
 
 
 @router.delete("/albums/{album_id}")
@@ -387,43 +424,34 @@ async def delete_album(album_id: int, db: aiosqlite.Connection = Depends(get_db)
                 to_delete.append((r[0], r[1]))
 
     ids = [r[0] for r in to_delete]
+    # thumbs rows cascade with the albums; renders of uploaded covers also free their files
+    for aid, cpath in to_delete:
+        await covers.forget(db, aid, cpath)
 
     # delete all in one operation
     placeholders = ",".join(["?"] * len(ids))
     await db.execute(f"DELETE FROM albums WHERE id IN ({placeholders})", tuple(ids))
     await db.commit()
 
-    # best-effort: remove cover files for deleted rows if they are inside cache/covers
-    cache_dir = os.path.abspath(os.path.join("cache", "covers"))
-    for _id, cpath in to_delete:
-        try:
-            if cpath:
-                abs_cover = os.path.abspath(cpath)
-                if abs_cover.startswith(cache_dir) and os.path.exists(abs_cover):
-                    try:
-                        os.remove(abs_cover)
-                    except Exception:
-                        pass
-        except Exception:
-            # ignore filesystem issues per-row
-            pass
+    # best-effort: remove uploaded covers no remaining album uses
+    await covers.release(db, [cpath for _id, cpath in to_delete])
 
     return {"ok": True, "deleted": len(ids), "ids": ids}
 
 
 @router.post('/open-with-LocalViewer')
 async def open_with_LocalViewer(body: dict):
-    """Request body: { path: str, type: 'folder'|'zip' }
+    """Request body: { path: str, type: 'folder'|'zip'|'rar'|'7z'|'tar' }
 
-    This will attempt to launch LocalViewer (Windows) to open the given folder or zip file.
+    This will attempt to launch LocalViewer (Windows) to open the given folder or archive.
     The executable path is taken from runtime settings (APP_LocalViewer_PATH env or settings).
     """
     path = body.get('path')
     typ = body.get('type')
     if not path:
         raise HTTPException(status_code=400, detail='path is required')
-    if typ not in ('folder', 'zip'):
-        raise HTTPException(status_code=400, detail='type must be "folder" or "zip"')
+    if typ != 'folder' and not archives.is_archive_kind(typ):
+        raise HTTPException(status_code=400, detail='type must be "folder" or an archive type')
 
     exe = runtime_settings.LocalViewer_path
     if not exe:
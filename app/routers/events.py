@@ -1,29 +1,56 @@
 from __future__ import annotations
-from fastapi import APIRouter
-from sse_starlette.sse import EventSourceResponse
+from fastapi import APIRouter, Header
 import json
 
 from ..utils.events import events
 
 router = APIRouter(tags=["events"])
 
+# events published within this window are sent as one SSE message
+BATCH_INTERVAL = 0.25
+
 
 @router.get("/events/stream")
-async def stream_events():
-    q = events.subscribe()
+async def stream_events(
+    topics: str | None = None,
+    last_event_id: str | None = Header(None),
+):
+    """SSE stream of bus events.
+
+    - `topics`: comma separated event names or prefixes (`scan`, `job:update`).
+    - `Last-Event-ID`: sent by EventSource on reconnect; missed events are
+      replayed from the bus history. If they are no longer available a
+      `{"bus": "resync"}` message tells the client to reload.
+    Each message's data is one event payload, or a list of payloads when
+    several were batched together.
+    """
+    # sse_starlette (and the uvicorn modules it pulls in) load on the first stream
+    from sse_starlette.sse import EventSourceResponse
+
+    topic_set = {t.strip() for t in topics.split(",") if t.strip()} if topics else None
+    try:
+        resume_from = int(last_event_id) if last_event_id else None
+    except ValueError:
+        resume_from = None
+    sub, complete = events.subscribe(topic_set, resume_from)
 
     async def gen():
         try:
+            if not complete:
+                yield {"event": "message", "id": str(events.last_id), "data": json.dumps({"bus": "resync"})}
             while True:
-                payload = await q.get()
-                data = payload.get("data") if isinstance(payload, dict) else None
-                if data is None:
-                    data = payload
+                items, dropped = await sub.next_batch(BATCH_INTERVAL)
+                datas = [item["data"] for item in items]
+                if dropped:
+                    datas.append({"bus": "dropped", "count": dropped})
+                if not datas:
+                    continue
                 yield {
                     "event": "message",
-                    "data": json.dumps(data),
+                    "id": str(items[-1]["id"] if items else events.last_id),
+                    "data": json.dumps(datas[0] if len(datas) == 1 else datas),
                 }
         finally:
-            events.unsubscribe(q)
+            events.unsubscribe(sub)
 
     return EventSourceResponse(gen())
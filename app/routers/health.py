@@ -1,9 +1,17 @@
 from __future__ import annotations
 from fastapi import APIRouter
 
+from ..utils import startup
+
 router = APIRouter()
 
 
 @router.get("/health")
 async def health():
     return {"status": "ok"}
+
+
+@router.get("/health/startup")
+async def health_startup():
+    """Seconds from process start to import / init_db / ready / first_request."""
+    return startup.report()
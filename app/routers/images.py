@@ -1,54 +1,103 @@
 from __future__ import annotations
 import os
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, Response
 import aiosqlite
 
 from ..db import get_db
 from ..settings import settings
-from ..services.thumbnails import get_or_create_thumb
+from ..services import covers, thumbstore
+from ..services.admission import DecodeRejected
+from ..services.encoders import Encoder
+from ..services.thumbnails import get_or_create_thumb, placeholder_for, snap_size
+from ..services.thumbstore import ThumbRef
+from ..services.encoders import negotiate, encode_stats, list_encoders
 from ..services.entries import first_entry
+from ..utils import afs
 
 router = APIRouter(tags=["images"])
 
+# responses depend on the Accept header when no explicit fmt is given
+_VARY = {"Vary": "Accept"}
+
 
 async def _get_album(db: aiosqlite.Connection, album_id: int):
-    async with db.execute("SELECT id, type, path, cover_path FROM albums WHERE id=?", (album_id,)) as cur:
+    async with db.execute("SELECT id, type, path, cover_path, placeholder FROM albums WHERE id=?", (album_id,)) as cur:
         r = await cur.fetchone()
         if not r:
             raise HTTPException(status_code=404, detail="album not found")
-    return {"id": r[0], "type": r[1], "path": r[2], "cover_path": r[3]}
+    return {"id": r[0], "type": r[1], "path": r[2], "cover_path": r[3], "placeholder": r[4]}
+
+
+async def _remember_placeholder(db: aiosqlite.Connection, album: dict, ref: ThumbRef) -> None:
+    """Record the album's placeholder from the cover thumbnail just served, once."""
+    if album.get("placeholder"):
+        return
+    placeholder = await placeholder_for(ref)
+    if placeholder:
+        await db.execute("UPDATE albums SET placeholder=? WHERE id=?", (placeholder, album["id"]))
+        await db.commit()
+
+
+async def _thumb_response(db: aiosqlite.Connection, encoder: Encoder, **thumb_args) -> tuple[ThumbRef, Response]:
+    """Look up or render a thumbnail and build its response.
+
+    Packed thumbnails are read here (one pread) rather than while streaming,
+    so a segment compacted away between lookup and read is looked up again.
+    """
+    for attempt in range(2):
+        try:
+            key, ref = await get_or_create_thumb(db, fmt=encoder.name, **thumb_args)
+        except DecodeRejected as e:
+            headers = {"Retry-After": str(e.retry_after)} if e.retry_after else None
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers=headers)
+        if ref.offset is None:
+            return ref, FileResponse(ref.path, media_type=encoder.media_type, headers=_VARY)
+        try:
+            data = await thumbstore.read_blob(ref)
+        except (FileNotFoundError, EOFError):
+            if attempt:
+                raise
+            afs.invalidate(ref.path)
+            continue
+        # keys encode album, entry, size, quality and format, so they make a stable ETag
+        return ref, Response(data, media_type=encoder.media_type, headers={**_VARY, "ETag": f'"{key}"'})
 
 
 @router.get("/albums/{album_id}/cover")
 async def get_cover(
     album_id: int,
+    request: Request,
     w: int = 640,
     h: int = 960,
     fit: str = "cover",
-    fmt: str = "webp",
-    q: int | None = settings.default_quality,
+    fmt: str | None = None,
+    q: int | None = None,
     db: aiosqlite.Connection = Depends(get_db),
 ):
+    encoder = negotiate(request.headers.get("accept"), fmt)
+    fmt = encoder.name
     album = await _get_album(db, album_id)
-    # 优先使用 cover_path；若是绝对路径且存在则直接返回原图；
+    # 优先使用 cover_path：上传的封面按标准尺寸缩略（上传时已生成）；缓存的缩略图文件直接返回；
     # 若是相对/内部条目名，则作为 entry_path 生成缩略；为空或无效则回退到首图。
+    w, h = snap_size(w, h)
     entry_path = None
     cp = album.get("cover_path")
     atype = album.get("type")
     apath = album.get("path")
+    fit = fit if fit in ("cover", "contain") else "cover"
+    if covers.is_uploaded(cp) and await afs.exists(cp):
+        # uploaded cover: its sizes were rendered at upload time
+        ref, response = await _thumb_response(
+            db, encoder, album_id=album["id"], w=w, h=h, fit=fit, quality=q, **covers.source_args(cp)
+        )
+        await _remember_placeholder(db, album, ref)
+        return response
     if cp:
         # 绝对路径：视为外部封面
-        if os.path.isabs(cp) and os.path.exists(cp):
+        if os.path.isabs(cp) and await afs.exists(cp):
             if cp.endswith(f"{w}_{h}.{fmt}"):
-                return FileResponse(cp, media_type="image/*") 
-    key = f"{album_id}_{fit}_{q}_{w}_{h}.{fmt}"
-    # try DB first
-    async with db.execute("SELECT file_path FROM thumbs WHERE album_id=? AND key=?", (album_id, key)) as cur:
-        row = await cur.fetchone()
-        if row and os.path.exists(row[0]):
-            return FileResponse(row[0], media_type="image/*")
-    print("not found in thumbs, generate new")
+                return FileResponse(cp, media_type=encoder.media_type, headers=_VARY)
     entry_path = await first_entry(db, album_id)
     if not entry_path and album["type"] == "folder":
         parent_path = album["path"]
@@ -60,10 +109,16 @@ async def get_cover(
             rows = await cur.fetchall()
         child_entry = None
         for cid, ctype, cpath, cover in rows:
+            if covers.is_uploaded(cover) and await afs.exists(cover):
+                ref, response = await _thumb_response(
+                    db, encoder, album_id=cid, w=w, h=h, fit=fit, quality=q, **covers.source_args(cover)
+                )
+                await _remember_placeholder(db, album, ref)
+                return response
             if cover:
-                if os.path.isabs(cover) and os.path.exists(cover):
+                if os.path.isabs(cover) and await afs.exists(cover):
                     if cover.endswith(f"{w}_{h}.{fmt}"):
-                        return FileResponse(cover, media_type="image/*")
+                        return FileResponse(cover, media_type=encoder.media_type, headers=_VARY)
             child_entry = await first_entry(db, cid)
             if child_entry:
                 entry_path = child_entry
@@ -72,40 +127,45 @@ async def get_cover(
                 break
         if not entry_path:
             raise HTTPException(status_code=404, detail="no images in album or its children")
-    _, path = await get_or_create_thumb(
+    ref, response = await _thumb_response(
         db,
+        encoder,
         album_id=album["id"],
         album_type=atype,
         album_path=apath,
         entry_path=entry_path,
         w=w,
         h=h,
-        fit=fit if fit in ("cover", "contain") else "cover",
-        fmt=fmt,
+        fit=fit,
         quality=q,
     )
-    media_type = "image/webp" if fmt.lower() == "webp" else "application/octet-stream"
-    await db.execute("UPDATE albums SET cover_path=? WHERE id=?", (path, album_id))
-    await db.commit()
-    return FileResponse(path, media_type=media_type)
+    await _remember_placeholder(db, album, ref)
+    if ref.offset is None:
+        # packed thumbnails have no file of their own to remember
+        await db.execute("UPDATE albums SET cover_path=? WHERE id=?", (ref.path, album_id))
+        await db.commit()
+    return response
 
 
 @router.get("/thumbnail")
 async def get_thumbnail(
+    request: Request,
     album_id: int,
     entry_path: str,
     w: int,
     h: int,
     fit: str = "cover",
-    fmt: str = "webp",
+    fmt: str | None = None,
     q: int | None = None,
     db: aiosqlite.Connection = Depends(get_db),
 ):
+    encoder = negotiate(request.headers.get("accept"), fmt)
     album = await _get_album(db, album_id)
     if not entry_path:
         raise HTTPException(status_code=400, detail="entry_path is required")
-    _, path = await get_or_create_thumb(
+    _, response = await _thumb_response(
         db,
+        encoder,
         album_id=album["id"],
         album_type=album["type"],
         album_path=album["path"],
@@ -113,8 +173,12 @@ async def get_thumbnail(
         w=w,
         h=h,
         fit=fit if fit in ("cover", "contain") else "cover",
-        fmt=fmt,
         quality=q,
     )
-    media_type = "image/webp" if fmt.lower() == "webp" else "application/octet-stream"
-    return FileResponse(path, media_type=media_type)
+    return response
+
+
+@router.get("/encoders")
+async def get_encoders():
+    """Available output formats and per-format encode time / size stats."""
+    return {"default": settings.encode_format, "encoders": list_encoders(), "stats": encode_stats.snapshot()}
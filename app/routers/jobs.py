@@ -0,0 +1,48 @@
+from __future__ import annotations
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException
+import aiosqlite
+
+from ..db import get_db
+from ..services.jobs import jobs
+
+router = APIRouter(tags=["jobs"])
+
+
+@router.get("/jobs")
+async def list_jobs(
+    status: Literal["queued", "running", "done", "failed", "cancelled"] | None = None,
+    limit: int = 50,
+    db: aiosqlite.Connection = Depends(get_db),
+):
+    limit = min(500, max(1, limit))
+    return {"items": await jobs.list_jobs(db, status, limit)}
+
+
+@router.post("/jobs")
+async def create_job(body: dict, db: aiosqlite.Connection = Depends(get_db)):
+    # body: { kind: 'scan'|'refresh'|'cache_cleanup', payload?: {...}, priority?: int }
+    kind = body.get("kind")
+    if kind not in jobs.kinds():
+        raise HTTPException(status_code=400, detail=f"kind must be one of {jobs.kinds()}")
+    payload = body.get("payload") or {}
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="payload must be an object")
+    job_id = await jobs.enqueue(db, kind, payload, priority=int(body.get("priority") or 0))
+    return {"job_id": job_id, "status": "queued"}
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    job = await jobs.get(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int, db: aiosqlite.Connection = Depends(get_db)):
+    job = await jobs.cancel(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
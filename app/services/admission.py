@@ -0,0 +1,148 @@
+"""Memory-budgeted admission of thumbnail decodes.
+
+Before a source image is decoded its peak memory is estimated from the
+header (dimensions recorded in `entries` at scan time, or a header probe)
+and reserved against `settings.decode_memory_budget`. Decodes that do not
+fit wait in FIFO order; one larger than the whole budget runs alone. A
+source over `settings.max_input_pixels` is refused outright, and a decode
+still waiting after `settings.decode_queue_timeout` is refused as busy.
+The budget is per process.
+"""
+from __future__ import annotations
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Optional, Tuple
+
+import aiosqlite
+
+from ..settings import settings
+from ..utils import afs, imgmeta
+from ..utils.metrics import DECODE_MEMORY_BYTES, DECODE_REJECTED, DECODE_WAITING
+from .entries import probe_entries
+
+# decoded bytes per pixel by source format (Pillow's mode after load);
+# unknown formats are assumed RGBA
+_BYTES_PER_PIXEL = {"jpeg": 3, "png": 4, "webp": 4, "gif": 1}
+# the decoded image plus one full-size working copy (cover crop, mode conversion)
+_PEAK_FACTOR = 2
+# reserved when the header cannot be read; such decodes usually fail early
+UNKNOWN_ESTIMATE = 64 * 1024 * 1024
+
+
+class DecodeRejected(Exception):
+    """The decode was refused; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, detail: str, status_code: int, retry_after: Optional[int] = None) -> None:
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def too_large(width: int | None = None, height: int | None = None) -> DecodeRejected:
+    DECODE_REJECTED.inc(reason="too_large")
+    size = f" ({width}x{height})" if width and height else ""
+    return DecodeRejected(f"image{size} is over the {settings.max_input_pixels} pixel limit", status_code=413)
+
+
+def estimate_bytes(meta: Optional[imgmeta.ImageMeta]) -> int:
+    """Estimated peak memory of decoding and resizing an image; raises DecodeRejected if over the pixel limit."""
+    if meta is None:
+        return UNKNOWN_ESTIMATE
+    pixels = meta.width * meta.height
+    if pixels > settings.max_input_pixels:
+        raise too_large(meta.width, meta.height)
+    return pixels * _BYTES_PER_PIXEL.get(meta.format, 4) * _PEAK_FACTOR
+
+
+async def read_meta(
+    db: aiosqlite.Connection, album_id: int, album_type: str, album_path: str, entry_path: Optional[str]
+) -> Optional[imgmeta.ImageMeta]:
+    """Header dimensions of an entry: from `entries` when recorded, else probed."""
+    if not entry_path:
+        return None
+    async with db.execute(
+        "SELECT width, height, format FROM entries WHERE album_id=? AND name=?", (album_id, entry_path)
+    ) as cur:
+        row = await cur.fetchone()
+    if row and row[0] is not None:
+        return imgmeta.ImageMeta(*row)
+    # probing disabled at scan time, or an album scanned before entries existed
+    [(_, meta)] = await afs.run_io(probe_entries, album_type, album_path, [entry_path])
+    return meta
+
+
+class MemoryBudget:
+    def __init__(self, limit: Callable[[], int]) -> None:
+        self._limit = limit
+        self.in_use = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    def _fits(self, nbytes: int) -> bool:
+        # a decode bigger than the whole budget still runs, but only alone
+        return self.in_use == 0 or self.in_use + nbytes <= self._limit()
+
+    def _take(self, nbytes: int) -> None:
+        self.in_use += nbytes
+        DECODE_MEMORY_BYTES.set(self.in_use)
+
+    def _release(self, nbytes: int) -> None:
+        self.in_use -= nbytes
+        DECODE_MEMORY_BYTES.set(self.in_use)
+        self.wake()
+
+    def wake(self) -> None:
+        """Admit queued decodes that fit now (after a release or a budget change)."""
+        while self._waiters:
+            nbytes, fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(nbytes):
+                # strict FIFO: a large decode at the head is not starved by small ones
+                break
+            self._waiters.popleft()
+            self._take(nbytes)
+            fut.set_result(None)
+
+    @asynccontextmanager
+    async def reserve(self, nbytes: int, timeout: float) -> AsyncIterator[None]:
+        if not self._waiters and self._fits(nbytes):
+            self._take(nbytes)
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            entry = (nbytes, fut)
+            self._waiters.append(entry)
+            DECODE_WAITING.inc()
+            try:
+                await asyncio.wait_for(asyncio.shield(fut), timeout)
+            except BaseException as e:
+                if fut.done() and not fut.cancelled():
+                    # admitted just as we gave up
+                    self._release(nbytes)
+                else:
+                    fut.cancel()
+                    try:
+                        self._waiters.remove(entry)
+                    except ValueError:
+                        pass
+                    # our slot at the head may have been blocking smaller decodes
+                    self.wake()
+                if isinstance(e, asyncio.TimeoutError):
+                    DECODE_REJECTED.inc(reason="timeout")
+                    raise DecodeRejected(
+                        "too many large images are being decoded, retry shortly",
+                        status_code=503,
+                        retry_after=1,
+                    ) from None
+                raise
+            finally:
+                DECODE_WAITING.dec()
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+
+budget = MemoryBudget(lambda: settings.decode_memory_budget)
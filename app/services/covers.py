@@ -0,0 +1,131 @@
+"""Uploaded (external) album covers.
+
+An upload is streamed to `cache/covers/<sha256>.<ext>` in chunks, so equal
+images share one file and names never collide between albums. The original
+is only a source: right after the upload the standard sizes are rendered
+through the thumbnail pipeline and registered in `thumbs`, and
+`GET /albums/{id}/cover` serves those like any other thumbnail.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import uuid
+from typing import BinaryIO, Optional
+
+import aiosqlite
+from fastapi import UploadFile
+
+from ..settings import settings
+from ..utils import afs
+from ..utils.fs import IMAGE_EXTS
+from . import thumbstore
+from .thumbnails import entry_tag, get_or_create_thumb, standard_sizes
+
+COVERS_DIR = os.path.abspath(os.path.join("cache", "covers"))
+# bytes read from the upload and written per step
+UPLOAD_CHUNK = 1024 * 1024
+
+
+def is_uploaded(path: Optional[str]) -> bool:
+    """True for a cover_path that points at an uploaded cover."""
+    return bool(path) and os.path.dirname(os.path.abspath(path)) == COVERS_DIR
+
+
+def source_args(path: str) -> dict:
+    """get_or_create_thumb() arguments that render from the uploaded original."""
+    return {"album_type": "folder", "album_path": COVERS_DIR, "entry_path": os.path.basename(path)}
+
+
+def _open_tmp() -> tuple[str, BinaryIO]:
+    os.makedirs(COVERS_DIR, exist_ok=True)
+    tmp = os.path.join(COVERS_DIR, f".upload-{uuid.uuid4().hex}.tmp")
+    return tmp, open(tmp, "wb")
+
+
+def _finish(f: BinaryIO, tmp: str, path: str) -> None:
+    f.close()
+    if os.path.exists(path):
+        # same content uploaded before
+        os.remove(tmp)
+    else:
+        os.replace(tmp, path)
+
+
+def _abort(f: BinaryIO, tmp: str) -> None:
+    f.close()
+    try:
+        os.remove(tmp)
+    except OSError:
+        pass
+
+
+async def save_upload(file: UploadFile) -> str:
+    """Stream `file` to disk under its content hash; returns the absolute path.
+
+    Raises ValueError for names without an image extension.
+    """
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    if ext.lstrip(".") not in IMAGE_EXTS:
+        raise ValueError(f"unsupported cover type: {file.filename!r}")
+    if ext == ".jpeg":
+        ext = ".jpg"
+    digest = hashlib.sha256()
+    tmp, f = await afs.run_io(_open_tmp)
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            await afs.run_io(f.write, chunk)
+    except BaseException:
+        await afs.run_io(_abort, f, tmp)
+        raise
+    path = os.path.join(COVERS_DIR, digest.hexdigest() + ext)
+    try:
+        await afs.run_io(_finish, f, tmp, path)
+    finally:
+        afs.invalidate(path)
+    return path
+
+
+async def render(db: aiosqlite.Connection, album_id: int, path: str) -> int:
+    """Render and register every standard size of an uploaded cover; returns how many."""
+    sizes = standard_sizes()
+    for w, h in sizes:
+        # in pyramid mode the first call renders all sizes, the rest are hits
+        await get_or_create_thumb(
+            db, album_id=album_id, w=w, h=h, fit="cover", fmt=settings.encode_format, **source_args(path)
+        )
+    return len(sizes)
+
+
+async def forget(db: aiosqlite.Connection, album_id: int, path: Optional[str]) -> None:
+    """Drop the thumbnails `album_id` rendered from an uploaded cover it no longer uses."""
+    if not is_uploaded(path):
+        return
+    # thumb keys start with "<album_id>_<entry tag>_"; the entry is the original's file name
+    prefix = f"{album_id}_{entry_tag(os.path.basename(path))}_"
+    async with db.execute(
+        "SELECT id, file_path, pack_offset, bytes FROM thumbs WHERE album_id=? AND substr(key, 1, ?)=?",
+        (album_id, len(prefix), prefix),
+    ) as cur:
+        rows = await cur.fetchall()
+    if not rows:
+        return
+    await db.executemany("DELETE FROM thumbs WHERE id=?", [(r[0],) for r in rows])
+    await db.commit()
+    await thumbstore.discard([thumbstore.ref_from_row(*r[1:]) for r in rows])
+
+
+async def release(db: aiosqlite.Connection, paths) -> None:
+    """Remove uploaded originals no album uses any more."""
+    for path in {p for p in paths if is_uploaded(p)}:
+        async with db.execute("SELECT 1 FROM albums WHERE cover_path=? LIMIT 1", (path,)) as cur:
+            if await cur.fetchone():
+                # the same image is the cover of another album
+                continue
+        try:
+            await afs.remove(path)
+        except OSError:
+            pass
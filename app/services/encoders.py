@@ -0,0 +1,202 @@
+from __future__ import annotations
+import functools
+import io
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+
+from ..settings import settings
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+@dataclass
+class Encoder:
+    """One output format: how to save it and how to advertise it."""
+
+    name: str
+    media_type: str
+    pil_format: str
+    params: Callable[[int], Dict[str, Any]]
+    # formats every browser decodes may be picked for `*/*` / `image/*` clients
+    universal: bool = False
+    modes: tuple[str, ...] = ("RGB", "RGBA", "L")
+    available: Callable[[], bool] = field(default=lambda: True)
+
+    def save(self, img: Image.Image, fp: Any, quality: int) -> None:
+        if img.mode not in self.modes:
+            img = img.convert("RGBA" if "RGBA" in self.modes and "A" in img.getbands() else "RGB")
+        img.save(fp, format=self.pil_format, **self.params(quality))
+
+
+@functools.lru_cache(maxsize=None)
+def _avif_available() -> bool:
+    from PIL import features
+
+    try:
+        if features.check("avif"):
+            return True
+    except Exception:
+        pass
+    try:
+        import pillow_avif  # noqa: F401  (registers the AVIF plugin)
+        return True
+    except ImportError:
+        return False
+
+
+_encoders: Dict[str, Encoder] = {}
+
+
+def register_encoder(encoder: Encoder) -> None:
+    _encoders[encoder.name] = encoder
+
+
+register_encoder(Encoder(
+    name="webp",
+    media_type="image/webp",
+    pil_format="WEBP",
+    # method: 0 = fastest .. 6 = smallest
+    params=lambda q: {"quality": q, "method": settings.webp_method},
+))
+register_encoder(Encoder(
+    name="jpeg",
+    media_type="image/jpeg",
+    pil_format="JPEG",
+    params=lambda q: {"quality": q, "progressive": True, "optimize": True},
+    universal=True,
+    modes=("RGB", "L"),
+))
+register_encoder(Encoder(
+    name="png",
+    media_type="image/png",
+    pil_format="PNG",
+    params=lambda q: {"optimize": True},
+    universal=True,
+))
+register_encoder(Encoder(
+    name="avif",
+    media_type="image/avif",
+    pil_format="AVIF",
+    # speed: 0 = slowest/smallest .. 10 = fastest
+    params=lambda q: {"quality": q, "speed": settings.avif_speed},
+    available=_avif_available,
+))
+
+_ALIASES = {"jpg": "jpeg"}
+
+
+def get_encoder(name: Optional[str]) -> Optional[Encoder]:
+    """Return the named encoder if it exists and works in this build."""
+    if not name:
+        return None
+    enc = _encoders.get(_ALIASES.get(name.lower(), name.lower()))
+    if enc is None or not enc.available():
+        return None
+    return enc
+
+
+def _parse_accept(accept: str) -> Dict[str, float]:
+    prefs: Dict[str, float] = {}
+    for part in accept.split(","):
+        bits = [b.strip() for b in part.split(";")]
+        if not bits[0]:
+            continue
+        q = 1.0
+        for b in bits[1:]:
+            if b.startswith("q="):
+                try:
+                    q = float(b[2:])
+                except ValueError:
+                    q = 0.0
+        prefs[bits[0].lower()] = q
+    return prefs
+
+
+def negotiate(accept: Optional[str], requested: Optional[str] = None) -> Encoder:
+    """Pick an output encoder.
+
+    An explicit, available `requested` format always wins. Otherwise try the
+    configured `encode_format`, then webp, then jpeg, taking the first the
+    client accepts. Browsers list the modern formats they decode explicitly,
+    so webp/avif are only chosen via wildcard when no Accept header is sent.
+    """
+    enc = get_encoder(requested)
+    if enc is not None:
+        return enc
+    prefs = _parse_accept(accept) if accept else {}
+    order = [settings.encode_format, "webp", "jpeg"]
+    for name in order:
+        enc = get_encoder(name)
+        if enc is None:
+            continue
+        if not prefs:
+            return enc
+        q = prefs.get(enc.media_type)
+        if q is None and enc.universal:
+            q = prefs.get("image/*", prefs.get("*/*"))
+        if q:
+            return enc
+    return _encoders["jpeg"]
+
+
+class _EncodeStats:
+    """Thread-safe per-format counters of encode time and output size."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, float]] = {}
+
+    def record(self, fmt: str, seconds: float, nbytes: int, pixels: int) -> None:
+        with self._lock:
+            d = self._data.setdefault(fmt, {"count": 0, "seconds": 0.0, "bytes": 0, "pixels": 0})
+            d["count"] += 1
+            d["seconds"] += seconds
+            d["bytes"] += nbytes
+            d["pixels"] += pixels
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            out = {}
+            for fmt, d in self._data.items():
+                count = d["count"] or 1
+                out[fmt] = {
+                    **d,
+                    "avg_ms": round(d["seconds"] * 1000 / count, 3),
+                    "avg_bytes": round(d["bytes"] / count, 1),
+                    # bytes per output pixel: lower means better compression
+                    "bytes_per_pixel": round(d["bytes"] / d["pixels"], 4) if d["pixels"] else None,
+                }
+            return out
+
+
+encode_stats = _EncodeStats()
+
+
+def encode_to_file(enc: Encoder, img: Image.Image, path: str, quality: int) -> int:
+    """Encode `img` into `path`, record timing/size stats and return the byte size."""
+    start = time.perf_counter()
+    with open(path, "wb") as f:
+        enc.save(img, f, quality)
+        nbytes = f.tell()
+    encode_stats.record(enc.name, time.perf_counter() - start, nbytes, img.width * img.height)
+    return nbytes
+
+
+def encode_to_bytes(enc: Encoder, img: Image.Image, quality: int) -> bytes:
+    """Like encode_to_file, for stores that keep the encoded bytes themselves."""
+    start = time.perf_counter()
+    buf = io.BytesIO()
+    enc.save(img, buf, quality)
+    data = buf.getvalue()
+    encode_stats.record(enc.name, time.perf_counter() - start, len(data), img.width * img.height)
+    return data
+
+
+def list_encoders() -> list[dict]:
+    return [
+        {"name": e.name, "media_type": e.media_type, "available": e.available()}
+        for e in _encoders.values()
+    ]
@@ -1,37 +1,37 @@
 from __future__ import annotations
 import os
-import zipfile
-from typing import List
+from typing import Iterable, List, Optional, Tuple
 
 import aiosqlite
-from natsort import natsorted, ns
 
+from ..utils import afs, archives, imgmeta
 from ..utils.fs import is_image_name
+from ..utils.zipscan import natural_sort_key
 
 
 async def _read_album(db: aiosqlite.Connection, album_id: int):
-    async with db.execute("SELECT id, type, path FROM albums WHERE id=?", (album_id,)) as cur:
+    async with db.execute("SELECT id, type, path, first_entry FROM albums WHERE id=?", (album_id,)) as cur:
         row = await cur.fetchone()
         if not row:
             return None
-        return {"id": row[0], "type": row[1], "path": row[2]}
+        return {"id": row[0], "type": row[1], "path": row[2], "first_entry": row[3]}
 
 
 def _list_album_images(album: dict) -> List[str]:
-    """List image entry paths for an album without persisting to DB.
+    """List image entry paths for an album straight from disk.
 
     For folder albums: return file names under the folder (non-recursive).
-    For zip albums: return inner entry names (paths inside zip).
-    Returns a naturally-sorted list.
+    For archive albums: return inner entry names (paths inside the archive).
+    Returns a naturally-sorted list. Only used for albums whose entries
+    were never recorded; normally pages come from the `entries` table.
     """
     images: List[str] = []
     if not album:
         return images
-    if album["type"] == "zip":
+    if album["type"] != "folder":
+        provider = archives.provider_for_kind(album["type"])
         try:
-            with zipfile.ZipFile(album["path"], 'r') as zf:
-                names = [i.filename for i in zf.infolist() if (not i.is_dir()) and is_image_name(i.filename)]
-                images = natsorted(names, alg=ns.IGNORECASE)
+            images = archives.image_names(provider, album["path"]) if provider else []
         except Exception:
             images = []
     else:
@@ -39,24 +39,124 @@ def _list_album_images(album: dict) -> List[str]:
             for name in os.listdir(album["path"]):
                 if is_image_name(name):
                     images.append(name)
-            images = natsorted(images, alg=ns.IGNORECASE)
         except Exception:
             images = []
-    return images
+    return sorted(images, key=natural_sort_key)
+
+
+# (name, header metadata or None when not probed / unreadable)
+EntryRow = Tuple[str, Optional[imgmeta.ImageMeta]]
+
+
+def read_album_entries(album_type: str, path: str, names: List[str], probe: bool = True) -> List[EntryRow]:
+    """Pair each image name with width/height/format read from its header only.
+
+    Archives are probed in a single pass. Runs in a worker thread; raises
+    archives.ArchiveError / OSError when the album itself cannot be read.
+    """
+    if not probe:
+        return [(name, None) for name in names]
+    if album_type == "folder":
+        return probe_entries(album_type, path, names)
+    provider = archives.provider_for_kind(album_type)
+    found = dict(archives.probe_images(provider, path, imgmeta.probe)) if provider else {}
+    return [(name, found.get(name)) for name in names]
+
+
+def probe_entries(album_type: str, path: str, names: Iterable[str]) -> List[EntryRow]:
+    """Probe the headers of just `names` (one page); unreadable entries get None."""
+    out: List[EntryRow] = []
+    provider = None if album_type == "folder" else archives.provider_for_kind(album_type)
+    if album_type != "folder" and provider is None:
+        # the archive's backend is not installed
+        return [(name, None) for name in names]
+    for name in names:
+        try:
+            if provider is None:
+                f = open(os.path.join(path, name), "rb")
+            else:
+                f = archives.open_member(provider, path, name)
+            with f:
+                meta = imgmeta.probe(f)
+        except (KeyError, OSError, archives.ArchiveError):
+            meta = None
+        out.append((name, meta))
+    return out
+
+
+async def save_entries(db: aiosqlite.Connection, album_id: int, rows: List[EntryRow], replace: bool = False) -> None:
+    """Record entries with their natural sort key; `replace` drops the album's old rows. No commit."""
+    if replace:
+        await db.execute("DELETE FROM entries WHERE album_id=?", (album_id,))
+    await db.executemany(
+        """
+        INSERT INTO entries(album_id, name, sort_key, width, height, format) VALUES(?,?,?,?,?,?)
+        ON CONFLICT(album_id, name) DO UPDATE SET
+          width=excluded.width,
+          height=excluded.height,
+          format=excluded.format
+        """,
+        [(album_id, name, natural_sort_key(name), *(meta or (None, None, None))) for name, meta in rows],
+    )
 
 
 async def list_entries(db: aiosqlite.Connection, album_id: int, page: int, per_page: int):
+    """A page of naturally-sorted entry names plus their header metadata.
+
+    The page is an indexed range of `entries` in sort_key order. `meta[i]`
+    is {width, height, format} for `items[i]`, or None when the image
+    header could not be read. `placeholders[i]` is a tiny data: URI preview,
+    or None until the entry's thumbnail has been rendered once.
+    """
     album = await _read_album(db, album_id)
-    images = _list_album_images(album)
-    total = len(images)
+    empty = {"total": 0, "items": [], "meta": [], "placeholders": [], "page": page, "per_page": per_page}
+    if not album:
+        return empty
+    async with db.execute("SELECT COUNT(*) FROM entries WHERE album_id=?", (album_id,)) as cur:
+        (total,) = await cur.fetchone()
     if total == 0:
-        return {"total": 0, "items": [], "page": page, "per_page": per_page}
+        # scanned before entries were recorded: list from disk once and keep it
+        images = await afs.run_io(_list_album_images, album)
+        if not images:
+            return empty
+        await save_entries(db, album_id, [(name, None) for name in images])
+        await db.commit()
+        total = len(images)
     offset = (max(1, page) - 1) * max(1, per_page)
-    items = images[offset : offset + per_page]
-    return {"total": total, "items": items, "page": page, "per_page": per_page}
+    async with db.execute(
+        "SELECT name, width, height, format, placeholder FROM entries WHERE album_id=?"
+        " ORDER BY sort_key, name LIMIT ? OFFSET ?",
+        (album_id, per_page, offset),
+    ) as cur:
+        rows = await cur.fetchall()
+    items = [row[0] for row in rows]
+    placeholders = [row[4] for row in rows]
+    known = {name: (w, h, fmt) for name, w, h, fmt, _ in rows if w is not None}
+    missing = [name for name in items if name not in known]
+    if missing:
+        # probing disabled at scan time, or formats skipped by the scan pass
+        probed = [(n, m) for n, m in await afs.run_io(probe_entries, album["type"], album["path"], missing) if m]
+        if probed:
+            await save_entries(db, album_id, probed)
+            await db.commit()
+            known.update((name, tuple(meta)) for name, meta in probed)
+    meta = [
+        {"width": known[name][0], "height": known[name][1], "format": known[name][2]} if name in known else None
+        for name in items
+    ]
+    return {"total": total, "items": items, "meta": meta, "placeholders": placeholders, "page": page, "per_page": per_page}
 
 
 async def first_entry(db: aiosqlite.Connection, album_id: int) -> str | None:
     album = await _read_album(db, album_id)
-    images = _list_album_images(album)
+    # recorded at scan time, so covers don't need to list and sort the album
+    if album and album["first_entry"]:
+        return album["first_entry"]
+    async with db.execute(
+        "SELECT name FROM entries WHERE album_id=? ORDER BY sort_key, name LIMIT 1", (album_id,)
+    ) as cur:
+        row = await cur.fetchone()
+    if row:
+        return row[0]
+    images = await afs.run_io(_list_album_images, album)
     return images[0] if images else None
@@ -0,0 +1,91 @@
+"""Cross-process event fan-out through the SQLite `event_log` table.
+
+In multi-worker mode every process bridges its EventBus: published events go
+to an outbox, this task appends them to `event_log`, and every process
+(including the publisher) delivers rows back to its own SSE subscribers in
+id order. Event ids are the log's row ids, so a client that reconnects to a
+different worker resumes with a consistent Last-Event-ID.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import time
+import traceback
+
+import aiosqlite
+
+from ..db import open_db
+from ..utils.events import EventBus
+
+POLL_INTERVAL = 0.1
+# rows older than this are pruned; reconnecting clients further behind resync
+RETENTION_SECONDS = 120.0
+PRUNE_INTERVAL = 10.0
+_FETCH_LIMIT = 1000
+
+
+class EventLogBridge:
+    def __init__(self, bus: EventBus) -> None:
+        self.bus = bus
+        self._task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        async with open_db() as db:
+            async with db.execute("SELECT COALESCE(MAX(id), 0) FROM event_log") as cur:
+                (last_id,) = await cur.fetchone()
+        # history from before this process started is not replayed
+        self.bus.bridge(last_id)
+        self._task = asyncio.create_task(self._run(last_id))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        pending = self.bus.unbridge()
+        if pending:
+            async with open_db() as db:
+                await self._append(db, pending)
+
+    async def _append(self, db: aiosqlite.Connection, pending: list) -> None:
+        now = time.time()
+        await db.executemany(
+            "INSERT INTO event_log(event, data, created_at) VALUES(?, ?, ?)",
+            [(event, json.dumps(data, ensure_ascii=False), now) for event, data in pending],
+        )
+        await db.commit()
+
+    async def _run(self, last_id: int) -> None:
+        last_prune = 0.0
+        async with open_db() as db:
+            while True:
+                pending = self.bus.drain_outbox()
+                if pending:
+                    try:
+                        await self._append(db, pending)
+                    except aiosqlite.OperationalError:
+                        # another worker holds the write lock; retry on the next tick
+                        await db.rollback()
+                        self.bus.requeue(pending)
+                try:
+                    async with db.execute(
+                        "SELECT id, event, data FROM event_log WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, _FETCH_LIMIT),
+                    ) as cur:
+                        rows = await cur.fetchall()
+                    for row_id, event, data in rows:
+                        last_id = row_id
+                        self.bus.deliver(row_id, event, json.loads(data))
+                    now = time.time()
+                    if now - last_prune >= PRUNE_INTERVAL:
+                        last_prune = now
+                        await db.execute("DELETE FROM event_log WHERE created_at < ?", (now - RETENTION_SECONDS,))
+                        await db.commit()
+                    if len(rows) == _FETCH_LIMIT:
+                        continue
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    traceback.print_exc()
+                await asyncio.sleep(POLL_INTERVAL)
@@ -0,0 +1,436 @@
+from __future__ import annotations
+import asyncio
+import json
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+import aiosqlite
+
+from ..db import open_db
+from ..utils.events import events
+from . import leases, thumbstore
+from .refresh import refresh_library
+from .scanner import ScanOptions, scan_paths
+from .thumbnails import lru_cleanup, migrate_cache_dir
+
+TERMINAL_STATUSES = ("done", "failed", "cancelled")
+# idle workers re-check the table at this interval even without a wakeup, so
+# retries whose backoff expired and jobs enqueued by other processes get picked up
+POLL_INTERVAL = 1.0
+# progress rows are persisted at most this often; events are published every time
+PROGRESS_PERSIST_INTERVAL = 1.0
+MAX_RETRY_DELAY = 60
+# multi-worker mode: the process holding this lease runs the job workers; it
+# renews every LEADER_TTL/3 seconds and another process takes over on expiry
+LEADER_LEASE = "jobs:leader"
+LEADER_TTL = 15.0
+# a running job holds "job:<id>", renewed with the leader lease; recovery
+# leaves jobs alone while another process may still be running them
+JOB_LEASE = "job:{}"
+
+_JOB_COLUMNS = (
+    "id, kind, payload, status, priority, attempts, max_attempts, progress, result, error,"
+    " cancel_requested, created_at, started_at, finished_at"
+)
+
+
+@dataclass
+class JobContext:
+    """Handed to job handlers: the job's payload plus a private DB connection."""
+
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempt: int
+    db: aiosqlite.Connection
+    _last_persist: float = 0.0
+
+    async def progress(self, data: Dict[str, Any]) -> None:
+        """Report progress: publishes `job:progress` and periodically stores it.
+
+        Persisting goes through the handler's own connection and commits, so
+        work done so far survives a crash and is skipped when the job resumes.
+        """
+        events.publish("job:progress", {"job_id": self.id, "kind": self.kind, "progress": data})
+        now = time.monotonic()
+        if now - self._last_persist < PROGRESS_PERSIST_INTERVAL:
+            return
+        self._last_persist = now
+        await self.db.execute("UPDATE jobs SET progress=? WHERE id=?", (json.dumps(data), self.id))
+        await self.db.commit()
+
+
+JobHandler = Callable[[JobContext], Awaitable[Dict[str, Any] | None]]
+
+
+def _row_to_job(row) -> dict:
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "payload": json.loads(row[2]) if row[2] else {},
+        "status": row[3],
+        "priority": row[4],
+        "attempts": row[5],
+        "max_attempts": row[6],
+        "progress": json.loads(row[7]) if row[7] else None,
+        "result": json.loads(row[8]) if row[8] else None,
+        "error": row[9],
+        "cancel_requested": bool(row[10]),
+        "created_at": row[11],
+        "started_at": row[12],
+        "finished_at": row[13],
+    }
+
+
+class JobQueue:
+    """Persistent job queue backed by the `jobs` table.
+
+    Jobs are claimed by priority (higher first) then FIFO. Jobs still marked
+    `running` at startup belong to a crashed process and are re-queued.
+    Failed jobs are retried with exponential backoff until `max_attempts`.
+    With several server processes, only the holder of the leader lease runs
+    workers; the others just enqueue, and recovery happens on takeover.
+    """
+
+    def __init__(self) -> None:
+        self._handlers: Dict[str, tuple[JobHandler, int]] = {}
+        self._workers: list[asyncio.Task] = []
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup: asyncio.Event | None = None
+        self._stopping = False
+        self._worker_count = 1
+        self._leader: asyncio.Task | None = None
+        # monotonic time the leader lease was last renewed for (see _lease_fresh)
+        self._lease_deadline = 0.0
+
+    def register(self, kind: str, handler: JobHandler, *, max_attempts: int = 3) -> None:
+        self._handlers[kind] = (handler, max_attempts)
+
+    def kinds(self) -> list[str]:
+        return sorted(self._handlers)
+
+    async def start(self, workers: int = 1) -> None:
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._worker_count = max(1, workers)
+        if leases.multi_worker():
+            # several server processes share the queue: only the lease holder runs jobs
+            self._leader = asyncio.create_task(self._lead())
+            return
+        async with open_db() as db:
+            await self._recover(db)
+        self._spawn_workers()
+
+    async def stop(self) -> None:
+        if self._leader is not None:
+            self._leader.cancel()
+            await asyncio.gather(self._leader, return_exceptions=True)
+            self._leader = None
+        await self._stop_workers()
+        if leases.multi_worker():
+            try:
+                async with open_db() as db:
+                    await leases.release(db, LEADER_LEASE)
+            except aiosqlite.Error:
+                pass
+
+    async def _orphaned(self, db: aiosqlite.Connection) -> list[int]:
+        """Jobs marked running that no live process is working on."""
+        async with db.execute("SELECT id, started_at FROM jobs WHERE status='running'") as cur:
+            rows = await cur.fetchall()
+        if not leases.multi_worker():
+            return [job_id for job_id, _ in rows]
+        orphaned = []
+        for job_id, started_at in rows:
+            # just claimed: its worker may not have taken the job lease yet
+            if job_id in self._running or (started_at or 0) > time.time() - LEADER_TTL:
+                continue
+            # the previous leader may still be winding the job down
+            if await leases.holder(db, JOB_LEASE.format(job_id)) is None:
+                orphaned.append(job_id)
+        return orphaned
+
+    async def _recover(self, db: aiosqlite.Connection) -> None:
+        # crash recovery: whatever was running when the previous owner died
+        ids = await self._orphaned(db)
+        if not ids:
+            return
+        marks = ",".join("?" * len(ids))
+        await db.execute(
+            f"UPDATE jobs SET status='cancelled', finished_at=? WHERE id IN ({marks}) AND cancel_requested=1",
+            (int(time.time()), *ids),
+        )
+        await db.execute(
+            f"UPDATE jobs SET status='queued', started_at=NULL WHERE id IN ({marks}) AND status='running'", ids
+        )
+        await db.commit()
+
+    def _spawn_workers(self) -> None:
+        for _ in range(self._worker_count):
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def _stop_workers(self) -> None:
+        self._stopping = True
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._stopping = False
+
+    def _lease_fresh(self) -> bool:
+        """False once the leader lease is close to expiring without a renewal.
+
+        Workers stop claiming jobs, and the leader stops them, a third of the
+        TTL early, so they have wound down before another process can take over.
+        """
+        return not leases.multi_worker() or time.monotonic() < self._lease_deadline - LEADER_TTL / 3
+
+    async def _lead(self) -> None:
+        """Hold the leader lease while running workers; hand over if it is lost."""
+        async with open_db() as db:
+            while True:
+                renewing = time.monotonic()
+                try:
+                    held = await leases.acquire(db, LEADER_LEASE, LEADER_TTL)
+                    if held:
+                        for job_id in list(self._running):
+                            await leases.acquire(db, JOB_LEASE.format(job_id), LEADER_TTL)
+                except aiosqlite.OperationalError:
+                    await db.rollback()
+                    # busy database: keep the current role while the last renewal is still good
+                    held = bool(self._workers) and self._lease_fresh()
+                else:
+                    if held:
+                        self._lease_deadline = renewing + LEADER_TTL
+                if not held and self._workers:
+                    await self._stop_workers()
+                if held:
+                    try:
+                        # jobs of a previous leader (or a crashed one), once their own leases ran out
+                        await self._recover(db)
+                        await self._cancel_requested(db)
+                    except aiosqlite.OperationalError:
+                        await db.rollback()
+                    if not self._workers:
+                        self._spawn_workers()
+                await asyncio.sleep(LEADER_TTL / 3)
+
+    async def _cancel_requested(self, db: aiosqlite.Connection) -> None:
+        """Interrupt running jobs whose cancel was requested through another process."""
+        if not self._running:
+            return
+        async with db.execute("SELECT id FROM jobs WHERE status='running' AND cancel_requested=1") as cur:
+            rows = await cur.fetchall()
+        for (job_id,) in rows:
+            task = self._running.get(job_id)
+            if task:
+                task.cancel()
+
+    def _wake(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def enqueue(
+        self,
+        db: aiosqlite.Connection,
+        kind: str,
+        payload: Dict[str, Any] | None = None,
+        *,
+        priority: int = 0,
+        max_attempts: int | None = None,
+    ) -> int:
+        if kind not in self._handlers:
+            raise ValueError(f"unknown job kind: {kind}")
+        attempts = max_attempts if max_attempts is not None else self._handlers[kind][1]
+        async with db.execute(
+            """
+            INSERT INTO jobs(kind, payload, status, priority, max_attempts, created_at)
+            VALUES(?, ?, 'queued', ?, ?, ?)
+            """,
+            (kind, json.dumps(payload or {}), priority, max(1, attempts), int(time.time())),
+        ) as cur:
+            job_id = cur.lastrowid
+        await db.commit()
+        events.publish("job:update", {"job_id": job_id, "kind": kind, "status": "queued"})
+        self._wake()
+        return job_id
+
+    async def get(self, db: aiosqlite.Connection, job_id: int) -> dict | None:
+        async with db.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE id=?", (job_id,)) as cur:
+            row = await cur.fetchone()
+        return _row_to_job(row) if row else None
+
+    async def list_jobs(self, db: aiosqlite.Connection, status: str | None = None, limit: int = 50) -> list[dict]:
+        sql = f"SELECT {_JOB_COLUMNS} FROM jobs"
+        params: tuple = ()
+        if status:
+            sql += " WHERE status=?"
+            params = (status,)
+        sql += " ORDER BY id DESC LIMIT ?"
+        async with db.execute(sql, (*params, limit)) as cur:
+            rows = await cur.fetchall()
+        return [_row_to_job(r) for r in rows]
+
+    async def cancel(self, db: aiosqlite.Connection, job_id: int) -> dict | None:
+        """Cancel a job. Queued jobs stop immediately; running jobs are interrupted."""
+        job = await self.get(db, job_id)
+        if not job or job["status"] in TERMINAL_STATUSES:
+            return job
+        now = int(time.time())
+        await db.execute(
+            "UPDATE jobs SET status='cancelled', finished_at=? WHERE id=? AND status='queued'",
+            (now, job_id),
+        )
+        await db.execute("UPDATE jobs SET cancel_requested=1 WHERE id=? AND status='running'", (job_id,))
+        await db.commit()
+        task = self._running.get(job_id)
+        if task:
+            task.cancel()
+        elif job["status"] == "queued":
+            # a job running in another worker process is interrupted by the leader
+            events.publish("job:update", {"job_id": job_id, "kind": job["kind"], "status": "cancelled"})
+        return await self.get(db, job_id)
+
+    async def _claim(self, db: aiosqlite.Connection) -> tuple | None:
+        now = int(time.time())
+        async with db.execute(
+            """
+            UPDATE jobs SET status='running', attempts=attempts+1, started_at=?, error=NULL
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE status='queued' AND run_after <= ?
+                ORDER BY priority DESC, id
+                LIMIT 1
+            )
+            RETURNING id, kind, payload, attempts, max_attempts
+            """,
+            (now, now),
+        ) as cur:
+            row = await cur.fetchone()
+        await db.commit()
+        return row
+
+    async def _worker(self) -> None:
+        assert self._wakeup is not None
+        async with open_db() as db:
+            while True:
+                self._wakeup.clear()
+                try:
+                    # an unrenewed leader lease: leave new jobs to whoever takes over
+                    row = await self._claim(db) if self._lease_fresh() else None
+                except aiosqlite.OperationalError:
+                    # database busy (e.g. another writer); try again on the next tick
+                    row = None
+                if row is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(db, *row)
+
+    async def _finish(self, db: aiosqlite.Connection, job_id: int, kind: str, status: str, **fields: Any) -> None:
+        sets = ["status=?", "finished_at=?"]
+        params: list[Any] = [status, int(time.time())]
+        for col, value in fields.items():
+            sets.append(f"{col}=?")
+            params.append(value)
+        params.append(job_id)
+        await db.execute(f"UPDATE jobs SET {', '.join(sets)} WHERE id=?", tuple(params))
+        await db.commit()
+        payload = {"job_id": job_id, "kind": kind, "status": status}
+        if "error" in fields:
+            payload["error"] = fields["error"]
+        events.publish("job:update", payload)
+
+    async def _run(
+        self, db: aiosqlite.Connection, job_id: int, kind: str, payload: str, attempt: int, max_attempts: int
+    ) -> None:
+        events.publish("job:update", {"job_id": job_id, "kind": kind, "status": "running", "attempt": attempt})
+        entry = self._handlers.get(kind)
+        if entry is None:
+            await self._finish(db, job_id, kind, "failed", error=f"unknown job kind: {kind}")
+            return
+        handler, _ = entry
+        if leases.multi_worker():
+            # taken before the handler starts: it shares this connection's transaction
+            try:
+                await leases.acquire(db, JOB_LEASE.format(job_id), LEADER_TTL)
+            except aiosqlite.OperationalError:
+                # the leader renews it on its next tick
+                await db.rollback()
+        ctx = JobContext(id=job_id, kind=kind, payload=json.loads(payload or "{}"), attempt=attempt, db=db)
+        task = asyncio.create_task(handler(ctx))
+        self._running[job_id] = task
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            await db.rollback()
+            if self._stopping:
+                # graceful shutdown: hand the job back so the next start resumes it; unless
+                # a new leader has already recovered and reclaimed it (which bumps attempts)
+                await db.execute(
+                    "UPDATE jobs SET status='queued', attempts=attempts-1, started_at=NULL"
+                    " WHERE id=? AND status='running' AND attempts=?",
+                    (job_id, attempt),
+                )
+                await db.commit()
+                raise
+            await self._finish(db, job_id, kind, "cancelled")
+        except Exception as e:
+            await db.rollback()
+            error = f"{type(e).__name__}: {e}"
+            traceback.print_exc()
+            if attempt < max_attempts:
+                delay = min(MAX_RETRY_DELAY, 2 ** attempt)
+                await db.execute(
+                    "UPDATE jobs SET status='queued', error=?, run_after=? WHERE id=?",
+                    (error, int(time.time()) + delay, job_id),
+                )
+                await db.commit()
+                events.publish(
+                    "job:update",
+                    {"job_id": job_id, "kind": kind, "status": "queued", "error": error, "retry_in": delay},
+                )
+            else:
+                await self._finish(db, job_id, kind, "failed", error=error)
+        else:
+            await self._finish(db, job_id, kind, "done", result=json.dumps(result or {}))
+        finally:
+            self._running.pop(job_id, None)
+            if leases.multi_worker():
+                try:
+                    await leases.release(db, JOB_LEASE.format(job_id))
+                except aiosqlite.Error:
+                    # the lease expires on its own
+                    pass
+
+
+async def _scan_job(ctx: JobContext) -> dict:
+    paths = ctx.payload.get("paths") or []
+    recursive = bool(ctx.payload.get("recursive", False))
+    return await scan_paths(ctx.db, paths, ScanOptions(recursive=recursive), progress=ctx.progress)
+
+
+async def _refresh_job(ctx: JobContext) -> dict:
+    return await refresh_library(ctx.db, progress=ctx.progress)
+
+
+async def _cache_cleanup_job(ctx: JobContext) -> dict:
+    result = await lru_cleanup(ctx.db)
+    # evicted packed thumbnails only become reclaimable space here
+    result.update(await thumbstore.compact(ctx.db, progress=ctx.progress))
+    return result
+
+
+async def _cache_migrate_job(ctx: JobContext) -> dict:
+    return await migrate_cache_dir(ctx.db, ctx.payload["from"], ctx.payload["to"], progress=ctx.progress)
+
+
+jobs = JobQueue()
+jobs.register("scan", _scan_job)
+jobs.register("refresh", _refresh_job)
+jobs.register("cache_cleanup", _cache_cleanup_job)
+jobs.register("cache_migrate", _cache_migrate_job)
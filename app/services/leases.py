@@ -0,0 +1,52 @@
+"""Named, expiring locks in the `leases` table.
+
+Used in multi-worker mode (APP_WORKERS > 1) so that separate processes
+sharing one database never do the same work twice: a thumbnail key is
+rendered by one worker, and only one process runs background jobs. A lease
+whose owner died simply expires.
+"""
+from __future__ import annotations
+import os
+import socket
+import time
+import uuid
+
+import aiosqlite
+
+from ..settings import settings
+
+# unique per process (pids are reused across restarts)
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def multi_worker() -> bool:
+    return settings.workers > 1
+
+
+async def acquire(db: aiosqlite.Connection, name: str, ttl: float) -> bool:
+    """Take or renew `name` for `ttl` seconds; False if another live owner holds it."""
+    now = time.time()
+    async with db.execute(
+        """
+        INSERT INTO leases(name, owner, expires_at) VALUES(?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET owner=excluded.owner, expires_at=excluded.expires_at
+        WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+        """,
+        (name, OWNER, now + ttl, now),
+    ) as cur:
+        acquired = cur.rowcount > 0
+    await db.commit()
+    return acquired
+
+
+async def release(db: aiosqlite.Connection, name: str) -> None:
+    await db.execute("DELETE FROM leases WHERE name=? AND owner=?", (name, OWNER))
+    await db.commit()
+
+
+async def holder(db: aiosqlite.Connection, name: str) -> str | None:
+    async with db.execute(
+        "SELECT owner FROM leases WHERE name=? AND expires_at >= ?", (name, time.time())
+    ) as cur:
+        row = await cur.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,184 @@
+"""SQLite housekeeping in the background.
+
+- WAL: `wal_checkpoint(TRUNCATE)` once the -wal file passes
+  `settings.db_wal_checkpoint_bytes`. Constant thumbs upserts and
+  last_access updates otherwise grow it without bound, since a busy reader
+  keeps automatic checkpoints from ever resetting it.
+- Statistics: `ANALYZE` (bounded by analysis_limit) + `PRAGMA optimize`
+  after scans, so the planner sees the new table sizes.
+- Free pages: `incremental_vacuum` in small steps while no HTTP request
+  has arrived for IDLE_SECONDS (the database uses auto_vacuum=INCREMENTAL).
+
+Every process runs its own loop; the operations are safe to overlap, one
+of them simply gets SQLITE_BUSY and tries again on the next tick.
+"""
+from __future__ import annotations
+import asyncio
+import os
+import time
+from typing import Any, Dict, Iterable
+
+import aiosqlite
+
+from .. import db as app_db
+from ..db import open_db
+from ..settings import settings
+
+CHECK_INTERVAL = 30.0
+# no request for this long counts as idle
+IDLE_SECONDS = 120.0
+# pages freed per incremental_vacuum statement; each one holds the write lock briefly
+VACUUM_STEP_PAGES = 1024
+# fewer free pages than this are not worth a vacuum
+VACUUM_MIN_FREE_PAGES = 256
+# rows sampled per index by ANALYZE
+ANALYSIS_LIMIT = 1000
+TASKS = ("checkpoint", "analyze", "vacuum")
+
+_last_activity = time.monotonic()
+
+
+def touch() -> None:
+    """Record request activity (called by the HTTP middleware)."""
+    global _last_activity
+    _last_activity = time.monotonic()
+
+
+def idle() -> bool:
+    return time.monotonic() - _last_activity >= IDLE_SECONDS
+
+
+def _size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+async def _pragma(db: aiosqlite.Connection, name: str) -> Any:
+    async with db.execute(f"PRAGMA {name}") as cur:
+        row = await cur.fetchone()
+    return row[0] if row else None
+
+
+async def checkpoint(db: aiosqlite.Connection) -> Dict[str, Any]:
+    before = _size(app_db.DB_PATH + "-wal")
+    async with db.execute("PRAGMA wal_checkpoint(TRUNCATE)") as cur:
+        busy, log_frames, checkpointed = await cur.fetchone()
+    # busy: a reader or writer kept the WAL from being reset; retried next tick
+    return {
+        "busy": bool(busy),
+        "wal_bytes_before": before,
+        "wal_bytes": _size(app_db.DB_PATH + "-wal"),
+        "frames": log_frames,
+        "checkpointed": checkpointed,
+    }
+
+
+async def analyze(db: aiosqlite.Connection) -> Dict[str, Any]:
+    start = time.perf_counter()
+    await db.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    await db.execute("ANALYZE")
+    await db.execute("PRAGMA optimize")
+    await db.commit()
+    return {"seconds": round(time.perf_counter() - start, 3)}
+
+
+async def incremental_vacuum(db: aiosqlite.Connection, only_while_idle: bool = True) -> Dict[str, Any]:
+    """Return free pages to the filesystem a step at a time."""
+    free = await _pragma(db, "freelist_count") or 0
+    if await _pragma(db, "auto_vacuum") != 2 or free < (VACUUM_MIN_FREE_PAGES if only_while_idle else 1):
+        return {"freed_pages": 0, "free_pages": free}
+    freed = 0
+    while free > 0 and (idle() or not only_while_idle):
+        await db.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})")
+        await db.commit()
+        left = await _pragma(db, "freelist_count") or 0
+        if left >= free:
+            break
+        freed += free - left
+        free = left
+        # let requests that arrived meanwhile get the write lock
+        await asyncio.sleep(0)
+    return {"freed_pages": freed, "free_pages": free}
+
+
+async def stats(db: aiosqlite.Connection) -> Dict[str, Any]:
+    page_size = await _pragma(db, "page_size")
+    page_count = await _pragma(db, "page_count")
+    free = await _pragma(db, "freelist_count")
+    return {
+        "path": app_db.DB_PATH,
+        "db_bytes": _size(app_db.DB_PATH),
+        "wal_bytes": _size(app_db.DB_PATH + "-wal"),
+        "wal_checkpoint_bytes": settings.db_wal_checkpoint_bytes,
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_count": free,
+        "free_bytes": (free or 0) * (page_size or 0),
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(await _pragma(db, "auto_vacuum"), "unknown"),
+        "journal_mode": await _pragma(db, "journal_mode"),
+        "idle": idle(),
+    }
+
+
+class Maintenance:
+    def __init__(self) -> None:
+        self._task: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._analyze_due = False
+        # task -> result of its last run, with a timestamp
+        self.last: Dict[str, Dict[str, Any]] = {}
+
+    def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def after_scan(self) -> None:
+        """Refresh planner statistics soon; scans change table sizes a lot."""
+        self._analyze_due = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run_once(self, db: aiosqlite.Connection, force: Iterable[str] = ()) -> Dict[str, Any]:
+        """Run whatever is due, plus the `force`d tasks regardless of thresholds."""
+        force = set(force)
+        results: Dict[str, Any] = {}
+        if "analyze" in force or self._analyze_due:
+            results["analyze"] = await analyze(db)
+            self._analyze_due = False
+        if "vacuum" in force or idle():
+            results["vacuum"] = await incremental_vacuum(db, only_while_idle="vacuum" not in force)
+        # last, so the frames written by the steps above are truncated too
+        if "checkpoint" in force or _size(app_db.DB_PATH + "-wal") > settings.db_wal_checkpoint_bytes:
+            results["checkpoint"] = await checkpoint(db)
+        now = time.time()
+        for task, result in results.items():
+            self.last[task] = {**result, "at": now}
+        return results
+
+    async def _run(self) -> None:
+        async with open_db() as db:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                try:
+                    await self.run_once(db)
+                except aiosqlite.OperationalError as e:
+                    # locked by a long write (a scan); the next tick retries
+                    await db.rollback()
+                    self.last["error"] = {"error": str(e), "at": time.time()}
+
+
+maintenance = Maintenance()
@@ -0,0 +1,123 @@
+from __future__ import annotations
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List
+
+# one profile at a time: overlapping samplers would just measure each other
+_profile_lock = asyncio.Lock()
+# event-loop heartbeat period; lag beyond the block threshold means the loop is stuck
+_HEARTBEAT = 0.005
+MAX_SECONDS = 60.0
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # first line of the function (not the current line) so samples merge per function
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _stack(frame) -> List[str]:
+    labels: List[str] = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def _describe_task(task: asyncio.Task | None) -> Dict[str, Any] | None:
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return {"name": task.get_name(), "coro": getattr(coro, "__qualname__", repr(coro))}
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, loop: asyncio.AbstractEventLoop, loop_thread: int, interval: float, block_threshold: float):
+        super().__init__(name="myread-profiler", daemon=True)
+        self.loop = loop
+        self.loop_thread = loop_thread
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.stop_event = threading.Event()
+        self.counts: Counter[str] = Counter()
+        self.samples = 0
+        self.last_beat = time.perf_counter()
+        self.blocks: List[Dict[str, Any]] = []
+        self._current_block: Dict[str, Any] | None = None
+
+    def beat(self) -> None:
+        self.last_beat = time.perf_counter()
+
+    def run(self) -> None:
+        me = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                stack = _stack(frame)
+                thread_name = names.get(ident, f"thread-{ident}").replace(";", ",")
+                self.counts[";".join([thread_name, *stack])] += 1
+            self.samples += 1
+            self._check_loop(frames.get(self.loop_thread))
+        self._close_block()
+
+    def _check_loop(self, frame) -> None:
+        lag = time.perf_counter() - self.last_beat
+        if lag < self.block_threshold:
+            self._close_block()
+            return
+        if self._current_block is None:
+            # asyncio.current_task only reads a dict keyed by loop; safe enough for diagnostics
+            self._current_block = {
+                "started": self.last_beat,
+                "task": _describe_task(asyncio.current_task(self.loop)),
+                "stack": _stack(frame) if frame is not None else [],
+            }
+
+    def _close_block(self) -> None:
+        block = self._current_block
+        if block is None:
+            return
+        self._current_block = None
+        ended = self.last_beat if self.last_beat > block["started"] else time.perf_counter()
+        block["duration_ms"] = round((ended - block.pop("started")) * 1000, 1)
+        self.blocks.append(block)
+
+
+async def profile(seconds: float, interval: float = 0.01, block_threshold: float = 0.1) -> Dict[str, Any]:
+    """Sample every thread's stack for `seconds` and watch for event-loop stalls.
+
+    Returns collapsed stacks (`thread;outer;...;inner count` lines, the input
+    format of flamegraph.pl / speedscope) and the list of loop stalls longer
+    than `block_threshold`, each with the task that was running and its stack.
+    """
+    seconds = max(0.1, min(MAX_SECONDS, seconds))
+    interval = max(0.001, interval)
+    async with _profile_lock:
+        loop = asyncio.get_running_loop()
+        sampler = _Sampler(loop, threading.get_ident(), interval, block_threshold)
+        sampler.start()
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                sampler.beat()
+                await asyncio.sleep(_HEARTBEAT)
+        finally:
+            sampler.beat()
+            sampler.stop_event.set()
+            await asyncio.to_thread(sampler.join)
+    collapsed = "\n".join(f"{stack} {n}" for stack, n in sampler.counts.most_common())
+    return {
+        "seconds": seconds,
+        "interval_ms": interval * 1000,
+        "samples": sampler.samples,
+        "collapsed": collapsed,
+        "slow_callbacks": sorted(sampler.blocks, key=lambda b: b["duration_ms"], reverse=True),
+    }
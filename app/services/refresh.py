@@ -0,0 +1,140 @@
+from __future__ import annotations
+import asyncio
+import posixpath
+import stat as stat_mod
+import time
+from typing import Dict, Iterable, List
+
+import aiosqlite
+
+from ..settings import settings
+from ..utils import afs
+from ..utils.events import events
+from .scanner import ProgressFn, ScanOptions, normalize_album_path, scan_paths
+
+# ids per DELETE statement; well under SQLITE_MAX_VARIABLE_NUMBER on old builds too
+_DELETE_CHUNK = 500
+# progress is reported every this many albums or this many seconds, whichever comes first
+_PROGRESS_EVERY = 200
+_PROGRESS_INTERVAL = 0.5
+
+
+def minimal_roots(paths: Iterable[str]) -> List[str]:
+    """Drop paths that are inside another path of the set (and duplicates).
+
+    A recursive rescan of the outermost changed album covers everything
+    below it, so each subtree is scanned once.
+    """
+    by_key: Dict[str, str] = {}
+    for p in paths:
+        by_key.setdefault(normalize_album_path(p).lower(), p)
+    roots = []
+    for key, p in by_key.items():
+        child, parent = key, posixpath.dirname(key)
+        covered = False
+        while parent and parent != child:
+            if parent in by_key:
+                covered = True
+                break
+            child, parent = parent, posixpath.dirname(parent)
+        if not covered:
+            roots.append(p)
+    return roots
+
+
+async def refresh_library(db: aiosqlite.Connection, progress: ProgressFn | None = None) -> dict:
+    """Remove albums that no longer exist on disk and rescan changed ones.
+
+    - For folder albums: path must be an existing directory.
+    - For archive albums (zip, rar, 7z, tar): path must be an existing regular file.
+    Albums are stat'ed concurrently (bounded by io_concurrency), changed ones
+    are rescanned from the smallest set of roots, and vanished ones are then
+    deleted in batches inside one transaction. Rescanning first lets the
+    scanner recognise a vanished album that was moved or renamed inside a
+    changed folder and repoint it instead. Deletions cascade to thumbs via FK.
+    Progress goes to `progress` and to the bus as `refresh:progress`.
+    """
+    async with db.execute("SELECT id, type, path, mtime FROM albums") as cur:
+        rows = await cur.fetchall()
+    checked = len(rows)
+    removed_ids: list[int] = []
+    # vanished album id -> its path, to tell deleted albums from moved ones
+    vanished: Dict[int, str] = {}
+    changed: list[str] = []
+    done = 0
+    last_report = 0.0
+
+    async def report(phase: str, **extra) -> None:
+        nonlocal last_report
+        last_report = time.monotonic()
+        data = {
+            "phase": phase,
+            "done": done,
+            "total": checked,
+            "vanished": len(vanished),
+            "removed": len(removed_ids),
+            "changed": len(changed),
+            **extra,
+        }
+        events.publish("refresh:progress", data)
+        if progress:
+            await progress(data)
+
+    pending = iter(rows)
+
+    async def sweep() -> None:
+        nonlocal done
+        # workers share one iterator; next() never awaits, so each row is taken once
+        for album_id, typ, p, mtime in pending:
+            try:
+                # refresh must see the disk as it is now: bypass the stat cache
+                st = await afs.stat(p, cached=False)
+            except OSError:
+                st = None
+            if st is None:
+                ok = False
+            elif typ == "folder":
+                ok = stat_mod.S_ISDIR(st.st_mode)
+            else:
+                ok = stat_mod.S_ISREG(st.st_mode)
+            if not ok:
+                vanished[album_id] = p
+            elif int(st.st_mtime) != mtime:
+                changed.append(p)
+            done += 1
+            if done % _PROGRESS_EVERY == 0 or time.monotonic() - last_report >= _PROGRESS_INTERVAL:
+                await report("stat")
+
+    await report("stat")
+    workers = max(1, min(settings.io_concurrency, checked))
+    await asyncio.gather(*(sweep() for _ in range(workers)))
+
+    roots = minimal_roots(changed)
+    if roots:
+        async def rescan_progress(data: dict) -> None:
+            await report("rescan", roots_done=data.get("done", 0), roots=len(roots))
+
+        await scan_paths(db, roots, ScanOptions(recursive=True), progress=rescan_progress)
+
+    if vanished:
+        ids = list(vanished)
+        for i in range(0, len(ids), _DELETE_CHUNK):
+            chunk = ids[i:i + _DELETE_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            async with db.execute(f"SELECT id, path FROM albums WHERE id IN ({placeholders})", chunk) as cur:
+                # albums the rescan moved now have a new path
+                removed_ids.extend(album_id for album_id, p in await cur.fetchall() if p == vanished[album_id])
+        await report("delete")
+        for i in range(0, len(removed_ids), _DELETE_CHUNK):
+            chunk = removed_ids[i:i + _DELETE_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            await db.execute(f"DELETE FROM albums WHERE id IN ({placeholders})", chunk)
+        await db.commit()
+    await report("done", rescanned=len(roots))
+    return {
+        "checked": checked,
+        "removed": len(removed_ids),
+        "moved": len(vanished) - len(removed_ids),
+        "ids": removed_ids,
+        "rescanned": len(roots),
+    }
@@ -0,0 +1,193 @@
+"""Runtime settings: overrides from the `settings` table applied to the live app.
+
+`PUT /api/settings` stores overrides (camelCase keys, JSON values). They are
+loaded over the environment defaults at startup and applied immediately
+when changed: worker pools are resized, a smaller cache limit queues an
+eviction, and a new cache dir queues a migration of the cached thumbnails.
+Every change is published as `settings:changed`; in multi-worker mode the
+other processes pick it up from the bus and apply it to themselves.
+"""
+from __future__ import annotations
+import asyncio
+import json
+import os
+from typing import Any, Dict
+
+import aiosqlite
+
+from ..settings import AppSettings, settings
+from ..utils import afs
+from ..utils.events import events
+from . import admission, leases
+from .encoders import get_encoder
+from .jobs import jobs
+from .thumbnails import resize_decode_pool
+
+# API / DB key -> AppSettings field
+KEY_MAP: Dict[str, str] = {
+    "cacheDir": "cache_dir",
+    "cacheMaxBytes": "cache_max_bytes",
+    "defaultQuality": "default_quality",
+    "encodeFormat": "encode_format",
+    "ioConcurrency": "io_concurrency",
+    "decodeConcurrency": "decode_concurrency",
+    "allowRecursive": "allow_recursive",
+    "maxInputPixels": "max_input_pixels",
+    "decodeMemoryBudget": "decode_memory_budget",
+}
+_FIELD_KEYS = {field: key for key, field in KEY_MAP.items()}
+
+# (minimum, maximum or None) for numeric fields
+_BOUNDS: Dict[str, tuple] = {
+    "cache_max_bytes": (0, None),
+    "default_quality": (1, 100),
+    "io_concurrency": (1, 256),
+    "decode_concurrency": (1, 64),
+    "max_input_pixels": (1, None),
+    "decode_memory_budget": (1, None),
+}
+
+
+def snapshot() -> Dict[str, Any]:
+    """Current effective values, camelCase."""
+    return {key: getattr(settings, field) for key, field in KEY_MAP.items()}
+
+
+def validate(values: Dict[str, Any]) -> Dict[str, Any]:
+    """Coerce and check `{field: value}`; raises ValueError naming the API key."""
+    data = settings.model_dump()
+    data.update(values)
+    # pydantic's ValidationError is a ValueError
+    checked = AppSettings(**data)
+    out: Dict[str, Any] = {}
+    for field in values:
+        value = getattr(checked, field)
+        key = _FIELD_KEYS[field]
+        if field in _BOUNDS:
+            low, high = _BOUNDS[field]
+            if value < low or (high is not None and value > high):
+                raise ValueError(f"{key} out of range: {value}")
+        if field == "encode_format" and get_encoder(value) is None:
+            raise ValueError(f"{key}: unsupported format {value!r}")
+        if field == "cache_dir":
+            if not str(value).strip():
+                raise ValueError(f"{key} must not be empty")
+            # thumbs rows store absolute paths joined from it
+            value = os.path.abspath(value)
+        out[field] = value
+    return out
+
+
+def _apply_local(values: Dict[str, Any]) -> None:
+    """Make `{field: value}` effective in this process (no DB, no jobs)."""
+    for field, value in values.items():
+        if field == "io_concurrency":
+            afs.resize_pool(value)
+        elif field == "decode_concurrency":
+            resize_decode_pool(value)
+        elif field == "decode_memory_budget":
+            settings.decode_memory_budget = value
+            # a larger budget may admit queued decodes right away
+            admission.budget.wake()
+        else:
+            setattr(settings, field, value)
+
+
+async def _read_overrides(db: aiosqlite.Connection) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    async with db.execute("SELECT key, value FROM settings") as cur:
+        async for key, raw in cur:
+            field = KEY_MAP.get(key)
+            if field is None:
+                continue
+            try:
+                out[field] = json.loads(raw)
+            except ValueError:
+                continue
+    return out
+
+
+async def load(db: aiosqlite.Connection) -> Dict[str, Any]:
+    """Apply stored overrides at startup; invalid ones are skipped, not fatal."""
+    applied: Dict[str, Any] = {}
+    for field, value in (await _read_overrides(db)).items():
+        try:
+            applied.update(validate({field: value}))
+        except ValueError as e:
+            print(f"⚠️ 忽略无效设置 {_FIELD_KEYS[field]}: {e}")
+    _apply_local(applied)
+    return applied
+
+
+async def update(db: aiosqlite.Connection, overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate, persist and apply camelCase `overrides`.
+
+    Returns the keys that actually changed and the ids of jobs queued for
+    them (`cache_migrate`, `cache_cleanup`).
+    """
+    unknown = [key for key in overrides if key not in KEY_MAP]
+    if unknown:
+        raise ValueError(f"unknown settings: {', '.join(unknown)}")
+    values = validate({KEY_MAP[key]: value for key, value in overrides.items()})
+    previous = {field: getattr(settings, field) for field in values}
+    await db.executemany(
+        "INSERT INTO settings(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
+        [(_FIELD_KEYS[field], json.dumps(value)) for field, value in values.items()],
+    )
+    await db.commit()
+    changed = {field: value for field, value in values.items() if previous[field] != value}
+    _apply_local(changed)
+    queued: Dict[str, int] = {}
+    if "cache_dir" in changed:
+        # new thumbnails already go to the new dir; the job moves the old ones
+        queued["cache_migrate"] = await jobs.enqueue(
+            db, "cache_migrate", {"from": previous["cache_dir"], "to": changed["cache_dir"]}, priority=1
+        )
+    if "cache_max_bytes" in changed and changed["cache_max_bytes"] < previous["cache_max_bytes"]:
+        queued["cache_cleanup"] = await jobs.enqueue(db, "cache_cleanup", priority=1)
+    if changed:
+        events.publish(
+            "settings:changed",
+            {
+                "settings": {_FIELD_KEYS[field]: value for field, value in changed.items()},
+                "origin": leases.OWNER,
+            },
+        )
+    return {"updated": len(values), "changed": [_FIELD_KEYS[field] for field in changed], "jobs": queued}
+
+
+_follower: asyncio.Task | None = None
+
+
+async def _follow() -> None:
+    sub, _ = events.subscribe({"settings:changed"})
+    try:
+        while True:
+            items, _ = await sub.next_batch()
+            for item in items:
+                data = item["data"]
+                if data.get("origin") == leases.OWNER:
+                    continue
+                values = {KEY_MAP[k]: v for k, v in (data.get("settings") or {}).items() if k in KEY_MAP}
+                try:
+                    _apply_local(validate(values))
+                except ValueError:
+                    continue
+    finally:
+        events.unsubscribe(sub)
+
+
+def start_follower() -> None:
+    """Multi-worker mode: apply changes made through other processes."""
+    global _follower
+    if _follower is None:
+        _follower = asyncio.create_task(_follow())
+
+
+async def stop_follower() -> None:
+    global _follower
+    if _follower is None:
+        return
+    _follower.cancel()
+    await asyncio.gather(_follower, return_exceptions=True)
+    _follower = None
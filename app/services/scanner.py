@@ -1,16 +1,31 @@
 from __future__ import annotations
-import asyncio
+import hashlib
 import os
+import stat as stat_mod
 import time
-import zipfile
 from dataclasses import dataclass
-from typing import Set
+from typing import Any, Awaitable, Callable, Dict, Set
 
 import aiosqlite
-from natsort import natsorted, ns
 
+from ..settings import settings
+from ..utils import afs, archives
 from ..utils.fs import is_image_name, basename_without_ext
 from ..utils.events import events
+from ..utils.metrics import SCAN_STAGE_SECONDS
+from ..utils.zipscan import natural_sort_key
+from .entries import read_album_entries, save_entries
+from .maintenance import maintenance
+
+
+# a recursive walk commits at least this often, so a large tree does not hold
+# the write lock for the whole scan (other writers, lease renewals in multi-worker mode)
+SCAN_COMMIT_INTERVAL = 2.0
+
+# async callback used by long-running operations to report progress (e.g. to a job)
+ProgressFn = Callable[[Dict[str, Any]], Awaitable[None]]
+# async callback receiving each album info dict as soon as it is upserted
+AlbumFn = Callable[[Dict[str, Any]], Awaitable[None]]
 
 
 @dataclass
@@ -42,7 +57,11 @@ async def stat_path(path: str) -> tuple[int, int]:
                 continue
         return int(st.st_mtime), total_size
 
-    return await asyncio.to_thread(_stat_sync, path)
+    def _timed_stat(p: str) -> tuple[int, int]:
+        with SCAN_STAGE_SECONDS.time(stage="stat"):
+            return _stat_sync(p)
+
+    return await afs.run_io(_timed_stat, path)
 
 def normalize_album_path(path: str) -> str:
     if not path:
@@ -65,7 +84,72 @@ async def _load_existing_album_keys(db: aiosqlite.Connection) -> Set[str]:
     return existing
 
 
-async def scan_zip(db: aiosqlite.Connection, path: str, seen_paths: Set[str]) -> dict | None:
+async def _album_id(db: aiosqlite.Connection, key: str) -> int:
+    async with db.execute("SELECT id FROM albums WHERE path=?", (key,)) as cur:
+        (album_id,) = await cur.fetchone()
+    return album_id
+
+
+def album_fingerprint(names: list[str]) -> str:
+    """Hash of the image (and archive) names an album holds, independent of its location."""
+    digest = hashlib.sha1()
+    for name in sorted(names):
+        digest.update(name.encode("utf-8", "surrogateescape"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+async def _claim_moved(
+    db: aiosqlite.Connection,
+    album_type: str,
+    key: str,
+    name: str,
+    mtime: int,
+    size: int,
+    file_count: int,
+    fingerprint: str,
+) -> tuple[int, str] | None:
+    """Repoint an album that was moved or renamed to `key`; returns (id, old path).
+
+    A candidate must agree on type, size, mtime, file count and fingerprint
+    (or, scanned before fingerprints existed, on the name) and its old path
+    must be gone, otherwise the new path is a copy. The album keeps its id,
+    so added_at, cover_path, entries and cached thumbnails stay with it.
+    """
+    async with db.execute(
+        """
+        SELECT id, path FROM albums
+        WHERE (fingerprint=? OR (fingerprint IS NULL AND name=?))
+          AND type=? AND size=? AND mtime=? AND file_count=? AND path!=?
+        """,
+        (fingerprint, name, album_type, size, mtime, file_count, key),
+    ) as cur:
+        candidates = await cur.fetchall()
+    for album_id, old_path in candidates:
+        if await afs.stat(old_path, cached=False) is not None:
+            continue
+        await db.execute(
+            "UPDATE albums SET path=?, name=?, name_key=?, fingerprint=? WHERE id=?",
+            (key, name, natural_sort_key(name), fingerprint, album_id),
+        )
+        return album_id, old_path
+    return None
+
+
+async def _record_entries(db: aiosqlite.Connection, album_id: int, album_type: str, path: str, names: list[str]) -> None:
+    """Replace the album's rows in `entries`, with header dimensions when enabled."""
+    try:
+        with SCAN_STAGE_SECONDS.time(stage="probe"):
+            rows = await afs.run_io(read_album_entries, album_type, path, names, settings.scan_probe_dimensions)
+    except (archives.ArchiveError, OSError):
+        # names only; the entries listing probes lazily instead
+        rows = [(name, None) for name in names]
+    await save_entries(db, album_id, rows, replace=True)
+
+
+async def scan_archive(
+    db: aiosqlite.Connection, path: str, seen_paths: Set[str], provider: archives.ArchiveProvider
+) -> dict | None:
     real_path = os.path.normpath(os.path.abspath(path))
     key = normalize_album_path(real_path)
     mtime, size = await stat_path(real_path)
@@ -77,21 +161,27 @@ async def scan_zip(db: aiosqlite.Connection, path: str, seen_paths: Set[str]) ->
             row = await cur.fetchone()
             album_id, album_mtime, file_count = row[0], row[1], row[2]
             if album_mtime == mtime:
-                return {"path": key, "type": "zip", "name": name, "mtime": mtime, "size": size, "file_count": file_count}
+                return {"path": key, "type": provider.kind, "name": name, "mtime": mtime, "size": size, "file_count": file_count}
             updateflag = True
-    # count image files in the zip
-    file_count = 0
+    # list image members and pick the naturally-first one, without sorting
     try:
-        with zipfile.ZipFile(real_path, 'r') as zf:
-            names = [i.filename for i in zf.infolist() if not i.is_dir()]
-            images = [n for n in names if is_image_name(n)]
-            # 自然排序
-            images = natsorted(images, alg=ns.IGNORECASE)
-            file_count = len(images)
-    except zipfile.BadZipFile:
+        with SCAN_STAGE_SECONDS.time(stage="zip_inspect"):
+            images = await afs.run_io(archives.image_names, provider, real_path)
+    except (archives.ArchiveError, OSError):
         return None
+    file_count = len(images)
     if file_count == 0:
         return None
+    first_entry = min(images, key=natural_sort_key)
+    fingerprint = album_fingerprint(images)
+    info = {
+        "path": key,
+        "type": provider.kind,
+        "name": name,
+        "mtime": mtime,
+        "size": size,
+        "file_count": file_count,
+    }
     if updateflag:
         await db.execute(
             """
@@ -100,36 +190,44 @@ async def scan_zip(db: aiosqlite.Connection, path: str, seen_paths: Set[str]) ->
                 size=?,
                 file_count=?,
                 cover_path=NULL,
-                name=?
+                placeholder=NULL,
+                first_entry=?,
+                name=?,
+                name_key=?,
+                fingerprint=?
             WHERE id=?
             """,
-            (mtime, size, file_count, name, album_id),
+            (mtime, size, file_count, first_entry, name, natural_sort_key(name), fingerprint, album_id),
         )
         await db.execute("DELETE FROM thumbs WHERE album_id=?", (album_id,))
     else:
+        moved = await _claim_moved(db, provider.kind, key, name, mtime, size, file_count, fingerprint)
+        if moved is not None:
+            # same content: entries and thumbnails are still valid
+            seen_paths.discard(moved[1])
+            seen_paths.add(key)
+            return {**info, "moved_from": moved[1]}
         now = int(time.time())
         await db.execute(
             """
-            INSERT INTO albums(type, path, name, mtime, size, file_count, added_at)
-            VALUES('zip', ?, ?, ?, ?, ?, ?)
+            INSERT INTO albums(type, path, name, name_key, mtime, size, file_count, added_at, first_entry, fingerprint)
+            VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ON CONFLICT(path) DO UPDATE SET
                 mtime=excluded.mtime,
                 size=excluded.size,
                 file_count=excluded.file_count,
-                name=excluded.name
+                name=excluded.name,
+                name_key=excluded.name_key,
+                first_entry=excluded.first_entry,
+                fingerprint=excluded.fingerprint
             """,
-            (key, name, mtime, size, file_count, now),
+            (provider.kind, key, name, natural_sort_key(name), mtime, size, file_count, now, first_entry, fingerprint),
         )
+        album_id = await _album_id(db, key)
         if key:
             seen_paths.add(key)
-    return {
-        "path": key,
-        "type": "zip",
-        "name": name,
-        "mtime": mtime,
-        "size": size,
-        "file_count": file_count,
-    }
+    await _record_entries(db, album_id, provider.kind, real_path, images)
+    return info
 
 
 async def scan_folder(
@@ -137,18 +235,28 @@ async def scan_folder(
     path: str,
     recursive: bool = False,
     seen_paths: Set[str] | None = None,
-) -> list[dict]:
-    """Scan a folder. When recursive=True, insert an album for each subfolder/zip
+    on_album: AlbumFn | None = None,
+) -> int:
+    """Scan a folder. When recursive=True, insert an album for each subfolder/archive
     under `path` that contains images; when False, insert only for `path` itself.
 
-    Returns a list of album info dicts that were inserted/updated.
+    Each inserted/updated album info dict is passed to `on_album` as soon as it
+    is written instead of being collected, so memory stays flat for huge trees.
+    Returns the number of albums inserted/updated.
     """
 
-    results: list[dict] = []
-    file_count_dict = {}
+    emitted = 0
+    # image counts of already-walked subfolders, consumed by their parent
+    file_count_dict: dict[str, int] = {}
     if seen_paths is None:
         seen_paths = set()
 
+    async def emit(info: dict) -> None:
+        nonlocal emitted
+        emitted += 1
+        if on_album:
+            await on_album(info)
+
     async def upsert_folder_album(folder_path: str, folder_dir: list[str], files_in_folder: list[str]) -> dict | None:
         # count images among the provided file names (not recursing)
         real_folder_path = os.path.normpath(os.path.abspath(folder_path))
@@ -165,21 +273,31 @@ async def scan_folder(
             updateflag = True
         images = [f for f in files_in_folder if is_image_name(f)]
         file_count = len(images)
-        # Albums for zip files under this folder
+        first_entry = min(images, key=natural_sort_key) if images else None
+        # Albums for archives (zip/cbz/rar/7z/tar...) under this folder
         for f in files_in_folder:
-            if f.lower().endswith('.zip'):
-                zip_path = os.path.join(folder_path, f)
-                info = await scan_zip(db, zip_path, seen_paths)
+            provider = archives.provider_for_name(f)
+            if provider is not None:
+                info = await scan_archive(db, os.path.join(folder_path, f), seen_paths, provider)
                 if info and info.get("file_count", 0) > 0:
-                    results.append(info)
+                    await emit(info)
                     file_count += info.get("file_count", 0)
         for f in folder_dir:
             normalized_f = normalize_album_path(os.path.join(real_folder_path, f))
-            if file_count_dict.get(normalized_f):
-                file_count += file_count_dict[normalized_f]
+            file_count += file_count_dict.pop(normalized_f, 0)
         if file_count == 0:
             return None
         file_count_dict[key] = file_count        
+        # direct images and archives only: subfolders are not listed in a non-recursive scan
+        fingerprint = album_fingerprint([f for f in files_in_folder if is_image_name(f) or archives.is_archive_name(f)])
+        info = {
+            "path": key,
+            "type": "folder",
+            "name": name,
+            "mtime": mtime,
+            "size": size,
+            "file_count": file_count,
+        }
         if updateflag:
             await db.execute(
                 """
@@ -188,80 +306,110 @@ async def scan_folder(
                     size=?,
                     file_count=?,
                     cover_path=NULL,
-                    name=?
+                    placeholder=NULL,
+                    first_entry=?,
+                    name=?,
+                    name_key=?,
+                    fingerprint=?
                 WHERE id=?
                 """,
-                (mtime, size, file_count, name, album_id),
+                (mtime, size, file_count, first_entry, name, natural_sort_key(name), fingerprint, album_id),
             )
             await db.execute("DELETE FROM thumbs WHERE album_id=?", (album_id,))
         else:
+            moved = await _claim_moved(db, "folder", key, name, mtime, size, file_count, fingerprint)
+            if moved is not None:
+                # same content: entries and thumbnails are still valid
+                seen_paths.discard(moved[1])
+                seen_paths.add(key)
+                return {**info, "moved_from": moved[1]}
             now = int(time.time())
             await db.execute(
                 """
-                INSERT INTO albums(type, path, name, mtime, size, file_count, added_at)
-                VALUES('folder', ?, ?, ?, ?, ?, ?)
+                INSERT INTO albums(type, path, name, name_key, mtime, size, file_count, added_at, first_entry, fingerprint)
+                VALUES('folder', ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ON CONFLICT(path) DO UPDATE SET
                     mtime=excluded.mtime,
                     size=excluded.size,
                     file_count=excluded.file_count,
-                    name=excluded.name
+                    name=excluded.name,
+                    name_key=excluded.name_key,
+                    first_entry=excluded.first_entry,
+                    fingerprint=excluded.fingerprint
                 """,
-                (key, name, mtime, size, file_count, now),
+                (key, name, natural_sort_key(name), mtime, size, file_count, now, first_entry, fingerprint),
             )
+            album_id = await _album_id(db, key)
             if key:
                 seen_paths.add(key)
-        return {
-            "path": key,
-            "type": "folder",
-            "name": name,
-            "mtime": mtime,
-            "size": size,
-            "file_count": file_count,
-        }
+        await _record_entries(db, album_id, "folder", real_folder_path, images)
+        return info
 
     if recursive:
         # Traverse all subdirectories; for each subdir (excluding root), create an album if it has images.
-        for root, dirs, files in os.walk(path,False):
+        walker = os.walk(path, False)
+        last_commit = time.monotonic()
+        while True:
+            # each listing step runs off the event loop; slow shares would stall it otherwise
+            with SCAN_STAGE_SECONDS.time(stage="walk"):
+                step = await afs.run_io(next, walker, None)
+            if step is None:
+                break
+            root, dirs, files = step
             # Albums for subfolders only ("path 下的每一个有图片的文件夹")
             info = await upsert_folder_album(root, dirs, files)
             if info:
-                results.append(info)
+                await emit(info)
+            if time.monotonic() - last_commit >= SCAN_COMMIT_INTERVAL:
+                await db.commit()
+                last_commit = time.monotonic()
     else:
         # Only this folder itself
         try:
             files = [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))]
         except FileNotFoundError:
             files = []
-        info = await upsert_folder_album(path, files)
+        info = await upsert_folder_album(path, [], files)
         if info:
-            results.append(info)
+            await emit(info)
+
+    return emitted
 
-    return results
 
+async def scan_paths(
+    db: aiosqlite.Connection,
+    paths: list[str],
+    options: ScanOptions,
+    progress: ProgressFn | None = None,
+    on_album: AlbumFn | None = None,
+) -> dict:
+    """Scan albums under `paths`; returns counts only.
 
-async def scan_paths(db: aiosqlite.Connection, paths: list[str], options: ScanOptions) -> dict:
+    Album records are streamed to `on_album` as they are upserted rather than
+    accumulated, so the result size does not grow with the library.
+    """
     seen_paths = await _load_existing_album_keys(db)
     added_or_updated = 0
-    details: list[dict] = []
-    for p in paths:
+    for index, p in enumerate(paths):
+        if progress:
+            await progress({"done": index, "total": len(paths), "count": added_or_updated, "path": p})
         abs_path = normalize_album_path(os.path.abspath(p))
         events.publish("scan:progress", {"path": abs_path, "status": "start"})
-        if not os.path.exists(abs_path):
+        st = await afs.stat(abs_path, cached=False)
+        if st is None:
             events.publish("scan:progress", {"path": abs_path, "status": "skip", "reason": "not_exists"})
             continue
-        if os.path.isdir(abs_path):
-            items = await scan_folder(db, abs_path, options.recursive, seen_paths)
-            details.extend(items)
-            added_or_updated += len(items)
-            events.publish(
-                "scan:progress",
-                {"path": abs_path, "status": "done", "items": items, "count": len(items)},
-            )
-        elif abs_path.lower().endswith('.zip'):
-            info = await scan_zip(db, abs_path, seen_paths)
+        provider = archives.provider_for_name(abs_path)
+        if stat_mod.S_ISDIR(st.st_mode):
+            count = await scan_folder(db, abs_path, options.recursive, seen_paths, on_album)
+            added_or_updated += count
+            events.publish("scan:progress", {"path": abs_path, "status": "done", "count": count})
+        elif provider is not None:
+            info = await scan_archive(db, abs_path, seen_paths, provider)
             if info and info.get("file_count", 0) > 0:
-                details.append(info)
                 added_or_updated += 1
+                if on_album:
+                    await on_album(info)
             status_payload = {"path": abs_path, "status": "done"}
             if info:
                 status_payload["info"] = info
@@ -269,9 +417,13 @@ async def scan_paths(db: aiosqlite.Connection, paths: list[str], options: ScanOp
                 status_payload["reason"] = "duplicate"
             events.publish("scan:progress", status_payload)
         else:
-            # 非文件夹/非 zip 跳过
+            # 非文件夹/非压缩包跳过
             events.publish("scan:progress", {"path": abs_path, "status": "skip", "reason": "unsupported"})
             continue
     await db.commit()
+    if added_or_updated:
+        maintenance.after_scan()
+    if progress:
+        await progress({"done": len(paths), "total": len(paths), "count": added_or_updated})
     events.publish("scan:done", {"count": added_or_updated})
-    return {"count": added_or_updated, "items": details}
+    return {"count": added_or_updated}
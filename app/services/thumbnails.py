@@ -1,48 +1,90 @@
 from __future__ import annotations
+import asyncio
+import base64
+import hashlib
+import io
+import math
 import os
 import time
-import zipfile
-from typing import Literal, Optional
+from typing import TYPE_CHECKING, Awaitable, Callable, Literal, Optional
 
 import aiosqlite
-from PIL import Image, ImageOps
 
 from ..settings import settings
+from ..utils import afs, archives
+from ..utils.pools import ResizablePool
+from ..utils.metrics import THUMB_CACHE, THUMB_STAGE_SECONDS
+from . import leases
+from . import admission, thumbstore
+from .encoders import get_encoder
+from .thumbstore import ThumbRef
+
+if TYPE_CHECKING:
+    from PIL import Image
 
 
 FitMode = Literal["cover", "contain"]
 
 
+def _load(fp) -> Image.Image:
+    """Open and decode, refusing sources over settings.max_input_pixels before any pixel is decoded."""
+    # Pillow is imported on first render, not at app startup
+    from PIL import Image
+
+    # Pillow only warns between 1x and 2x its limit; the explicit check below covers that range
+    Image.MAX_IMAGE_PIXELS = settings.max_input_pixels
+    try:
+        img = Image.open(fp)
+    except Image.DecompressionBombError as e:
+        raise admission.too_large() from e
+    # admission control estimated from scan-time dimensions; this is the real header
+    if img.width * img.height > settings.max_input_pixels:
+        img.close()
+        raise admission.too_large(img.width, img.height)
+    img.load()
+    return img
+
+
 def _open_image_from_path(album_type: str, album_path: str, entry_path: Optional[str] = None) -> Image.Image:
     if album_type == "folder":
         fp = os.path.join(album_path, entry_path) if entry_path else album_path
-        img = Image.open(fp)
-        return img
-    elif album_type == "zip":
-        if not entry_path:
-            raise ValueError("entry_path required for zip album")
-        with zipfile.ZipFile(album_path, 'r') as zf:
-            with zf.open(entry_path, 'r') as fp:
-                img = Image.open(fp)
-                # keep file handle open until load() completes
-                img.load()
-                return img
-    else:
+        with THUMB_STAGE_SECONDS.time(stage="decode"):
+            return _load(fp)
+    provider = archives.provider_for_kind(album_type)
+    if provider is None:
+        if archives.is_archive_kind(album_type):
+            raise admission.DecodeRejected(f"{album_type} archives are not supported by this server", status_code=415)
         raise ValueError("unknown album type")
+    if not entry_path:
+        raise ValueError("entry_path required for archive album")
+    # the stage keeps its historical name; it covers every archive format
+    with THUMB_STAGE_SECONDS.time(stage="zip_open"):
+        member = archives.open_member(provider, album_path, entry_path)
+    # the buffer (mmap, extracted file) must stay valid until load() completes
+    with member, THUMB_STAGE_SECONDS.time(stage="decode"):
+        return _load(member)
 
 
 def _apply_exif_and_rgb(img: Image.Image) -> Image.Image:
-    Image.MAX_IMAGE_PIXELS = settings.max_input_pixels
+    """Turn the decoded image upright (EXIF Orientation) and into RGB/RGBA.
+
+    imgmeta reports sizes as displayed, so renders must agree with it.
+    """
+    from PIL import ImageOps
+
     try:
-        img = ImageOps.exif_transpose(img)
+        # in place: upright sources (the common case) are not copied
+        ImageOps.exif_transpose(img, in_place=True)
     except Exception:
         pass
     if img.mode not in ("RGB", "RGBA"):
-        img = img.convert("RGB")
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
     return img
 
 
 def _resize(img: Image.Image, w: int, h: int, fit: FitMode) -> Image.Image:
+    from PIL import Image
+
     if fit == "contain":
         img.thumbnail((w, h), Image.Resampling.LANCZOS)
         return img
@@ -63,6 +105,210 @@ def _resize(img: Image.Image, w: int, h: int, fit: FitMode) -> Image.Image:
     img = img.crop(box)
     return img.resize((w, h), Image.Resampling.LANCZOS)
 
+def parse_sizes(spec: str) -> list[tuple[int, int]]:
+    """Parse "300x400,450x300" into [(300, 400), (450, 300)], ignoring junk."""
+    sizes: list[tuple[int, int]] = []
+    for part in (spec or "").split(","):
+        try:
+            w, h = (int(v) for v in part.lower().strip().split("x", 1))
+        except ValueError:
+            continue
+        if w > 0 and h > 0 and (w, h) not in sizes:
+            sizes.append((w, h))
+    return sizes
+
+
+def standard_sizes() -> list[tuple[int, int]]:
+    return parse_sizes(settings.thumb_sizes)
+
+
+# a standard size is only substituted when its aspect ratio is this close
+# (as |log(ratio)|, ~15%), otherwise cover crops would visibly change
+_SNAP_MAX_ASPECT_DIFF = 0.14
+
+
+def snap_size(w: int, h: int) -> tuple[int, int]:
+    """Map an arbitrary request onto the nearest standard size.
+
+    Among standard sizes with a similar aspect ratio, pick the smallest one
+    that is at least as large as the request (so nothing is upscaled in the
+    browser), else the largest. Unmatched aspect ratios are returned as-is.
+    """
+    if w <= 0 or h <= 0:
+        return w, h
+    want = math.log(w / h)
+    close = [(sw, sh) for sw, sh in standard_sizes() if abs(math.log(sw / sh) - want) <= _SNAP_MAX_ASPECT_DIFF]
+    if not close:
+        return w, h
+    big_enough = [sz for sz in close if sz[0] >= w and sz[1] >= h]
+    if big_enough:
+        return min(big_enough, key=lambda sz: sz[0] * sz[1])
+    return max(close, key=lambda sz: sz[0] * sz[1])
+
+
+def entry_tag(entry_path: Optional[str]) -> str:
+    # entry is hashed into the key so different pages of one album never share a thumb
+    return hashlib.sha1(entry_path.encode("utf-8")).hexdigest()[:12] if entry_path else "album"
+
+
+def thumb_key(album_id: int, entry_path: Optional[str], fit: str, q: int, w: int, h: int, fmt: str) -> str:
+    return f"{album_id}_{entry_tag(entry_path)}_{fit}_{q}_{w}_{h}.{fmt}"
+
+
+def _prescale(img: Image.Image, sizes: list[tuple[int, int]], fit: FitMode) -> Image.Image:
+    """Shrink the decoded source once to the smallest image that still covers every size."""
+    from PIL import Image
+
+    src_w, src_h = img.size
+    if not src_w or not src_h:
+        return img
+    if fit == "contain":
+        scale = max(min(w / src_w, h / src_h) for w, h in sizes)
+    else:
+        scale = max(max(w / src_w, h / src_h) for w, h in sizes)
+    if scale >= 0.5:
+        # not worth an extra resampling pass
+        return img
+    new_size = (max(1, math.ceil(src_w * scale)), max(1, math.ceil(src_h * scale)))
+    return img.resize(new_size, Image.Resampling.LANCZOS)
+
+
+# placeholders fit in this many pixels per side; blurred by the browser's upscaling
+PLACEHOLDER_SIZE = 16
+PLACEHOLDER_QUALITY = 40
+
+
+def make_placeholder(img: Image.Image) -> str:
+    """A tiny WebP of `img` as a data: URI (a few hundred bytes), inlined in listings."""
+    from PIL import Image
+
+    small = img.copy()
+    small.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.Resampling.BILINEAR)
+    if small.mode not in ("RGB", "RGBA"):
+        small = small.convert("RGB")
+    buf = io.BytesIO()
+    small.save(buf, "WEBP", quality=PLACEHOLDER_QUALITY, method=0)
+    return "data:image/webp;base64," + base64.b64encode(buf.getvalue()).decode("ascii")
+
+
+def _placeholder_from_bytes(data: bytes) -> str:
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        return make_placeholder(img)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def placeholder_for(ref: ThumbRef) -> str | None:
+    """Placeholder made from an already rendered thumbnail; None if it cannot be read."""
+    try:
+        if ref.offset is None:
+            data = await afs.run_io(_read_file, ref.path)
+        else:
+            data = await thumbstore.read_blob(ref)
+        return await _decode_pool.run(_placeholder_from_bytes, data)
+    except Exception:
+        return None
+
+
+def _render_sizes(
+    album_type: str,
+    album_path: str,
+    entry_path: Optional[str],
+    targets: list[tuple[int, int, str]],
+    fit: FitMode,
+    fmt: str,
+    q: int,
+) -> tuple[list[tuple[int, int, str, ThumbRef, int, int]], str]:
+    """Decode the source once and encode every (w, h, key) target into the store.
+
+    Runs in a worker thread. Returns [(w, h, key, ref, width, height)] and
+    the entry's placeholder, made from the same decode.
+    """
+    encoder = get_encoder(fmt)
+    if encoder is None:
+        raise ValueError(f"unsupported format: {fmt}")
+    img = _open_image_from_path(album_type, album_path, entry_path)
+    with THUMB_STAGE_SECONDS.time(stage="resize"):
+        img = _apply_exif_and_rgb(img)
+        base = _prescale(img, [(w, h) for w, h, _ in targets], fit)
+    store = thumbstore.get_store()
+    out = []
+    for w, h, key in targets:
+        # contain uses Image.thumbnail, which works in place
+        with THUMB_STAGE_SECONDS.time(stage="resize"):
+            thumb = _resize(base.copy() if fit == "contain" else base, w, h, fit)
+        with THUMB_STAGE_SECONDS.time(stage="encode"):
+            ref = store.put(key, encoder, thumb, q)
+        out.append((w, h, key, ref, thumb.width, thumb.height))
+    return out, make_placeholder(base)
+
+
+# decode + resize + encode runs here; sized by settings.decode_concurrency so a
+# burst of thumbnail misses cannot take over the default executor
+_decode_pool = ResizablePool("myread-decode", lambda: settings.decode_concurrency)
+
+
+def resize_decode_pool(workers: int) -> None:
+    _decode_pool.resize(workers)
+    settings.decode_concurrency = _decode_pool.size
+
+
+# renders in progress, keyed by render name (the pyramid's when all sizes are
+# rendered together), so concurrent requests for the same image share one
+# decode; each resolves to {thumb key: ref} for the sizes it produced
+_inflight: dict[str, asyncio.Future] = {}
+
+# multi-worker mode: a render lease outlives any sane render; a crashed
+# holder delays other workers by at most this long
+RENDER_LEASE_TTL = 60.0
+RENDER_POLL_INTERVAL = 0.05
+
+
+_THUMB_ROW_SQL = "SELECT file_path, pack_offset, bytes FROM thumbs WHERE album_id=? AND key=?"
+
+
+async def _registered_ref(db: aiosqlite.Connection, album_id: int, key: str) -> ThumbRef | None:
+    async with db.execute(_THUMB_ROW_SQL, (album_id, key)) as cur:
+        row = await cur.fetchone()
+    # bypass the stat cache: the file may have just been written by another process
+    if row and await afs.exists(row[0], cached=False):
+        return thumbstore.ref_from_row(*row)
+    return None
+
+
+async def _claim_render(
+    db: aiosqlite.Connection, album_id: int, key: str, lease_name: str
+) -> tuple[ThumbRef | None, bool]:
+    """Take the render lease for `key`, or wait until the worker holding it is done.
+
+    Returns (ref, False) when another worker produced the thumbnail, or
+    (None, True) when this worker now owns the lease and must render.
+    """
+    while True:
+        try:
+            acquired = await leases.acquire(db, lease_name, RENDER_LEASE_TTL)
+        except aiosqlite.OperationalError:
+            await db.rollback()
+            acquired = False
+        if acquired:
+            # the previous holder may have finished between our lookup and now
+            ref = await _registered_ref(db, album_id, key)
+            if ref is not None:
+                await leases.release(db, lease_name)
+                return ref, False
+            return None, True
+        await asyncio.sleep(RENDER_POLL_INTERVAL)
+        ref = await _registered_ref(db, album_id, key)
+        if ref is not None:
+            return ref, False
+
+
 async def get_or_create_thumb(
     db: aiosqlite.Connection,
     *,
@@ -75,47 +321,110 @@ async def get_or_create_thumb(
     fit: FitMode,
     fmt: str = "webp",
     quality: int | None = None,
-) -> tuple[str, str]:
+) -> tuple[str, ThumbRef]:
+    """Return (key, ref) of a cached thumbnail, rendering it if needed.
+
+    `w`/`h` are snapped to the configured standard sizes. In pyramid mode a
+    miss renders every standard size for the entry from a single decode and
+    registers all of them, so the next size asked for is already cached.
+    """
     q = int(quality or settings.default_quality)
-    key = f"{album_id}_{fit}_{q}_{w}_{h}.{fmt}"
-    file_path = os.path.join(settings.cache_dir, "thumbs", key)
+    w, h = snap_size(w, h)
+    key = thumb_key(album_id, entry_path, fit, q, w, h, fmt)
 
     # try DB first
-    async with db.execute("SELECT file_path FROM thumbs WHERE album_id=? AND key=?", (album_id, key)) as cur:
+    async with db.execute(_THUMB_ROW_SQL, (album_id, key)) as cur:
         row = await cur.fetchone()
-        if row and os.path.exists(row[0]):
+        if row and await afs.exists(row[0]):
             await db.execute("UPDATE thumbs SET last_access=? WHERE album_id=? AND key=?", (int(time.time()), album_id, key))
             await db.commit()
-            return key, row[0]
+            THUMB_CACHE.inc(result="hit")
+            return key, thumbstore.ref_from_row(*row)
+
+    sizes = standard_sizes()
+    if settings.thumb_pyramid and (w, h) in sizes:
+        wanted = sizes
+    else:
+        wanted = [(w, h)]
+    # one render (and lease) per decode: the whole pyramid when it is rendered together
+    render_name = thumb_key(album_id, entry_path, fit, q, 0, 0, fmt) if len(wanted) > 1 else key
+
+    pending = _inflight.get(render_name)
+    if pending is not None:
+        refs = await asyncio.shield(pending)
+        # a render settled by another worker only carries its own size; the rest are registered
+        ref = refs.get(key) or await _registered_ref(db, album_id, key)
+        if ref is not None:
+            THUMB_CACHE.inc(result="shared")
+            return key, ref
 
     # (re)generate
-    os.makedirs(os.path.dirname(file_path), exist_ok=True)
-    img = _open_image_from_path(album_type, album_path, entry_path)
-    img = _resize(img, w, h, fit)
-    save_params = {"format": fmt.upper()}
-    if fmt.lower() == "webp":
-        save_params.update({"quality": q, "method": 4})
-    tmp_path = f"{file_path}.tmp"
-    img.save(tmp_path, **save_params)
-    os.replace(tmp_path, file_path)
-
-    stat = os.stat(file_path)
-    now = int(time.time())
-    await db.execute(
-        """
-        INSERT INTO thumbs(album_id, key, file_path, bytes, width, height, created_at, last_access)
-        VALUES(?,?,?,?,?,?,?,?)
-        ON CONFLICT(album_id, key) DO UPDATE SET
-          file_path=excluded.file_path,
-          bytes=excluded.bytes,
-          width=excluded.width,
-          height=excluded.height,
-          last_access=excluded.last_access
-        """,
-        (album_id, key, file_path, stat.st_size, img.width, img.height, now, now),
-    )
-    await db.commit()
-    return key, file_path
+    targets = [(tw, th, thumb_key(album_id, entry_path, fit, q, tw, th, fmt)) for tw, th in wanted]
+
+    fut: asyncio.Future = asyncio.get_running_loop().create_future()
+    _inflight[render_name] = fut
+    lease_name = "thumb:" + render_name
+    owns_lease = False
+    try:
+        if leases.multi_worker():
+            peer_ref, owns_lease = await _claim_render(db, album_id, key, lease_name)
+            if peer_ref is not None:
+                THUMB_CACHE.inc(result="shared")
+                fut.set_result({key: peer_ref})
+                return key, peer_ref
+        THUMB_CACHE.inc(result="miss")
+        need = admission.estimate_bytes(await admission.read_meta(db, album_id, album_type, album_path, entry_path))
+        async with admission.budget.reserve(need, settings.decode_queue_timeout):
+            rendered, placeholder = await _decode_pool.run(
+                _render_sizes, album_type, album_path, entry_path, targets, fit, fmt, q
+            )
+        # the hit check may have cached "missing" for these paths; they exist now
+        for _, _, _, written, _, _ in rendered:
+            afs.invalidate(written.path)
+        now = int(time.time())
+        await db.executemany(
+            """
+            INSERT INTO thumbs(album_id, key, file_path, pack_offset, bytes, width, height, created_at, last_access)
+            VALUES(?,?,?,?,?,?,?,?,?)
+            ON CONFLICT(album_id, key) DO UPDATE SET
+              file_path=excluded.file_path,
+              pack_offset=excluded.pack_offset,
+              bytes=excluded.bytes,
+              width=excluded.width,
+              height=excluded.height,
+              last_access=excluded.last_access
+            """,
+            [
+                (album_id, tkey, ref.path, ref.offset, ref.length, iw, ih, now, now)
+                for _, _, tkey, ref, iw, ih in rendered
+            ],
+        )
+        if entry_path:
+            # a side effect of the render: listings can paint the entry before its thumbnail loads
+            await db.execute(
+                "UPDATE entries SET placeholder=? WHERE album_id=? AND name=?", (placeholder, album_id, entry_path)
+            )
+        await db.commit()
+        refs = {tkey: r for _, _, tkey, r, _, _ in rendered}
+        ref = refs[key]
+        fut.set_result(refs)
+    except asyncio.CancelledError:
+        fut.cancel()
+        raise
+    except Exception as e:
+        fut.set_exception(e)
+        # mark retrieved so an unawaited failure does not log a warning
+        fut.exception()
+        raise
+    finally:
+        _inflight.pop(render_name, None)
+        if owns_lease:
+            try:
+                await leases.release(db, lease_name)
+            except aiosqlite.Error:
+                # the lease expires on its own
+                pass
+    return key, ref
 
 
 async def lru_cleanup(db: aiosqlite.Connection):
@@ -127,19 +436,109 @@ async def lru_cleanup(db: aiosqlite.Connection):
         return {"removed": 0}
     to_remove = total - settings.cache_max_bytes
     removed = 0
+    victims: list[tuple[int, ThumbRef]] = []
     async with db.execute(
-        "SELECT album_id, key, file_path, bytes FROM thumbs ORDER BY last_access ASC"
+        "SELECT id, file_path, pack_offset, bytes FROM thumbs ORDER BY last_access ASC"
     ) as cur:
-        rows = await cur.fetchall()
-    for album_id, key, file_path, bytes_ in rows:
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception:
-            pass
-        await db.execute("DELETE FROM thumbs WHERE album_id=? AND key=?", (album_id, key))
-        removed += bytes_ or 0
-        if removed >= to_remove:
-            break
+        async for thumb_id, file_path, pack_offset, bytes_ in cur:
+            victims.append((thumb_id, thumbstore.ref_from_row(file_path, pack_offset, bytes_)))
+            removed += bytes_ or 0
+            if removed >= to_remove:
+                break
+    await db.executemany("DELETE FROM thumbs WHERE id=?", [(thumb_id,) for thumb_id, _ in victims])
     await db.commit()
+    # rows go first: a file is never removed while a row still points at it
+    await thumbstore.discard([ref for _, ref in victims])
     return {"removed": removed}
+
+
+# files (thumbnails or pack segments) moved and committed per batch during a cache dir migration
+_MIGRATE_BATCH = 256
+# cache_dir subdirectories holding files referenced by thumbs.file_path
+_THUMB_DIRS = ("thumbs", "packs")
+
+
+def _move_files(pairs: list[tuple[str, str]]) -> tuple[list[str], list[str]]:
+    """Move (src, dst) files; returns (srcs moved, srcs that are gone). Others stay put."""
+    import shutil
+
+    moved: list[str] = []
+    missing: list[str] = []
+    for src, dst in pairs:
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if os.path.exists(dst):
+                # already there (a render after the switch, or a retried job)
+                os.remove(src)
+            else:
+                # os.replace within a filesystem, copy + delete across devices
+                shutil.move(src, dst)
+            moved.append(src)
+        except FileNotFoundError:
+            (moved if os.path.exists(dst) else missing).append(src)
+        except OSError:
+            # in use (an open pack segment on Windows); its rows keep the old path
+            continue
+    return moved, missing
+
+
+def _drop_old_dirs(old_dir: str) -> None:
+    import shutil
+
+    # extracted archives are derived data; they are re-extracted on demand
+    shutil.rmtree(os.path.join(old_dir, "extract"), ignore_errors=True)
+    for sub in _THUMB_DIRS:
+        try:
+            os.rmdir(os.path.join(old_dir, sub))
+        except OSError:
+            # not empty (foreign or in-use files) or already gone
+            pass
+
+
+async def migrate_cache_dir(
+    db: aiosqlite.Connection,
+    old_dir: str,
+    new_dir: str,
+    progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+) -> dict:
+    """Move cached thumbnails from `old_dir` to `new_dir` and repoint their rows.
+
+    Renders keep working while this runs: a row whose file has not moved yet
+    still points at the old file, and one whose file vanished is re-rendered
+    into the new directory on its next request. A pack segment moves once
+    for all the rows stored in it.
+    """
+    if os.path.normcase(os.path.abspath(old_dir)) == os.path.normcase(os.path.abspath(new_dir)):
+        return {"moved": 0, "dropped": 0}
+    moved = dropped = 0
+    for sub in _THUMB_DIRS:
+        # rows hold the path exactly as it was joined from settings.cache_dir
+        old_root = os.path.join(old_dir, sub) + os.sep
+        new_root = os.path.join(new_dir, sub)
+        by_path: dict[str, list[int]] = {}
+        async with db.execute(
+            "SELECT id, file_path FROM thumbs WHERE substr(file_path, 1, ?) = ?", (len(old_root), old_root)
+        ) as cur:
+            async for thumb_id, path in cur:
+                by_path.setdefault(path, []).append(thumb_id)
+        paths = list(by_path)
+        for start in range(0, len(paths), _MIGRATE_BATCH):
+            batch = [(path, os.path.join(new_root, path[len(old_root):])) for path in paths[start:start + _MIGRATE_BATCH]]
+            done, missing = await afs.run_io(_move_files, batch)
+            new_paths = dict(batch)
+            await db.executemany(
+                "UPDATE thumbs SET file_path=? WHERE id=?",
+                [(new_paths[src], thumb_id) for src in done for thumb_id in by_path[src]],
+            )
+            await db.executemany(
+                "DELETE FROM thumbs WHERE id=?", [(thumb_id,) for src in missing for thumb_id in by_path[src]]
+            )
+            await db.commit()
+            for src, _ in batch:
+                afs.invalidate(src)
+            moved += sum(len(by_path[src]) for src in done)
+            dropped += sum(len(by_path[src]) for src in missing)
+            if progress is not None:
+                await progress({"moved": moved, "dropped": dropped, "total": sum(map(len, by_path.values()))})
+    await afs.run_io(_drop_old_dirs, old_dir)
+    return {"moved": moved, "dropped": dropped}
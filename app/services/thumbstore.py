@@ -0,0 +1,204 @@
+"""Where rendered thumbnails are kept.
+
+Two backends share one interface (`put` in a worker thread, `read_blob`,
+`discard`), and every `thumbs` row says which one holds it:
+
+- files (default): one file per thumbnail under `<cache_dir>/thumbs`;
+  `pack_offset` is NULL and `file_path` is the file.
+- pack (`APP_THUMB_STORE=pack`): thumbnails are appended to large segment
+  files under `<cache_dir>/packs`; `file_path` is the segment,
+  `pack_offset`/`bytes` locate the blob. Evicting a row leaves a dead blob
+  behind; `compact` rewrites segments that are mostly dead.
+
+Switching backends needs no migration: existing rows keep being served
+from where they are and new renders go to the configured store.
+"""
+from __future__ import annotations
+import hashlib
+import os
+import time
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+import aiosqlite
+
+from ..settings import settings
+from ..utils import afs, packfile
+from . import leases
+from .encoders import Encoder, encode_to_bytes, encode_to_file
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+
+# a writer rolls over to a new segment past this size
+PACK_SEGMENT_BYTES = 256 * 1024 * 1024
+# segments with at least this share of dead bytes are rewritten by compact()
+COMPACT_DEAD_RATIO = 0.5
+# segments written to more recently than this may still be another
+# process's active segment and are left alone
+COMPACT_IDLE_SECONDS = 300.0
+
+
+class ThumbRef(NamedTuple):
+    path: str
+    # None: `path` is the whole thumbnail; else the blob's offset in a segment
+    offset: Optional[int]
+    length: int
+
+
+class FileStore:
+    name = "files"
+
+    def put(self, key: str, encoder: Encoder, img: Image.Image, quality: int) -> ThumbRef:
+        path = os.path.join(settings.cache_dir, "thumbs", key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        nbytes = encode_to_file(encoder, img, tmp_path, quality)
+        os.replace(tmp_path, path)
+        return ThumbRef(path, None, nbytes)
+
+
+class PackStore:
+    name = "pack"
+
+    def __init__(self) -> None:
+        # one writer (and so one active segment) per process
+        self.writer = packfile.PackWriter(
+            lambda: os.path.join(settings.cache_dir, "packs"),
+            hashlib.sha1(leases.OWNER.encode("utf-8")).hexdigest()[:8],
+            PACK_SEGMENT_BYTES,
+        )
+
+    def put(self, key: str, encoder: Encoder, img: Image.Image, quality: int) -> ThumbRef:
+        data = encode_to_bytes(encoder, img, quality)
+        path, offset = self.writer.append(data)
+        return ThumbRef(path, offset, len(data))
+
+
+STORES = {"files": FileStore(), "pack": PackStore()}
+
+
+def get_store():
+    return STORES.get(settings.thumb_store, STORES["files"])
+
+
+def close() -> None:
+    """Close this process's active pack segment (shutdown)."""
+    STORES["pack"].writer.close()
+
+
+def ref_from_row(file_path: str, pack_offset: Optional[int], nbytes: int) -> ThumbRef:
+    return ThumbRef(file_path, pack_offset, nbytes or 0)
+
+
+async def read_blob(ref: ThumbRef) -> bytes:
+    """Bytes of a packed thumbnail (one pread); FileNotFoundError if its segment is gone."""
+    return await afs.run_io(packfile.read_slice, ref.path, ref.offset, ref.length)
+
+
+def _remove_files(paths: List[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+async def discard(refs: List[ThumbRef]) -> None:
+    """Free storage of thumbnails whose rows were already deleted.
+
+    Standalone files are removed in one batch on the I/O pool; packed
+    blobs are dead as soon as no row points at them.
+    """
+    files = [ref.path for ref in refs if ref.offset is None]
+    if not files:
+        return
+    try:
+        await afs.run_io(_remove_files, files)
+    finally:
+        for path in files:
+            afs.invalidate(path)
+
+
+def _list_segments(root: str) -> List[tuple]:
+    out = []
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return out
+    for name in names:
+        if not name.endswith(packfile.SUFFIX):
+            continue
+        path = os.path.join(root, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        out.append((path, st.st_size, st.st_mtime))
+    return out
+
+
+def _copy_live(store: PackStore, path: str, rows: List[tuple]) -> List[tuple]:
+    """Append the live blobs (id, offset, length) of `path` to the active segment."""
+    moved = []
+    for thumb_id, offset, length in rows:
+        try:
+            data = packfile.read_slice(path, offset, length)
+        except (OSError, EOFError):
+            # unreadable blob: leave the row; its render is redone on demand
+            continue
+        new_path, new_offset = store.writer.append(data)
+        moved.append((new_path, new_offset, thumb_id, path, offset))
+    return moved
+
+
+async def compact(
+    db: aiosqlite.Connection,
+    progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+) -> Dict[str, int]:
+    """Delete dead segments and rewrite mostly-dead ones into the active segment."""
+    store = STORES["pack"]
+    segments = await afs.run_io(_list_segments, os.path.join(settings.cache_dir, "packs"))
+    if not segments:
+        return {"segments_removed": 0, "bytes_reclaimed": 0}
+    live: Dict[str, int] = {}
+    async with db.execute(
+        "SELECT file_path, SUM(bytes) FROM thumbs WHERE pack_offset IS NOT NULL GROUP BY file_path"
+    ) as cur:
+        async for path, nbytes in cur:
+            live[path] = nbytes or 0
+    removed = reclaimed = 0
+    idle_before = time.time() - COMPACT_IDLE_SECONDS
+    for path, size, mtime in segments:
+        if path == store.writer.active_path or mtime > idle_before:
+            continue
+        live_bytes = live.get(path, 0)
+        if live_bytes and size - live_bytes < size * COMPACT_DEAD_RATIO:
+            continue
+        if live_bytes:
+            async with db.execute(
+                "SELECT id, pack_offset, bytes FROM thumbs WHERE file_path=? AND pack_offset IS NOT NULL"
+                " ORDER BY pack_offset",
+                (path,),
+            ) as cur:
+                rows = await cur.fetchall()
+            moved = await afs.run_io(_copy_live, store, path, rows)
+            # a row changed meanwhile (evicted, re-rendered) keeps its new value
+            await db.executemany(
+                "UPDATE thumbs SET file_path=?, pack_offset=? WHERE id=? AND file_path=? AND pack_offset=?",
+                moved,
+            )
+            await db.commit()
+            if len(moved) < len(rows):
+                # some blobs could not be copied; keep the segment for them
+                continue
+        try:
+            await afs.remove(path)
+        except OSError:
+            # still open elsewhere (Windows); it has no live rows, next run retries
+            continue
+        removed += 1
+        reclaimed += size - live_bytes
+        if progress is not None:
+            await progress({"segments_removed": removed, "bytes_reclaimed": reclaimed})
+    return {"segments_removed": removed, "bytes_reclaimed": reclaimed}
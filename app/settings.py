@@ -8,10 +8,37 @@ class AppSettings(BaseModel):
     cache_max_bytes: int = int(os.getenv("APP_CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
     default_quality: int = int(os.getenv("APP_DEFAULT_QUALITY", 75))
     encode_format: str = os.getenv("APP_ENCODE_FORMAT", "webp")
+    webp_method: int = int(os.getenv("APP_WEBP_METHOD", 4))
+    avif_speed: int = int(os.getenv("APP_AVIF_SPEED", 8))
     io_concurrency: int = int(os.getenv("APP_IO_CONCURRENCY", 8))
+    # seconds a stat()/exists() result is reused by app.utils.afs; 0 disables the cache
+    stat_cache_ttl: float = float(os.getenv("APP_STAT_CACHE_TTL", 2.0))
     decode_concurrency: int = int(os.getenv("APP_DECODE_CONCURRENCY", 3))
     allow_recursive: bool = os.getenv("APP_ALLOW_RECURSIVE", "false").lower() == "true"
     max_input_pixels: int = int(os.getenv("APP_MAX_INPUT_PIXELS", 178_000_000))
+    # estimated peak bytes of all thumbnail decodes running at once (per process)
+    decode_memory_budget: int = int(os.getenv("APP_DECODE_MEMORY_BUDGET", 1024 * 1024 * 1024))
+    # seconds a decode may wait for the memory budget before the request gets a 503
+    decode_queue_timeout: float = float(os.getenv("APP_DECODE_QUEUE_TIMEOUT", 30.0))
+    # read image headers (width/height/format) of every entry while scanning
+    scan_probe_dimensions: bool = os.getenv("APP_SCAN_PROBE_DIMENSIONS", "true").lower() == "true"
+    # standard thumbnail sizes ("WxH,WxH"); one decode renders all of them
+    thumb_sizes: str = os.getenv("APP_THUMB_SIZES", "300x400,450x300,640x960")
+    # where thumbnails are kept: "files" (one file each) or "pack" (append-only segment files)
+    thumb_store: str = os.getenv("APP_THUMB_STORE", "files")
+    thumb_pyramid: bool = os.getenv("APP_THUMB_PYRAMID", "true").lower() == "true"
+    # solid archives (7z, solid RAR, .tar.gz) kept extracted under cache_dir/extract
+    extract_cache_archives: int = int(os.getenv("APP_EXTRACT_CACHE_ARCHIVES", 8))
+    # checkpoint (and truncate) the SQLite WAL once it grows past this many bytes
+    db_wal_checkpoint_bytes: int = int(os.getenv("APP_DB_WAL_CHECKPOINT_BYTES", 64 * 1024 * 1024))
+    # responses at least this large are compressed (brotli or gzip, as the client accepts)
+    compress_min_bytes: int = int(os.getenv("APP_COMPRESS_MIN_BYTES", 1024))
+    # uvicorn worker processes; >1 coordinates renders/jobs/events through SQLite
+    workers: int = int(os.getenv("APP_WORKERS", 1))
+    # background job workers; scans hold the SQLite write lock, so keep this small
+    job_workers: int = int(os.getenv("APP_JOB_WORKERS", 1))
+    # admin diagnostics (sampling profiler); off unless explicitly enabled
+    enable_profiler: bool = os.getenv("APP_ENABLE_PROFILER", "false").lower() == "true"
     # optional full path to LocalViewer executable on host (Windows). If empty, feature is disabled.
     LocalViewer_path: str | None = os.getenv("APP_LocalViewer_PATH", "D:\\myprogram\\BandiView\\BandiView.exe")
 
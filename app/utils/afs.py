@@ -0,0 +1,119 @@
+"""Event-loop-safe filesystem helpers.
+
+Every call runs on a dedicated thread pool sized by `settings.io_concurrency`,
+so slow network shares stall a bounded number of threads instead of the event
+loop. `stat`/`exists`/`isdir`/`isfile` results are cached for a short TTL,
+including "missing" results; writes and removals through this module
+invalidate the affected path.
+"""
+from __future__ import annotations
+import os
+import stat as stat_mod
+import time
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+from ..settings import settings
+from .pools import ResizablePool
+
+T = TypeVar("T")
+
+# entries beyond this are dropped oldest-first; keeps the cache O(working set)
+_STAT_CACHE_MAX = 20_000
+
+_io_pool = ResizablePool("myread-io", lambda: settings.io_concurrency)
+_stat_cache: Dict[str, Tuple[float, Optional[os.stat_result]]] = {}
+
+
+def resize_pool(workers: int) -> None:
+    """Swap in a pool of a new size; work already queued finishes on the old one."""
+    _io_pool.resize(workers)
+    settings.io_concurrency = _io_pool.size
+
+
+async def run_io(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run blocking filesystem work on the I/O pool."""
+    return await _io_pool.run(fn, *args, **kwargs)
+
+
+def invalidate(path: str | None = None) -> None:
+    """Forget cached stat results for `path` (or everything)."""
+    if path is None:
+        _stat_cache.clear()
+    else:
+        _stat_cache.pop(path, None)
+
+
+def _stat_or_none(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+async def stat(path: str, cached: bool = True) -> Optional[os.stat_result]:
+    """os.stat off the event loop; returns None when the path does not exist."""
+    now = time.monotonic()
+    if cached:
+        hit = _stat_cache.get(path)
+        if hit is not None and hit[0] > now:
+            return hit[1]
+    result = await run_io(_stat_or_none, path)
+    ttl = settings.stat_cache_ttl
+    if ttl > 0:
+        if len(_stat_cache) >= _STAT_CACHE_MAX:
+            # dicts keep insertion order: drop the oldest tenth
+            for key in list(_stat_cache)[: _STAT_CACHE_MAX // 10]:
+                _stat_cache.pop(key, None)
+        _stat_cache[path] = (now + ttl, result)
+    return result
+
+
+async def exists(path: str, cached: bool = True) -> bool:
+    return await stat(path, cached) is not None
+
+
+async def isdir(path: str, cached: bool = True) -> bool:
+    st = await stat(path, cached)
+    return st is not None and stat_mod.S_ISDIR(st.st_mode)
+
+
+async def isfile(path: str, cached: bool = True) -> bool:
+    st = await stat(path, cached)
+    return st is not None and stat_mod.S_ISREG(st.st_mode)
+
+
+def _remove_sync(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def remove(path: str) -> bool:
+    """Remove a file; returns False if it was already gone."""
+    try:
+        return await run_io(_remove_sync, path)
+    finally:
+        invalidate(path)
+
+
+async def makedirs(path: str) -> None:
+    await run_io(os.makedirs, path, exist_ok=True)
+    invalidate(path)
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+async def write_bytes(path: str, data: bytes) -> None:
+    """Write `data` to `path` atomically (tmp file + replace)."""
+    try:
+        await run_io(_write_atomic, path, data)
+    finally:
+        invalidate(path)
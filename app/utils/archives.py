@@ -0,0 +1,493 @@
+"""Archive providers: one interface for every archive format an album can be.
+
+Each provider lists member names and opens a single member for reading; the
+scanner, the entries listing and the thumbnail pipeline only talk to this
+module. ZIP/CBZ and plain TAR members are read in place (see zipread). For
+solid or stream-only formats (RAR/CBR solid archives, 7z, compressed tar)
+reaching member N means decompressing everything before it, so once an
+album is paged through its images are extracted once into
+`<cache_dir>/extract/` and later pages are served from there.
+
+RAR and 7z support is optional: `rarfile` (plus an unrar/bsdtar tool) and
+`py7zr` are imported on first use, and archives whose backend is missing are
+skipped by the scanner.
+"""
+from __future__ import annotations
+import hashlib
+import io
+import mmap
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from functools import lru_cache
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple, TypeVar
+
+from ..settings import settings
+from . import zipread
+from .fs import is_image_name
+from .zipscan import iter_zip_names
+
+
+T = TypeVar("T")
+# bytes of each member kept when a format can only be read front to back
+HEAD_BYTES = 256 * 1024
+
+
+class ArchiveError(Exception):
+    """The file is not a readable archive of its kind."""
+
+
+class ArchiveProvider:
+    # album type stored in albums.type
+    kind = ""
+    extensions: Tuple[str, ...] = ()
+
+    def available(self) -> bool:
+        """False when the optional backend for this format is not installed."""
+        return True
+
+    def bad_archive_errors(self) -> Tuple[type, ...]:
+        return ()
+
+    def iter_names(self, path: str) -> Iterator[str]:
+        """Yield names of the file members (not directories) in archive order."""
+        raise NotImplementedError
+
+    def read_member(self, path: str, name: str) -> BinaryIO:
+        """Open one member directly, decompressing whatever precedes it."""
+        raise NotImplementedError
+
+    def is_solid(self, path: str) -> bool:
+        """True when random access costs a decompression from the start."""
+        return False
+
+    def probe_images(self, path: str, probe: Callable[[BinaryIO], T]) -> Iterator[Tuple[str, T]]:
+        """Yield (name, probe(stream)) for every image member in one pass.
+
+        `probe` should read only what it needs (e.g. an image header).
+        """
+        for name in self.iter_names(path):
+            if is_image_name(name):
+                with self.read_member(path, name) as f:
+                    yield name, probe(f)
+
+    def extract(self, path: str, names: List[str], dest: str) -> None:
+        """Write `names` under `dest`, keeping their relative paths."""
+        for name in names:
+            target = _member_path(dest, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with self.read_member(path, name) as src, open(target, "wb") as out:
+                shutil.copyfileobj(src, out, 1024 * 1024)
+
+
+class ZipProvider(ArchiveProvider):
+    kind = "zip"
+    extensions = (".zip", ".cbz")
+
+    def bad_archive_errors(self) -> Tuple[type, ...]:
+        return (zipfile.BadZipFile,)
+
+    def iter_names(self, path: str) -> Iterator[str]:
+        for name in iter_zip_names(path):
+            if not name.endswith("/"):
+                yield name
+
+    def read_member(self, path: str, name: str) -> BinaryIO:
+        try:
+            # one bulk read + inflate (or an mmap window for STORED members)
+            return zipread.open_member(path, name)
+        except zipread.UnsupportedMember:
+            pass
+        # encrypted or exotic compression: let zipfile handle (or reject) it
+        with zipfile.ZipFile(path, "r") as zf:
+            return io.BytesIO(zf.read(name))
+
+    def probe_images(self, path: str, probe: Callable[[BinaryIO], T]) -> Iterator[Tuple[str, T]]:
+        # zipfile streams each member, so a header read inflates only a few KB
+        with zipfile.ZipFile(path, "r") as zf:
+            for info in zf.infolist():
+                if info.is_dir() or not is_image_name(info.filename) or info.flag_bits & 0x1:
+                    continue
+                with zf.open(info) as f:
+                    yield info.filename, probe(f)
+
+
+_TAR_COMPRESSED_MAGIC = (b"\x1f\x8b", b"BZh", b"\xfd7zXZ\x00")
+
+
+@lru_cache(maxsize=32)
+def _tar_index(path: str, size: int, mtime_ns: int) -> Dict[str, Tuple[int, int]]:
+    # walks every header once; size/mtime in the key re-index rewritten files
+    index: Dict[str, Tuple[int, int]] = {}
+    with tarfile.open(path, "r:") as tf:
+        for info in tf:
+            if info.isreg() and not info.issparse():
+                index[info.name] = (info.offset_data, info.size)
+    return index
+
+
+class TarProvider(ArchiveProvider):
+    kind = "tar"
+    extensions = (".tar", ".cbt", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+    def bad_archive_errors(self) -> Tuple[type, ...]:
+        return (tarfile.TarError, EOFError)
+
+    def iter_names(self, path: str) -> Iterator[str]:
+        with tarfile.open(path, "r:*") as tf:
+            for info in tf:
+                if info.isreg():
+                    yield info.name
+
+    def is_solid(self, path: str) -> bool:
+        with open(path, "rb") as f:
+            head = f.read(6)
+        return head.startswith(_TAR_COMPRESSED_MAGIC)
+
+    def read_member(self, path: str, name: str) -> BinaryIO:
+        if not self.is_solid(path):
+            st = os.stat(path)
+            entry = _tar_index(path, st.st_size, st.st_mtime_ns).get(name)
+            if entry is not None:
+                offset, size = entry
+                if size == 0:
+                    return zipread.MemberReader(memoryview(b""))
+                with open(path, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if offset + size > len(mm):
+                    mm.close()
+                    raise tarfile.ReadError("truncated member data")
+                return zipread.MemberReader(memoryview(mm)[offset:offset + size], on_close=mm.close)
+        with tarfile.open(path, "r:*") as tf:
+            member = tf.extractfile(name)
+            if member is None:
+                raise KeyError(name)
+            return io.BytesIO(member.read())
+
+    def probe_images(self, path: str, probe: Callable[[BinaryIO], T]) -> Iterator[Tuple[str, T]]:
+        # stream mode: compressed tars are decompressed once, front to back
+        with tarfile.open(path, "r|*") as tf:
+            for info in tf:
+                if info.isreg() and is_image_name(info.name):
+                    yield info.name, probe(tf.extractfile(info))
+
+    def extract(self, path: str, names: List[str], dest: str) -> None:
+        # one sequential pass over the stream instead of one per member
+        wanted = set(names)
+        with tarfile.open(path, "r|*") as tf:
+            for info in tf:
+                if info.name not in wanted or not info.isreg():
+                    continue
+                target = _member_path(dest, info.name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                src = tf.extractfile(info)
+                with open(target, "wb") as out:
+                    shutil.copyfileobj(src, out, 1024 * 1024)
+
+
+class RarProvider(ArchiveProvider):
+    kind = "rar"
+    extensions = (".rar", ".cbr")
+
+    def available(self) -> bool:
+        return _optional("rarfile")
+
+    def bad_archive_errors(self) -> Tuple[type, ...]:
+        import rarfile
+
+        return (rarfile.Error,)
+
+    def iter_names(self, path: str) -> Iterator[str]:
+        import rarfile
+
+        with rarfile.RarFile(path) as rf:
+            for info in rf.infolist():
+                if not info.is_dir():
+                    yield info.filename
+
+    def is_solid(self, path: str) -> bool:
+        import rarfile
+
+        with rarfile.RarFile(path) as rf:
+            return bool(rf.is_solid())
+
+    def read_member(self, path: str, name: str) -> BinaryIO:
+        import rarfile
+
+        with rarfile.RarFile(path) as rf:
+            return io.BytesIO(rf.read(name))
+
+    def probe_images(self, path: str, probe: Callable[[BinaryIO], T]) -> Iterator[Tuple[str, T]]:
+        import rarfile
+
+        with rarfile.RarFile(path) as rf:
+            if rf.is_solid():
+                # each open() would decompress from the start; left to first view
+                return
+            for info in rf.infolist():
+                if not info.is_dir() and is_image_name(info.filename):
+                    with rf.open(info) as f:
+                        yield info.filename, probe(f)
+
+    def extract(self, path: str, names: List[str], dest: str) -> None:
+        import rarfile
+
+        # a single unrar run decompresses the solid stream once
+        with rarfile.RarFile(path) as rf:
+            rf.extractall(dest, members=names)
+
+
+class SevenZipProvider(ArchiveProvider):
+    kind = "7z"
+    extensions = (".7z", ".cb7")
+
+    def available(self) -> bool:
+        return _optional("py7zr")
+
+    def bad_archive_errors(self) -> Tuple[type, ...]:
+        import py7zr
+
+        return (py7zr.Bad7zFile, py7zr.exceptions.ArchiveError)
+
+    def iter_names(self, path: str) -> Iterator[str]:
+        import py7zr
+
+        with py7zr.SevenZipFile(path, "r") as zf:
+            for info in zf.list():
+                if not info.is_directory:
+                    yield info.filename
+
+    def is_solid(self, path: str) -> bool:
+        # py7zr has no per-member stream; every read goes through extraction
+        return True
+
+    def read_member(self, path: str, name: str) -> BinaryIO:
+        if not _safe_name(name):
+            raise KeyError(name)
+        with tempfile.TemporaryDirectory(prefix="myread-7z-") as tmp:
+            self.extract(path, [name], tmp)
+            with open(_member_path(tmp, name), "rb") as f:
+                return io.BytesIO(f.read())
+
+    def probe_images(self, path: str, probe: Callable[[BinaryIO], T]) -> Iterator[Tuple[str, T]]:
+        import py7zr
+
+        try:
+            from py7zr.io import Py7zIO, WriterFactory
+        except ImportError:
+            # py7zr < 1.0 can only extract whole members to disk
+            return
+
+        class Head(Py7zIO):
+            # keeps the first HEAD_BYTES of a member; the rest is dropped
+            def __init__(self) -> None:
+                self.buf = bytearray()
+
+            def write(self, s) -> int:
+                if len(self.buf) < HEAD_BYTES:
+                    self.buf += s[:HEAD_BYTES - len(self.buf)]
+                return len(s)
+
+            def read(self, size=None) -> bytes:
+                return b""
+
+            def seek(self, offset: int, whence: int = 0) -> int:
+                return 0
+
+            def flush(self) -> None:
+                pass
+
+            def size(self) -> int:
+                return len(self.buf)
+
+        class Heads(WriterFactory):
+            def __init__(self) -> None:
+                self.products: Dict[str, Head] = {}
+
+            def create(self, filename: str) -> Head:
+                return self.products.setdefault(filename, Head())
+
+        with py7zr.SevenZipFile(path, "r") as zf:
+            names = [i.filename for i in zf.list() if not i.is_directory and is_image_name(i.filename)]
+            heads = Heads()
+            # one decompression pass over the solid stream
+            zf.extract(targets=names, factory=heads)
+        for name in names:
+            head = heads.products.get(name)
+            if head is not None:
+                yield name, probe(io.BytesIO(bytes(head.buf)))
+
+    def extract(self, path: str, names: List[str], dest: str) -> None:
+        import py7zr
+
+        with py7zr.SevenZipFile(path, "r") as zf:
+            zf.extract(path=dest, targets=names)
+
+
+PROVIDERS: Tuple[ArchiveProvider, ...] = (ZipProvider(), TarProvider(), RarProvider(), SevenZipProvider())
+_BY_KIND = {p.kind: p for p in PROVIDERS}
+# longest extension first, so compound ones like ".tar.gz" are matched whole
+_BY_EXT = sorted(((ext, p) for p in PROVIDERS for ext in p.extensions), key=lambda e: -len(e[0]))
+
+
+@lru_cache(maxsize=None)
+def _optional(module: str) -> bool:
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+def provider_for_name(name: str) -> ArchiveProvider | None:
+    """Provider for a file name by extension; None if unsupported or its backend is missing."""
+    lower = name.lower()
+    for ext, provider in _BY_EXT:
+        if lower.endswith(ext):
+            return provider if provider.available() else None
+    return None
+
+
+def provider_for_kind(kind: str) -> ArchiveProvider | None:
+    """Provider for an album type; None if unknown or its backend is missing.
+
+    An album recorded while the backend was installed can outlive it.
+    """
+    provider = _BY_KIND.get(kind)
+    return provider if provider is not None and provider.available() else None
+
+
+def is_archive_kind(kind: str) -> bool:
+    """True for an archive album type, whether or not its backend is installed."""
+    return kind in _BY_KIND
+
+
+def is_archive_name(name: str) -> bool:
+    return provider_for_name(name) is not None
+
+
+def _safe_name(name: str) -> bool:
+    parts = name.replace("\\", "/").split("/")
+    return not name.startswith(("/", "\\")) and ":" not in parts[0] and ".." not in parts
+
+
+def _member_path(root: str, name: str) -> str:
+    return os.path.join(root, *name.replace("\\", "/").split("/"))
+
+
+def probe_images(provider: ArchiveProvider, path: str, probe: Callable[[BinaryIO], T]) -> List[Tuple[str, T]]:
+    """Run `probe` on every image member; raises ArchiveError."""
+    try:
+        return list(provider.probe_images(path, probe))
+    except provider.bad_archive_errors() as e:
+        raise ArchiveError(f"{path}: {e}") from e
+
+
+def image_names(provider: ArchiveProvider, path: str) -> List[str]:
+    """Image member names in archive order; raises ArchiveError."""
+    try:
+        return [n for n in provider.iter_names(path) if is_image_name(n)]
+    except provider.bad_archive_errors() as e:
+        raise ArchiveError(f"{path}: {e}") from e
+
+
+# --- extracted-member cache for solid archives ---
+
+# archives read once stay uncached (album covers touch one member each); the
+# second distinct member read from the same archive means someone is paging
+_recent_reads: "OrderedDict[str, str]" = OrderedDict()
+_RECENT_READS_MAX = 256
+_extract_locks: Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def _extract_root() -> str:
+    return os.path.join(settings.cache_dir, "extract")
+
+
+def _cache_tag(path: str) -> str:
+    st = os.stat(path)
+    return hashlib.sha1(f"{path}\0{st.st_size}\0{st.st_mtime_ns}".encode("utf-8")).hexdigest()[:20]
+
+
+def _wants_cache(tag: str, name: str) -> bool:
+    with _locks_guard:
+        previous = _recent_reads.pop(tag, None)
+        _recent_reads[tag] = name
+        if len(_recent_reads) > _RECENT_READS_MAX:
+            _recent_reads.popitem(last=False)
+    return previous is not None and previous != name
+
+
+def _evict(keep: str) -> None:
+    root = _extract_root()
+    try:
+        dirs = [e for e in os.scandir(root) if e.is_dir() and "." not in e.name and e.name != keep]
+    except FileNotFoundError:
+        return
+    excess = len(dirs) + 1 - max(1, settings.extract_cache_archives)
+    if excess <= 0:
+        return
+    dirs.sort(key=lambda e: e.stat().st_mtime)
+    for entry in dirs[:excess]:
+        # readers holding a file open keep it on POSIX; Windows may refuse, retry next time
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _ensure_extracted(provider: ArchiveProvider, path: str, tag: str) -> str:
+    final = os.path.join(_extract_root(), tag)
+    with _locks_guard:
+        lock = _extract_locks.setdefault(tag, threading.Lock())
+    with lock:
+        if os.path.isdir(final):
+            # mtime doubles as the LRU clock for eviction
+            os.utime(final)
+            return final
+        names = [n for n in provider.iter_names(path) if is_image_name(n) and _safe_name(n)]
+        tmp = tempfile.mkdtemp(prefix=f"{tag}.", dir=_makedirs(_extract_root()))
+        try:
+            provider.extract(path, names, tmp)
+            try:
+                os.rename(tmp, final)
+            except OSError:
+                # another process finished the same archive first
+                if not os.path.isdir(final):
+                    raise
+                shutil.rmtree(tmp, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        _evict(keep=tag)
+        return final
+
+
+def _makedirs(path: str) -> str:
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def open_member(provider: ArchiveProvider, path: str, name: str) -> BinaryIO:
+    """Open member `name` for reading; close the result when done.
+
+    Raises KeyError for missing members and ArchiveError for unreadable archives.
+    """
+    try:
+        if not provider.is_solid(path):
+            return provider.read_member(path, name)
+        tag = _cache_tag(path)
+        cached = os.path.join(_extract_root(), tag)
+        if not os.path.isdir(cached) and not _wants_cache(tag, name):
+            return provider.read_member(path, name)
+        if not _safe_name(name):
+            raise KeyError(name)
+        root = _ensure_extracted(provider, path, tag)
+        try:
+            return open(_member_path(root, name), "rb")
+        except FileNotFoundError:
+            raise KeyError(name) from None
+    except provider.bad_archive_errors() as e:
+        raise ArchiveError(f"{path}: {e}") from e
@@ -0,0 +1,187 @@
+"""Response compression: brotli when the client and the server support it, else gzip.
+
+Bodies under `minimum_size` go out as they are; images, archives, fonts
+and event streams are never compressed, nor are responses that already
+carry a Content-Encoding or are partial; file responses sent with
+pathsend are left alone, and streaming responses are compressed chunk by
+chunk (flushed, so each chunk reaches the client promptly). `brotli` is an
+optional dependency; without it only gzip is offered.
+"""
+from __future__ import annotations
+import zlib
+
+import anyio.to_thread
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+# bodies at least this large are compressed in a worker thread
+THREAD_MINIMUM_SIZE = 128 * 1024
+# media types (or type/* families) sent uncompressed: already compressed, or streamed events
+EXCLUDED_CONTENT_TYPES = (
+    "image/*",
+    "video/*",
+    "audio/*",
+    "font/woff",
+    "font/woff2",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "text/event-stream",
+)
+
+
+def _accepts(accept_encoding: str, coding: str) -> bool:
+    """True if `coding` is listed in Accept-Encoding without q=0."""
+    for part in accept_encoding.lower().split(","):
+        name, *params = part.split(";")
+        if name.strip() != coding:
+            continue
+        for param in params:
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
+
+
+def _excluded(content_type: str) -> bool:
+    media_type = content_type.partition(";")[0].strip().lower()
+    return media_type in EXCLUDED_CONTENT_TYPES or media_type.partition("/")[0] + "/*" in EXCLUDED_CONTENT_TYPES
+
+
+class _Responder:
+    """Wraps one response; subclasses provide the encoder."""
+
+    content_encoding = ""
+
+    def __init__(self, app: ASGIApp, minimum_size: int) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.send: Send | None = None
+        self.start: Message | None = None
+        self.start_sent = False
+        # leave the body alone (already encoded, partial, excluded type)
+        self.passthrough = False
+        self.started = False
+        self.compressing = False
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self._send)
+
+    async def _send_start(self) -> None:
+        if self.start is not None and not self.start_sent:
+            self.start_sent = True
+            await self.send(self.start)
+
+    async def _send(self, message: Message) -> None:
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            self.start = message
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] in (204, 206, 304)
+                or _excluded(headers.get("content-type", ""))
+            )
+            if self.passthrough:
+                await self._send_start()
+            return
+        if message_type != "http.response.body" or self.passthrough:
+            # pathsend, trailers, early hints: headers first, body untouched
+            await self._send_start()
+            await self.send(message)
+            return
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if not self.started:
+            self.started = True
+            if len(body) < self.minimum_size and not more_body:
+                await self._send_start()
+                await self.send(message)
+                return
+            self.compressing = True
+            body = await self._compress(body, more_body)
+            headers = MutableHeaders(raw=self.start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            headers["Content-Encoding"] = self.content_encoding
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                headers["Content-Length"] = str(len(body))
+            await self._send_start()
+            await self.send({**message, "body": body})
+            return
+        if self.compressing:
+            message = {**message, "body": await self._compress(body, more_body)}
+        await self.send(message)
+
+    async def _compress(self, body: bytes, more_body: bool) -> bytes:
+        if len(body) >= THREAD_MINIMUM_SIZE:
+            # compressing large bodies inline would stall the event loop
+            return await anyio.to_thread.run_sync(self._compress_body, body, more_body)
+        return self._compress_body(body, more_body)
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        raise NotImplementedError
+
+
+class GZipResponder(_Responder):
+    content_encoding = "gzip"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, level: int) -> None:
+        super().__init__(app, minimum_size)
+        self.level = level
+        self._compressor = None
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            # wbits 16 + MAX_WBITS: gzip container rather than raw zlib
+            self._compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        out = self._compressor.compress(body)
+        return out + self._compressor.flush(zlib.Z_SYNC_FLUSH if more_body else zlib.Z_FINISH)
+
+
+class BrotliResponder(_Responder):
+    content_encoding = "br"
+
+    def __init__(self, app: ASGIApp, minimum_size: int, quality: int) -> None:
+        super().__init__(app, minimum_size)
+        self.quality = quality
+        self._compressor = None
+
+    def _compress_body(self, body: bytes, more_body: bool) -> bytes:
+        if self._compressor is None:
+            self._compressor = brotli.Compressor(quality=self.quality)
+        out = self._compressor.process(body)
+        return out + (self._compressor.flush() if more_body else self._compressor.finish())
+
+
+class CompressionMiddleware:
+    def __init__(
+        self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4
+    ) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        if brotli is not None and _accepts(accept, "br"):
+            await BrotliResponder(self.app, self.minimum_size, self.brotli_quality)(scope, receive, send)
+        elif _accepts(accept, "gzip"):
+            await GZipResponder(self.app, self.minimum_size, self.gzip_level)(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
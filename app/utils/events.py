@@ -1,27 +1,147 @@
 from __future__ import annotations
 import asyncio
-from typing import Any, Dict, Set
+from collections import OrderedDict, deque
+from typing import Any, Dict, Hashable, Iterable, List, Set, Tuple
+
+# events whose newer payloads supersede older ones for the same field value;
+# a slow subscriber only ever holds the latest progress per path / job
+COALESCE_FIELDS: Dict[str, str] = {
+    "scan:progress": "path",
+    "job:progress": "job_id",
+    "refresh:progress": "phase",
+}
+
+
+def _topic_matches(event: str, topics: Set[str] | None) -> bool:
+    if not topics:
+        return True
+    return event in topics or event.split(":", 1)[0] in topics
+
+
+class Subscription:
+    """Bounded pending-event buffer for one subscriber.
+
+    Events sharing a coalesce key replace each other; when the buffer is full
+    the oldest event is dropped and counted so the client can resync.
+    """
+
+    def __init__(self, topics: Set[str] | None, max_pending: int) -> None:
+        self.topics = topics
+        self.max_pending = max(1, max_pending)
+        self.dropped = 0
+        self._pending: "OrderedDict[Hashable, Dict[str, Any]]" = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def offer(self, item: Dict[str, Any], key: Hashable | None) -> None:
+        if not _topic_matches(item["event"], self.topics):
+            return
+        slot = key if key is not None else item["id"]
+        if slot in self._pending:
+            # move to the end so ids stay ascending within a batch
+            del self._pending[slot]
+        elif len(self._pending) >= self.max_pending:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+        self._pending[slot] = item
+        self._ready.set()
+
+    async def next_batch(self, interval: float = 0.0) -> Tuple[List[Dict[str, Any]], int]:
+        """Wait for at least one event, then collect what arrives within `interval`."""
+        await self._ready.wait()
+        if interval > 0:
+            await asyncio.sleep(interval)
+        items = list(self._pending.values())
+        self._pending.clear()
+        self._ready.clear()
+        dropped, self.dropped = self.dropped, 0
+        return items, dropped
 
 
 class EventBus:
-    def __init__(self) -> None:
-        self._subs: Set[asyncio.Queue] = set()
+    def __init__(self, max_pending: int = 256, history_size: int = 512) -> None:
+        self._subs: Set[Subscription] = set()
+        self._seq = 0
+        self._history: deque[Dict[str, Any]] = deque(maxlen=history_size)
+        self.max_pending = max_pending
+        self._outbox: List[Tuple[str, Dict[str, Any]]] | None = None
 
-    def subscribe(self) -> asyncio.Queue:
-        q: asyncio.Queue = asyncio.Queue()
-        self._subs.add(q)
-        return q
+    @property
+    def last_id(self) -> int:
+        return self._seq
 
-    def unsubscribe(self, q: asyncio.Queue) -> None:
-        self._subs.discard(q)
+    def subscribe(
+        self,
+        topics: Iterable[str] | None = None,
+        last_event_id: int | None = None,
+    ) -> Tuple[Subscription, bool]:
+        """Register a subscriber, replaying history newer than `last_event_id`.
+
+        Returns (subscription, complete). `complete` is False when the ring
+        buffer no longer covers the requested id (or the id is from a previous
+        process), in which case the client should do a full refresh.
+        """
+        sub = Subscription(set(topics) if topics else None, self.max_pending)
+        complete = True
+        if last_event_id is not None:
+            oldest = self._history[0]["id"] if self._history else self._seq + 1
+            if last_event_id > self._seq or last_event_id < oldest - 1:
+                complete = False
+            for item in self._history:
+                if item["id"] > last_event_id:
+                    sub.offer(item, self._coalesce_key(item["event"], item["data"]))
+        self._subs.add(sub)
+        return sub, complete
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        self._subs.discard(sub)
+
+    @staticmethod
+    def _coalesce_key(event: str, data: Dict[str, Any]) -> Hashable | None:
+        field = COALESCE_FIELDS.get(event)
+        if field is None or not isinstance(data, dict) or field not in data:
+            return None
+        return (event, data[field])
 
     def publish(self, event: str, data: Dict[str, Any]) -> None:
-        payload = {"event": event, "data": data}
-        for q in list(self._subs):
+        if self._outbox is not None:
+            # bridged (multi-worker): the event log assigns the id and every
+            # process, including this one, delivers it from there
+            self._outbox.append((event, data))
+            return
+        self.deliver(self._seq + 1, event, data)
+
+    def deliver(self, seq: int, event: str, data: Dict[str, Any]) -> None:
+        """Hand an event with an externally assigned id to subscribers."""
+        self._seq = seq
+        item = {"id": seq, "event": event, "data": data}
+        self._history.append(item)
+        key = self._coalesce_key(event, data)
+        for sub in list(self._subs):
             try:
-                q.put_nowait(payload)
+                sub.offer(item, key)
             except Exception:
                 pass
 
+    def bridge(self, start_id: int) -> None:
+        """Route publish() through an outbox drained by an external transport."""
+        self._seq = max(self._seq, start_id)
+        self._outbox = []
+
+    def unbridge(self) -> List[Tuple[str, Dict[str, Any]]]:
+        pending = self.drain_outbox()
+        self._outbox = None
+        return pending
+
+    def requeue(self, pending: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """Put events back at the front of the outbox after a failed hand-off."""
+        if self._outbox is not None:
+            self._outbox[:0] = pending
+
+    def drain_outbox(self) -> List[Tuple[str, Dict[str, Any]]]:
+        if not self._outbox:
+            return []
+        pending, self._outbox = self._outbox, []
+        return pending
+
 
 events = EventBus()
@@ -0,0 +1,170 @@
+"""Image dimensions from the first bytes of a file, without decoding it.
+
+`parse_header` understands the formats the library accepts (JPEG SOF, PNG
+IHDR, GIF logical screen, WebP VP8/VP8L/VP8X). `probe` reads a stream a
+little at a time until the header is found, so a typical JPEG costs one
+small read; anything the parser does not recognise falls back to a lazy
+Pillow open of the bytes read so far.
+
+Sizes are as displayed: renders apply the EXIF orientation, so a JPEG
+whose Orientation tag rotates it by 90 degrees (5-8) reports width and
+height swapped.
+"""
+from __future__ import annotations
+import io
+import struct
+from typing import BinaryIO, NamedTuple, Optional
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic...)
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# markers without a length field
+_STANDALONE = {0x01, 0xD8} | set(range(0xD0, 0xD8))
+_APP1 = 0xE1
+_EXIF_ORIENTATION = 0x0112
+# orientations that turn the image by 90 degrees (optionally mirrored)
+_TRANSPOSED = {5, 6, 7, 8}
+_FIRST_READ = 4096
+# EXIF/ICC segments can push the SOF far in; give up on the parser after this
+MAX_HEADER_BYTES = 1024 * 1024
+
+
+class ImageMeta(NamedTuple):
+    width: int
+    height: int
+    format: str
+
+
+class UnknownFormat(ValueError):
+    """The bytes do not start with a header this parser knows."""
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    """Orientation tag from IFD0 of an EXIF TIFF block; 1 (upright) if absent."""
+    if tiff[:2] == b"II":
+        order = "<"
+    elif tiff[:2] == b"MM":
+        order = ">"
+    else:
+        return 1
+    if len(tiff) < 8:
+        return 1
+    (ifd,) = struct.unpack_from(order + "I", tiff, 4)
+    if ifd + 2 > len(tiff):
+        return 1
+    (count,) = struct.unpack_from(order + "H", tiff, ifd)
+    for i in range(count):
+        entry = ifd + 2 + 12 * i
+        if entry + 12 > len(tiff):
+            break
+        (tag,) = struct.unpack_from(order + "H", tiff, entry)
+        if tag == _EXIF_ORIENTATION:
+            # SHORT value, stored left-aligned in the 4-byte value field
+            (value,) = struct.unpack_from(order + "H", tiff, entry + 8)
+            return value
+    return 1
+
+
+def _jpeg(buf: bytes) -> Optional[ImageMeta]:
+    pos = 2
+    n = len(buf)
+    orientation = 1
+    while pos + 4 <= n:
+        if buf[pos] != 0xFF:
+            raise UnknownFormat("bad JPEG marker")
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        if marker in _STANDALONE:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            raise UnknownFormat("JPEG without frame header")
+        if marker in _SOF_MARKERS:
+            if pos + 9 > n:
+                return None
+            height, width = struct.unpack_from(">HH", buf, pos + 5)
+            if orientation in _TRANSPOSED:
+                width, height = height, width
+            return ImageMeta(width, height, "jpeg")
+        (length,) = struct.unpack_from(">H", buf, pos + 2)
+        if marker == _APP1 and buf[pos + 4:pos + 10] == b"Exif\0\0":
+            if pos + 2 + length > n:
+                # the SOF comes after it anyway
+                return None
+            orientation = _exif_orientation(buf[pos + 10:pos + 2 + length])
+        pos += 2 + length
+    return None
+
+
+def _webp(buf: bytes) -> Optional[ImageMeta]:
+    if len(buf) < 30:
+        return None
+    chunk = buf[12:16]
+    if chunk == b"VP8 ":
+        w, h = struct.unpack_from("<HH", buf, 26)
+        return ImageMeta(w & 0x3FFF, h & 0x3FFF, "webp")
+    if chunk == b"VP8L":
+        (bits,) = struct.unpack_from("<I", buf, 21)
+        return ImageMeta((bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, "webp")
+    if chunk == b"VP8X":
+        w = int.from_bytes(buf[24:27], "little") + 1
+        h = int.from_bytes(buf[27:30], "little") + 1
+        return ImageMeta(w, h, "webp")
+    raise UnknownFormat("unknown WebP chunk")
+
+
+def parse_header(buf: bytes) -> Optional[ImageMeta]:
+    """Return the dimensions, None if `buf` is too short to tell yet.
+
+    Raises UnknownFormat for data that is not JPEG/PNG/GIF/WebP.
+    """
+    if buf[:2] == b"\xff\xd8":
+        return _jpeg(buf)
+    if buf[:8] == b"\x89PNG\r\n\x1a\n":
+        if len(buf) < 24:
+            return None
+        w, h = struct.unpack_from(">II", buf, 16)
+        return ImageMeta(w, h, "png")
+    if buf[:6] in (b"GIF87a", b"GIF89a"):
+        if len(buf) < 10:
+            return None
+        w, h = struct.unpack_from("<HH", buf, 6)
+        return ImageMeta(w, h, "gif")
+    if buf[:4] == b"RIFF" and buf[8:12] == b"WEBP":
+        return _webp(buf)
+    if len(buf) < 12:
+        return None
+    raise UnknownFormat("unrecognised image header")
+
+
+def _pillow(buf: bytes) -> Optional[ImageMeta]:
+    from PIL import Image
+
+    try:
+        # open() only parses the header; nothing is decoded without load()
+        with Image.open(io.BytesIO(buf)) as img:
+            return ImageMeta(img.width, img.height, (img.format or "").lower())
+    except Exception:
+        return None
+
+
+def probe(f: BinaryIO) -> Optional[ImageMeta]:
+    """Read just enough of `f` to find the image size; None if unreadable."""
+    buf = f.read(_FIRST_READ)
+    want = _FIRST_READ
+    while True:
+        try:
+            meta = parse_header(buf)
+        except UnknownFormat:
+            break
+        if meta is not None:
+            return meta
+        if len(buf) < want or want >= MAX_HEADER_BYTES:
+            # EOF or header too deep
+            break
+        chunk = f.read(want)
+        buf += chunk
+        want *= 2
+    return _pillow(buf)
@@ -0,0 +1,32 @@
+"""JSON responses for large listing payloads.
+
+FastAPI runs every returned dict through `jsonable_encoder` (a recursive
+copy that type-checks each value) before the response class serializes
+it. Listings are already built from plain dicts, lists, str, int and None,
+so endpoints return `FastJSONResponse(payload)` themselves: FastAPI passes
+a Response through untouched and the payload is serialized once, by orjson
+when it is installed (optional; the stdlib encoder is the fallback).
+"""
+from __future__ import annotations
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse for payloads that are already JSON-compatible primitives."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
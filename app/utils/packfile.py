@@ -0,0 +1,100 @@
+"""Append-only segment files holding many small blobs.
+
+A blob is addressed by (segment path, offset, length); the index lives
+elsewhere (the `thumbs` table). Each process appends to its own segment
+and rolls over to a new one when it reaches `segment_bytes`, when the
+target directory changes, or when the segment was removed underneath it
+(compaction), so segments are never written by two processes at once.
+Blobs are never rewritten in place: dead ones are reclaimed by copying the
+live blobs of a segment into a new one and deleting the old file.
+"""
+from __future__ import annotations
+import os
+import threading
+import time
+from typing import Callable, Tuple
+
+SUFFIX = ".pack"
+
+
+def read_slice(path: str, offset: int, length: int) -> bytes:
+    """Read one blob with a single positional read where the OS has one."""
+    fd = os.open(path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        if hasattr(os, "pread"):
+            data = os.pread(fd, length, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            data = os.read(fd, length)
+    finally:
+        os.close(fd)
+    if len(data) != length:
+        raise EOFError(f"short read from {path} at {offset}: {len(data)}/{length}")
+    return data
+
+
+class PackWriter:
+    def __init__(self, directory: Callable[[], str], tag: str, segment_bytes: int) -> None:
+        # resolved on every append so a cache dir change takes effect at once
+        self._directory = directory
+        self.tag = tag
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._path: str | None = None
+        self._size = 0
+
+    @property
+    def active_path(self) -> str | None:
+        return self._path
+
+    def _stale(self, directory: str) -> bool:
+        if self._file is None or self._size >= self.segment_bytes:
+            return True
+        if os.path.dirname(self._path or "") != directory:
+            return True
+        try:
+            # compacted away (POSIX allows unlinking a file that is still open)
+            return os.fstat(self._file.fileno()).st_nlink == 0
+        except OSError:
+            return True
+
+    def _roll(self, directory: str) -> None:
+        self._close()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.time_ns():016x}-{self.tag}{SUFFIX}")
+        self._file = open(path, "ab")
+        self._path = path
+        self._size = 0
+
+    def _close(self) -> None:
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+        self._file = None
+        self._path = None
+        self._size = 0
+
+    def append(self, data: bytes) -> Tuple[str, int]:
+        """Write `data` and return (segment path, offset). Thread-safe."""
+        directory = self._directory()
+        with self._lock:
+            if self._stale(directory):
+                self._roll(directory)
+            offset = self._size
+            try:
+                self._file.write(data)
+                # readers in other threads/processes open the file separately
+                self._file.flush()
+            except OSError:
+                # the tail may hold a partial blob; never append after it
+                self._close()
+                raise
+            self._size += len(data)
+            return self._path, offset
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
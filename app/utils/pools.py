@@ -0,0 +1,48 @@
+"""Thread pools whose size can change while the app is running.
+
+A resize swaps in a new executor; work already queued on the old one still
+finishes there, new work goes to the new pool.
+"""
+from __future__ import annotations
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+
+class ResizablePool:
+    def __init__(self, name: str, size: Callable[[], int]) -> None:
+        self.name = name
+        # read on first use, so the size follows settings loaded at startup
+        self._initial_size = size
+        self._executor: ThreadPoolExecutor | None = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size or max(1, self._initial_size())
+
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._size = max(1, self._size or self._initial_size())
+                    self._executor = ThreadPoolExecutor(max_workers=self._size, thread_name_prefix=self.name)
+        return self._executor
+
+    def resize(self, workers: int) -> None:
+        workers = max(1, workers)
+        with self._lock:
+            if workers == self._size:
+                return
+            old, self._executor, self._size = self._executor, None, workers
+        if old is not None:
+            old.shutdown(wait=False)
+
+    async def run(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor(), partial(fn, *args, **kwargs))
@@ -0,0 +1,43 @@
+"""Startup phase timing.
+
+Times are seconds since process start. server.py exports MYREAD_T0 before it
+imports anything heavy; when the app is started some other way (plain
+`uvicorn app.main:app`) the clock starts when this module is first imported.
+"""
+from __future__ import annotations
+import os
+import time
+from typing import Dict
+
+from .metrics import registry
+
+STARTUP_SECONDS = registry.gauge(
+    "myread_startup_seconds", "Seconds from process start to each startup phase.", ("phase",)
+)
+
+try:
+    _T0 = float(os.environ["MYREAD_T0"])
+except (KeyError, ValueError):
+    _T0 = time.time()
+
+_phases: Dict[str, float] = {}
+
+
+def mark(phase: str) -> float:
+    """Record that `phase` finished now; the first mark of a phase wins."""
+    if phase not in _phases:
+        _phases[phase] = round(time.time() - _T0, 4)
+        STARTUP_SECONDS.set(_phases[phase], phase=phase)
+    return _phases[phase]
+
+
+def marked(phase: str) -> bool:
+    return phase in _phases
+
+
+def report() -> Dict[str, float]:
+    return dict(_phases)
+
+
+def format_report() -> str:
+    return " ".join(f"{phase}={secs * 1000:.0f}ms" for phase, secs in _phases.items())
@@ -0,0 +1,170 @@
+"""Whole-member reads from zip archives for the thumbnail pipeline.
+
+`zipfile.ZipFile.open()` re-parses the central directory on every call and
+inflates members through many small reads. Here the directory of an archive
+is parsed once and cached (keyed by path, size and mtime). A member is then
+read with one pread of its compressed bytes and a single inflate into an
+output buffer sized from the directory. STORED members are not read at all:
+Pillow gets a window onto a memory map of the archive.
+"""
+from __future__ import annotations
+import io
+import mmap
+import os
+import struct
+import zipfile
+import zlib
+from functools import lru_cache
+from typing import Dict
+
+from .zipscan import ZipMember, iter_zip_members
+
+_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_LOCAL_HEADER_SIG = b"PK\x03\x04"
+_STORED = 0
+_DEFLATED = 8
+_ENCRYPTED_FLAG = 0x1
+# archives whose directory stays cached; a library view touches a few at a time
+_INDEX_CACHE_SIZE = 32
+_HAS_PREAD = hasattr(os, "pread")
+
+
+class UnsupportedMember(NotImplementedError):
+    """Compression method or encryption this reader does not handle; use zipfile."""
+
+
+class MemberReader(io.RawIOBase):
+    """Read-only, seekable file object over a buffer without copying it up front."""
+
+    def __init__(self, buf: memoryview, on_close=None) -> None:
+        super().__init__()
+        self._buf = buf
+        self._pos = 0
+        self._on_close = on_close
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._buf) if size is None or size < 0 else min(len(self._buf), self._pos + size)
+        if end <= self._pos:
+            return b""
+        data = bytes(self._buf[self._pos:end])
+        self._pos = end
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readinto(self, b) -> int:
+        n = min(len(b), len(self._buf) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._buf)
+        if offset < 0:
+            raise ValueError("negative seek position")
+        self._pos = offset
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            # release the view first: an mmap cannot close while it is exported
+            self._buf.release()
+            if self._on_close is not None:
+                self._on_close()
+        super().close()
+
+
+@lru_cache(maxsize=_INDEX_CACHE_SIZE)
+def _member_index(path: str, size: int, mtime_ns: int) -> Dict[str, ZipMember]:
+    # size/mtime are part of the key so a rewritten archive is re-indexed
+    return {m.name: m for m in iter_zip_members(path)}
+
+
+def find_member(path: str, name: str) -> ZipMember:
+    st = os.stat(path)
+    member = _member_index(path, st.st_size, st.st_mtime_ns).get(name)
+    if member is None:
+        raise KeyError(f"there is no item named {name!r} in the archive")
+    return member
+
+
+def _pread(f: io.FileIO, size: int, offset: int) -> bytes:
+    if _HAS_PREAD:
+        return os.pread(f.fileno(), size, offset)
+    # Windows has no pread; the file object is private to this call anyway
+    f.seek(offset)
+    return f.read(size)
+
+
+def _pread_exact(f: io.FileIO, size: int, offset: int) -> bytes:
+    data = _pread(f, size, offset)
+    if len(data) == size:
+        return data
+    # short reads are legal (network filesystems); finish in a loop
+    parts = [data]
+    got = len(data)
+    while got < size:
+        chunk = _pread(f, size - got, offset + got)
+        if not chunk:
+            raise zipfile.BadZipFile("truncated member data")
+        parts.append(chunk)
+        got += len(chunk)
+    return b"".join(parts)
+
+
+def _data_offset(f: io.FileIO, member: ZipMember) -> int:
+    header = _pread_exact(f, _LOCAL_HEADER.size, member.header_offset)
+    if header[:4] != _LOCAL_HEADER_SIG:
+        raise zipfile.BadZipFile("bad local file header")
+    fields = _LOCAL_HEADER.unpack(header)
+    name_len, extra_len = fields[9], fields[10]
+    return member.header_offset + _LOCAL_HEADER.size + name_len + extra_len
+
+
+def open_member(path: str, name: str) -> MemberReader:
+    """Return a file object with the uncompressed bytes of member `name`.
+
+    Close it (or use it in a `with` block) when done: for STORED members it
+    holds a memory map of the archive. Raises UnsupportedMember for encrypted
+    members and methods other than STORED/DEFLATED, KeyError for missing
+    names and zipfile.BadZipFile for corrupt archives.
+    """
+    member = find_member(path, name)
+    if member.flags & _ENCRYPTED_FLAG or member.method not in (_STORED, _DEFLATED):
+        raise UnsupportedMember(f"{name}: method {member.method}, flags {member.flags:#x}")
+    with open(path, "rb", buffering=0) as f:
+        start = _data_offset(f, member)
+        if member.method == _STORED:
+            if member.file_size == 0:
+                reader = MemberReader(memoryview(b""))
+            else:
+                # the map keeps its own handle, so the file can be closed right away
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if start + member.file_size > len(mm):
+                    mm.close()
+                    raise zipfile.BadZipFile("truncated member data")
+                reader = MemberReader(memoryview(mm)[start:start + member.file_size], on_close=mm.close)
+        else:
+            raw = _pread_exact(f, member.compress_size, start)
+            # raw deflate stream; bufsize preallocates the exact output size
+            data = zlib.decompress(raw, -zlib.MAX_WBITS, max(1, member.file_size))
+            del raw
+            if len(data) != member.file_size or zlib.crc32(data) != member.crc:
+                raise zipfile.BadZipFile(f"bad CRC or size for {name}")
+            reader = MemberReader(memoryview(data))
+    return reader
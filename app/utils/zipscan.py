@@ -0,0 +1,177 @@
+from __future__ import annotations
+import os
+import re
+import struct
+import unicodedata
+import zipfile
+from functools import lru_cache
+from typing import Any, Callable, Iterator, NamedTuple, Tuple
+
+from .fs import is_image_name
+
+# record layouts as in the ZIP spec (see also zipfile's structEndArchive etc.)
+_EOCD = struct.Struct("<4s4H2LH")
+_ZIP64_LOCATOR = struct.Struct("<4sLQL")
+_ZIP64_EOCD = struct.Struct("<4sQ2H2L4Q")
+_CENTRAL_DIR = struct.Struct("<4s4B4HL2L5H2L")
+_EOCD_SIG = b"PK\x05\x06"
+_ZIP64_LOCATOR_SIG = b"PK\x06\x07"
+_ZIP64_EOCD_SIG = b"PK\x06\x06"
+_CENTRAL_DIR_SIG = b"PK\x01\x02"
+_MAX_COMMENT = 0xFFFF
+_UTF8_FLAG = 0x800
+_ZIP64_EXTRA_TAG = 0x0001
+
+@lru_cache(maxsize=None)
+def _natural_keygen() -> Callable[[str], Any]:
+    # natsort is slow to import; defer it until the first scan or listing
+    from natsort import natsort_keygen, ns
+
+    return natsort_keygen(alg=ns.IGNORECASE)
+
+
+def natural_key(name: str) -> Any:
+    """Case-insensitive natural sort key (same order as natsorted(..., alg=ns.IGNORECASE))."""
+    return _natural_keygen()(name)
+
+
+_DIGITS = re.compile(r"(\d+)")
+
+
+def natural_sort_key(name: str) -> bytes:
+    """Byte string that sorts like `natural_key` under plain memcmp.
+
+    Stored in SQLite (albums.name_key, entries.sort_key) so natural order is
+    an indexed ORDER BY. Text runs are casefolded UTF-8 closed by a 0x00
+    byte, so a shorter run sorts first as it does in natsort's tuples;
+    numbers are their digit count followed by the digits.
+    """
+    # natsort compares NFD-normalised, casefolded text
+    parts = _DIGITS.split(unicodedata.normalize("NFD", name).casefold())
+    out = bytearray(parts[0].encode("utf-8"))
+    for i in range(1, len(parts), 2):
+        digits = str(int(parts[i]))
+        out += b"\x00" + bytes((min(len(digits), 255),)) + digits.encode("ascii")
+        out += parts[i + 1].encode("utf-8")
+    return bytes(out)
+
+
+class ZipMember(NamedTuple):
+    name: str
+    flags: int
+    method: int
+    crc: int
+    compress_size: int
+    file_size: int
+    # absolute offset of the local file header (prepended data already added)
+    header_offset: int
+
+
+def _zip64_fields(extra: bytes, want: int) -> list[int]:
+    """Return the first `want` 8-byte values of the zip64 extra field."""
+    pos = 0
+    while pos + 4 <= len(extra):
+        tag, size = struct.unpack_from("<HH", extra, pos)
+        if tag == _ZIP64_EXTRA_TAG:
+            if size < want * 8:
+                raise zipfile.BadZipFile("truncated zip64 extra field")
+            return list(struct.unpack_from(f"<{want}Q", extra, pos + 4))
+        pos += 4 + size
+    raise zipfile.BadZipFile("zip64 extra field missing")
+
+
+def iter_zip_members(path: str, with_offsets: bool = True) -> Iterator[ZipMember]:
+    """Yield members by walking the central directory record by record.
+
+    Unlike `zipfile.ZipFile`, no ZipInfo objects or name lists are built, which
+    matters when a scan touches thousands of archives. With `with_offsets`
+    False the zip64 extra fields are skipped and sizes/offsets of zip64
+    members are left as stored. Raises `zipfile.BadZipFile` for anything
+    that is not a readable archive.
+    """
+    with open(path, "rb") as f:
+        f.seek(0, 2)
+        file_size = f.tell()
+        tail_len = min(file_size, _EOCD.size + _MAX_COMMENT)
+        f.seek(file_size - tail_len)
+        tail = f.read(tail_len)
+        idx = tail.rfind(_EOCD_SIG)
+        if idx < 0 or idx + _EOCD.size > len(tail):
+            raise zipfile.BadZipFile("end of central directory not found")
+        eocd_pos = file_size - tail_len + idx
+        _, _, _, _, total, cd_size, cd_offset, _ = _EOCD.unpack_from(tail, idx)
+        # size of zip64 records sitting between the central directory and EOCD
+        meta_size = 0
+        if total == 0xFFFF or cd_size == 0xFFFFFFFF or cd_offset == 0xFFFFFFFF:
+            loc_pos = idx - _ZIP64_LOCATOR.size
+            if loc_pos < 0:
+                raise zipfile.BadZipFile("zip64 locator missing")
+            sig, _, eocd64_pos, _ = _ZIP64_LOCATOR.unpack_from(tail, loc_pos)
+            if sig != _ZIP64_LOCATOR_SIG:
+                raise zipfile.BadZipFile("zip64 locator missing")
+            f.seek(eocd64_pos)
+            rec = f.read(_ZIP64_EOCD.size)
+            if len(rec) != _ZIP64_EOCD.size or rec[:4] != _ZIP64_EOCD_SIG:
+                raise zipfile.BadZipFile("bad zip64 end record")
+            _, _, _, _, _, _, _, total, cd_size, cd_offset = _ZIP64_EOCD.unpack(rec)
+            meta_size = _ZIP64_LOCATOR.size + _ZIP64_EOCD.size
+        # bytes prepended to the archive (e.g. self-extractors) shift every offset
+        concat = eocd_pos - meta_size - cd_size - cd_offset
+        if concat < 0:
+            raise zipfile.BadZipFile("bad central directory offset")
+        f.seek(cd_offset + concat)
+        for _ in range(total):
+            header = f.read(_CENTRAL_DIR.size)
+            if len(header) != _CENTRAL_DIR.size or header[:4] != _CENTRAL_DIR_SIG:
+                raise zipfile.BadZipFile("bad central directory record")
+            fields = _CENTRAL_DIR.unpack(header)
+            flags, method, crc = fields[5], fields[6], fields[9]
+            csize, usize, name_len, extra_len, comment_len = fields[10], fields[11], fields[12], fields[13], fields[14]
+            offset = fields[18]
+            raw = f.read(name_len)
+            wide = [v for v in (usize, csize, offset) if v == 0xFFFFFFFF]
+            if with_offsets and wide:
+                extra = f.read(extra_len)
+                f.seek(comment_len, 1)
+                # zip64 values appear in this order, only for the fields that overflowed
+                values = iter(_zip64_fields(extra, len(wide)))
+                if usize == 0xFFFFFFFF:
+                    usize = next(values)
+                if csize == 0xFFFFFFFF:
+                    csize = next(values)
+                if offset == 0xFFFFFFFF:
+                    offset = next(values)
+            else:
+                f.seek(extra_len + comment_len, 1)
+            name = raw.decode("utf-8" if flags & _UTF8_FLAG else "cp437", errors="replace")
+            # normalize like ZipInfo so names can be passed back to ZipFile.open()
+            name = name.split("\0", 1)[0]
+            if os.sep != "/" and os.sep in name:
+                name = name.replace(os.sep, "/")
+            yield ZipMember(name, flags, method, crc, csize, usize, offset + concat)
+
+
+def iter_zip_names(path: str) -> Iterator[str]:
+    """Yield member names in central directory order (see iter_zip_members)."""
+    for member in iter_zip_members(path, with_offsets=False):
+        yield member.name
+
+
+def inspect_zip_images(path: str) -> Tuple[int, str | None]:
+    """Return (image count, naturally-first image name) in one O(N) pass.
+
+    The full natural sort is left to the entries listing, which only runs when
+    an album is actually opened.
+    """
+    count = 0
+    first: str | None = None
+    first_key = None
+    key_of = _natural_keygen()
+    for name in iter_zip_names(path):
+        if name.endswith("/") or not is_image_name(name):
+            continue
+        count += 1
+        key = key_of(name)
+        if first_key is None or key < first_key:
+            first, first_key = name, key
+    return count, first
@@ -0,0 +1,313 @@
+"""Benchmarks for the scan / listing / thumbnail hot paths.
+
+Generates a synthetic library (see benchmarks/synth.py) in a temp directory,
+points the app's database and cache there, and measures:
+
+- scan_paths throughput (albums/s, images/s)
+- list_entries latency per page on a large zip
+- get_or_create_thumb latency, cold and warm, including huge pages
+- list_albums (children and tree scope) at 1k / 10k / 100k albums
+- lru_cleanup time over many cached thumbs
+- serializing and compressing the tree listing of a 50k-album library:
+  jsonable_encoder + json (FastAPI's default path) vs orjson, gzip vs brotli
+
+Results are written as JSON so runs can be diffed for regressions:
+
+    python -m benchmarks.bench --out bench.json            # default sizes
+    python -m benchmarks.bench --quick --out bench.json    # smoke-sized run
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Awaitable, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import db as app_db  # noqa: E402
+from app.settings import settings  # noqa: E402
+from benchmarks.synth import LibrarySpec, generate_library  # noqa: E402
+
+
+def _summary(samples: list[float]) -> dict:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+    return {
+        "n": len(samples),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "median_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+    }
+
+
+async def _timed(fn: Callable[[], Awaitable[object]]) -> float:
+    start = time.perf_counter()
+    await fn()
+    return time.perf_counter() - start
+
+
+async def bench_scan(db, root: str, summary: dict) -> dict:
+    from app.services.scanner import ScanOptions, scan_paths
+
+    elapsed = await _timed(lambda: scan_paths(db, [root], ScanOptions(recursive=True)))
+    async with db.execute("SELECT COUNT(*), SUM(file_count) FROM albums WHERE type='zip' OR file_count>0") as cur:
+        albums, _ = await cur.fetchone()
+    images = summary["loose_images"] + summary["zip_members"] + summary["huge_pages"]
+    # a second scan over an unchanged tree measures the skip path
+    rescan = await _timed(lambda: scan_paths(db, [root], ScanOptions(recursive=True)))
+    return {
+        "seconds": round(elapsed, 4),
+        "albums": albums,
+        "albums_per_s": round(albums / elapsed, 1) if elapsed else None,
+        "images_per_s": round(images / elapsed, 1) if elapsed else None,
+        "rescan_seconds": round(rescan, 4),
+    }
+
+
+async def bench_entries(db, pages: int) -> dict:
+    from app.services.entries import list_entries
+
+    async with db.execute("SELECT id FROM albums WHERE type='zip' ORDER BY file_count DESC LIMIT 1") as cur:
+        row = await cur.fetchone()
+    if not row:
+        return {}
+    samples = [await _timed(lambda p=p: list_entries(db, row[0], p, 48)) for p in range(1, pages + 1)]
+    return _summary(samples)
+
+
+async def _pick_entries(db, album_type: str, limit: int) -> list[tuple[int, str, str, str]]:
+    from app.services.entries import list_entries
+
+    out = []
+    async with db.execute("SELECT id, type, path FROM albums WHERE type=? AND file_count>0", (album_type,)) as cur:
+        albums = await cur.fetchall()
+    for album_id, typ, path in albums:
+        page = await list_entries(db, album_id, 1, limit)
+        for item in page["items"]:
+            name = item if isinstance(item, str) else item.get("path")
+            out.append((album_id, typ, path, name))
+            if len(out) >= limit:
+                return out
+    return out
+
+
+async def bench_thumbs(db, count: int, warm_repeats: int) -> dict:
+    from app.services.thumbnails import get_or_create_thumb
+
+    async def thumb(album_id, typ, path, entry):
+        return await get_or_create_thumb(
+            db, album_id=album_id, album_type=typ, album_path=path, entry_path=entry,
+            w=300, h=400, fit="cover", fmt=settings.encode_format,
+        )
+
+    results = {}
+    for label, album_type in (("zip", "zip"), ("folder", "folder")):
+        entries = await _pick_entries(db, album_type, count)
+        if not entries:
+            continue
+        cold = [await _timed(lambda e=e: thumb(*e)) for e in entries]
+        warm = [await _timed(lambda: thumb(*entries[0])) for _ in range(warm_repeats)]
+        results[f"{label}_cold"] = _summary(cold)
+        results[f"{label}_warm"] = _summary(warm)
+
+    async with db.execute("SELECT id, path FROM albums WHERE path LIKE '%/huge'") as cur:
+        huge = await cur.fetchone()
+    if huge:
+        names = sorted(os.listdir(huge[1]))
+        cold = [await _timed(lambda n=n: thumb(huge[0], "folder", huge[1], n)) for n in names]
+        results["huge_cold"] = _summary(cold)
+    return results
+
+
+async def _seed_albums(db, n: int) -> None:
+    """Insert n synthetic album rows in a three-level hierarchy (no files needed)."""
+    await db.execute("DELETE FROM albums")
+    now = int(time.time())
+    rows = []
+    per_group = max(1, int(round(n ** (1 / 3))))
+    for i in range(n):
+        a, b = i // (per_group * per_group), (i // per_group) % per_group
+        if i % (per_group * per_group) == 0:
+            path = f"/lib/g{a}"
+        elif i % per_group == 0:
+            path = f"/lib/g{a}/s{b}"
+        else:
+            path = f"/lib/g{a}/s{b}/album{i}"
+        rows.append(("folder", path, os.path.basename(path), now - i, i * 1000, 10 + i % 50, now - i))
+    await db.executemany(
+        "INSERT OR IGNORE INTO albums(type, path, name, mtime, size, file_count, added_at) VALUES(?,?,?,?,?,?,?)",
+        rows,
+    )
+    await db.commit()
+
+
+async def bench_list_albums(db, sizes: list[int], repeats: int) -> dict:
+    from app.routers.albums import list_albums
+
+    results = {}
+    for n in sizes:
+        await _seed_albums(db, n)
+        children = [
+            await _timed(lambda: list_albums(sort_by="name", order="asc", keyword=None, scope="children",
+                                             parent_path=None, db=db))
+            for _ in range(repeats)
+        ]
+        tree = [
+            await _timed(lambda: list_albums(sort_by="name", order="asc", keyword=None, scope="tree",
+                                             parent_path=None, db=db))
+            for _ in range(repeats)
+        ]
+        results[str(n)] = {"children": _summary(children), "tree": _summary(tree)}
+    return results
+
+
+async def bench_serialize(db, n: int, repeats: int) -> dict:
+    import gzip
+    from fastapi.encoders import jsonable_encoder
+    from app.routers.albums import list_albums
+    from app.utils import jsonresp
+
+    await _seed_albums(db, n)
+    response = await list_albums(sort_by="name", order="asc", keyword=None, scope="tree", parent_path=None, db=db)
+    payload = json.loads(response.body)
+
+    def stdlib():
+        # what JSONResponse did with the dict FastAPI handed it
+        return json.dumps(
+            jsonable_encoder(payload), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+        ).encode("utf-8")
+
+    def timed(fn) -> tuple[list[float], object]:
+        samples, out = [], None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            out = fn()
+            samples.append(time.perf_counter() - start)
+        return samples, out
+
+    encoder_samples, body = timed(stdlib)
+    fast_samples, fast_body = timed(lambda: jsonresp.dumps(payload))
+    results = {
+        "albums": n,
+        "orjson": jsonresp.orjson is not None,
+        "json_bytes": len(body),
+        "jsonable_encoder_json": _summary(encoder_samples),
+        "fast_json": _summary(fast_samples),
+        "identical": json.loads(body) == json.loads(fast_body),
+    }
+    gzip_samples, gz = timed(lambda: gzip.compress(fast_body, compresslevel=6))
+    results["gzip_6"] = {**_summary(gzip_samples), "bytes": len(gz)}
+    try:
+        import brotli
+    except ImportError:
+        return results
+    br_samples, br = timed(lambda: brotli.compress(fast_body, quality=4))
+    results["brotli_4"] = {**_summary(br_samples), "bytes": len(br)}
+    return results
+
+
+async def bench_lru(db, thumbs: int) -> dict:
+    from app.services.thumbnails import lru_cleanup
+
+    await db.execute(
+        "INSERT INTO albums(type, path, name, mtime, size, file_count, added_at) VALUES('folder', '/lru', 'lru', 0, 0, 1, 0)"
+    )
+    async with db.execute("SELECT id FROM albums WHERE path='/lru'") as cur:
+        (album_id,) = await cur.fetchone()
+    lru_dir = os.path.join(settings.cache_dir, "lru")
+    os.makedirs(lru_dir, exist_ok=True)
+    rows = []
+    payload = b"\0" * 1024
+    for i in range(thumbs):
+        path = os.path.join(lru_dir, f"t{i}.webp")
+        with open(path, "wb") as f:
+            f.write(payload)
+        rows.append((album_id, f"lru_{i}", path, len(payload), 1, 1, i, i))
+    await db.executemany(
+        "INSERT INTO thumbs(album_id, key, file_path, bytes, width, height, created_at, last_access) VALUES(?,?,?,?,?,?,?,?)",
+        rows,
+    )
+    await db.commit()
+    async with db.execute("SELECT SUM(bytes) FROM thumbs") as cur:
+        (total,) = await cur.fetchone()
+    old_max = settings.cache_max_bytes
+    settings.cache_max_bytes = total // 2
+    try:
+        start = time.perf_counter()
+        result = await lru_cleanup(db)
+        elapsed = time.perf_counter() - start
+    finally:
+        settings.cache_max_bytes = old_max
+    return {"thumbs": thumbs, "seconds": round(elapsed, 4), "removed_bytes": result.get("removed")}
+
+
+async def run(args) -> dict:
+    spec = LibrarySpec(
+        depth=2 if args.quick else 3,
+        breadth=2 if args.quick else 3,
+        images_per_folder=5 if args.quick else 20,
+        zips=2 if args.quick else 10,
+        members_per_zip=200 if args.quick else 2000,
+        huge_pages=1 if args.quick else 2,
+        huge_size=(2000, 3000) if args.quick else (6000, 8500),
+    )
+    album_sizes = [1000] if args.quick else [1000, 10_000, 100_000]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="myread-bench-")
+    lib = os.path.join(workdir, "library")
+    settings.cache_dir = os.path.join(workdir, "cache")
+    app_db.DB_PATH = os.path.join(workdir, "bench.sqlite3")
+    results: dict = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": int(time.time()),
+            "quick": bool(args.quick),
+            "encode_format": settings.encode_format,
+        }
+    }
+    try:
+        start = time.perf_counter()
+        summary = generate_library(lib, spec)
+        results["meta"]["library"] = summary
+        results["meta"]["generate_seconds"] = round(time.perf_counter() - start, 3)
+        await app_db.init_db()
+        async with app_db.open_db() as db:
+            results["scan_paths"] = await bench_scan(db, lib, summary)
+            results["list_entries"] = await bench_entries(db, pages=5 if args.quick else 20)
+            results["get_or_create_thumb"] = await bench_thumbs(
+                db, count=5 if args.quick else 30, warm_repeats=20 if args.quick else 100
+            )
+            results["lru_cleanup"] = await bench_lru(db, thumbs=500 if args.quick else 10_000)
+            results["list_albums"] = await bench_list_albums(db, album_sizes, repeats=2 if args.quick else 3)
+            results["serialize_tree"] = await bench_serialize(
+                db, 1000 if args.quick else 50_000, repeats=3 if args.quick else 5
+            )
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench.json", help="where to write the JSON results")
+    parser.add_argument("--quick", action="store_true", help="small library, for smoke runs")
+    parser.add_argument("--workdir", help="reuse this directory instead of a temp dir (kept afterwards)")
+    parser.add_argument("--keep", action="store_true", help="keep the temp directory")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Cold-start benchmark: time from process spawn to the first answered request.
+
+Starts the server in a fresh interpreter (no reload) several times, polls
+/api/health until it answers, and reads the server-side phase report from
+/api/health/startup (import, init_db, ready, first_request):
+
+    python -m benchmarks.startup --runs 5 --out startup.json
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_SERVER = (
+    "import os, time; os.environ['MYREAD_T0'] = os.environ.get('MYREAD_T0') or str(time.time()); "
+    "import sys, uvicorn; sys.path.insert(0, {root!r}); "
+    "uvicorn.run('app.main:app', host='127.0.0.1', port={port}, log_level='warning')"
+)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url: str) -> bytes | None:
+    try:
+        with urllib.request.urlopen(url, timeout=0.5) as resp:
+            return resp.read()
+    except OSError:
+        return None
+
+
+def measure_once(workdir: str, timeout: float = 30.0) -> dict:
+    port = _free_port()
+    env = {**os.environ, "MYREAD_T0": str(time.time())}
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-c", _SERVER.format(root=ROOT, port=port)],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if _get(f"http://127.0.0.1:{port}/api/health") is not None:
+                first = time.perf_counter() - start
+                phases = json.loads(_get(f"http://127.0.0.1:{port}/api/health/startup") or b"{}")
+                return {"first_response_s": round(first, 4), "phases": phases}
+            if proc.poll() is not None:
+                raise RuntimeError("server exited during startup")
+            time.sleep(0.01)
+        raise TimeoutError("server did not answer")
+    finally:
+        proc.terminate()
+        proc.wait(10)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--out", help="write the JSON results here")
+    args = parser.parse_args()
+    # one workdir for all runs: the first run creates the database, later runs
+    # exercise the "schema already current" path like a real restart
+    workdir = tempfile.mkdtemp(prefix="myread-startup-")
+    try:
+        runs = [measure_once(workdir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    firsts = [r["first_response_s"] for r in runs]
+    results = {
+        "runs": runs,
+        "first_response_median_s": round(statistics.median(firsts), 4),
+        "first_response_min_s": min(firsts),
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
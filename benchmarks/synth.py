@@ -0,0 +1,122 @@
+"""Synthetic library generator for the benchmarks.
+
+Builds a directory tree that exercises the scanner and thumbnail hot paths:
+nested folders of loose images, zips with thousands of JPEG/PNG/WebP members
+(both STORED and DEFLATED) and a few huge "scanned page" images.
+
+Usage:
+    python -m benchmarks.synth OUT_DIR [--zips 20] [--members 2000] ...
+"""
+from __future__ import annotations
+import argparse
+import io
+import os
+import random
+import zipfile
+from dataclasses import dataclass
+
+from PIL import Image
+
+
+@dataclass
+class LibrarySpec:
+    depth: int = 3
+    breadth: int = 3
+    images_per_folder: int = 20
+    zips: int = 10
+    members_per_zip: int = 2000
+    huge_pages: int = 2
+    huge_size: tuple[int, int] = (6000, 8500)
+    image_size: tuple[int, int] = (1200, 1700)
+    seed: int = 1
+
+
+def _encoded_samples(size: tuple[int, int], rng: random.Random) -> dict[str, list[bytes]]:
+    """A few pre-encoded images per format; members reuse them to keep generation fast."""
+    samples: dict[str, list[bytes]] = {"jpg": [], "png": [], "webp": []}
+    for i in range(3):
+        color = tuple(rng.randrange(256) for _ in range(3))
+        img = Image.new("RGB", size, color)
+        # upsampled noise gives encoders real work while keeping members at realistic sizes
+        noise = Image.effect_noise((size[0] // 4, size[1] // 4), 40).convert("RGB")
+        img = Image.blend(img, noise.resize(size, Image.Resampling.BICUBIC), 0.35)
+        for ext, fmt in (("jpg", "JPEG"), ("png", "PNG"), ("webp", "WEBP")):
+            buf = io.BytesIO()
+            img.save(buf, format=fmt, quality=85)
+            samples[ext].append(buf.getvalue())
+    return samples
+
+
+def generate_library(root: str, spec: LibrarySpec | None = None) -> dict:
+    """Create the synthetic library under `root` and return a summary."""
+    spec = spec or LibrarySpec()
+    rng = random.Random(spec.seed)
+    samples = _encoded_samples(spec.image_size, rng)
+    exts = list(samples)
+    summary = {"folders": 0, "loose_images": 0, "zips": 0, "zip_members": 0, "huge_pages": 0}
+    os.makedirs(root, exist_ok=True)
+
+    def fill_folder(path: str, level: int) -> None:
+        os.makedirs(path, exist_ok=True)
+        summary["folders"] += 1
+        for i in range(spec.images_per_folder):
+            ext = exts[i % len(exts)]
+            with open(os.path.join(path, f"img{i + 1}.{ext}"), "wb") as f:
+                f.write(samples[ext][i % len(samples[ext])])
+            summary["loose_images"] += 1
+        if level < spec.depth:
+            for b in range(spec.breadth):
+                fill_folder(os.path.join(path, f"sub{level}_{b}"), level + 1)
+
+    fill_folder(os.path.join(root, "folders"), 1)
+
+    zip_dir = os.path.join(root, "zips")
+    os.makedirs(zip_dir, exist_ok=True)
+    for z in range(spec.zips):
+        # alternate STORED/DEFLATED archives; image data barely deflates, like real comics
+        compression = zipfile.ZIP_STORED if z % 2 == 0 else zipfile.ZIP_DEFLATED
+        # compresslevel=1 keeps generation fast; readers pay the same inflate cost either way
+        path = os.path.join(zip_dir, f"archive{z + 1}.zip")
+        with zipfile.ZipFile(path, "w", compression, compresslevel=1) as zf:
+            for m in range(spec.members_per_zip):
+                ext = exts[m % len(exts)]
+                zf.writestr(f"chapter{m // 100 + 1}/page{m + 1}.{ext}", samples[ext][m % len(samples[ext])])
+        summary["zips"] += 1
+        summary["zip_members"] += spec.members_per_zip
+
+    if spec.huge_pages:
+        huge_dir = os.path.join(root, "huge")
+        os.makedirs(huge_dir, exist_ok=True)
+        # upsampled noise: page-like detail without paying for full-size noise generation
+        small = Image.effect_noise((spec.huge_size[0] // 8, spec.huge_size[1] // 8), 60).convert("RGB")
+        noise = small.resize(spec.huge_size, Image.Resampling.BICUBIC)
+        for i in range(spec.huge_pages):
+            ext = "png" if i % 2 == 0 else "jpg"
+            noise.save(os.path.join(huge_dir, f"scan{i + 1}.{ext}"), quality=90)
+            summary["huge_pages"] += 1
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out")
+    parser.add_argument("--depth", type=int, default=LibrarySpec.depth)
+    parser.add_argument("--breadth", type=int, default=LibrarySpec.breadth)
+    parser.add_argument("--images", type=int, default=LibrarySpec.images_per_folder)
+    parser.add_argument("--zips", type=int, default=LibrarySpec.zips)
+    parser.add_argument("--members", type=int, default=LibrarySpec.members_per_zip)
+    parser.add_argument("--huge", type=int, default=LibrarySpec.huge_pages)
+    args = parser.parse_args()
+    spec = LibrarySpec(
+        depth=args.depth,
+        breadth=args.breadth,
+        images_per_folder=args.images,
+        zips=args.zips,
+        members_per_zip=args.members,
+        huge_pages=args.huge,
+    )
+    print(generate_library(args.out, spec))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-import { $, $$, fmt, fmtSize, api, normPath, lowerPath, parentDirPath, state, logLine, sseConnect } from './lib.js';
+import { $, $$, fmt, fmtSize, api, waitJob, normPath, lowerPath, parentDirPath, state, logLine, sseConnect } from './lib.js';
 
 const LAYOUT_STORAGE_KEY = 'myread.horizontalMode';
 let treeSearchTimer = null;
@@ -223,6 +223,10 @@ function renderAlbums() {
         const coverUrl = `/api/albums/${album.id}/cover?w=${isHorizontal ? 450 : 300}&h=${isHorizontal ? 300 : 400}&fit=cover`;
         const thumb = document.createElement('div');
         thumb.className = 'thumb';
+        if (album.placeholder) {
+            // 内联的小预览图，封面加载完成前先显示
+            thumb.style.backgroundImage = `url("${album.placeholder}")`;
+        }
         const img = document.createElement('img');
         img.loading = 'lazy';
         img.src = coverUrl;
@@ -245,7 +249,7 @@ function renderAlbums() {
         const badge = document.createElement('div');
         badge.className = 'type-badge';
         if (album.type === 'folder') badge.classList.add('folder');
-        else if (album.type === 'zip') badge.classList.add('zip');
+        else if (album.type) badge.classList.add('zip');
         badge.textContent = album.type || '';
 
         
@@ -339,13 +343,8 @@ function renderAlbumTree() {
     }
     const expandAll = !!state.treeKeyword;
 
-    const sortNodes = (list) => {
-        return [...(list || [])].sort((a, b) => {
-            const an = (a.album?.name || a.album?.path || '').toLowerCase();
-            const bn = (b.album?.name || b.album?.path || '').toLowerCase();
-            return an.localeCompare(bn, 'zh-CN');
-        });
-    };
+    // the server returns every branch in natural name order
+    const sortNodes = (list) => list || [];
 
     const renderNode = (node, depth = 0) => {
         const album = node.album || {};
@@ -363,7 +362,7 @@ function renderAlbumTree() {
         toggle.textContent = hasChildren ? (shouldExpand ? '▾' : '▸') : '';
         const icon = document.createElement('span');
         icon.className = 'ticon';
-        icon.textContent = album.type === 'zip' ? zipIcon : folderIcon;
+        icon.textContent = album.type === 'folder' ? folderIcon : zipIcon;
     const name = document.createElement('div');
     name.className = 'tname';
     name.title = album.path || '';
@@ -435,10 +434,11 @@ async function scanPaths(paths, recursive) {
     }
     $('#scanBtn').disabled = true;
     try {
-        await api('/api/albums/scan', {
+        const job = await api('/api/albums/scan', {
             method: 'POST',
             body: JSON.stringify({ paths, options: { folder: { recursive: !!recursive } } })
         });
+        await waitJob(job.job_id);
     } finally {
         $('#scanBtn').disabled = false;
     }
@@ -512,7 +512,8 @@ async function refreshAlbums() {
     const btn = $('#refreshBtn');
     btn.disabled = true;
     try {
-        const res = await api('/api/albums/refresh', { method: 'POST' });
+        const job = await api('/api/albums/refresh', { method: 'POST' });
+        const res = await waitJob(job.job_id);
         logLine(`刷新完成: 检查=${res.checked} 删除=${res.removed}`, res.removed ? 'warn' : 'ok');
         await loadAlbums();
     } catch (e) {
@@ -21,6 +21,17 @@ const api = async (url, opts={}) => {
     return res.text();
 };
 
+// waitJob: poll a background job until it reaches a terminal status
+const waitJob = async (jobId, intervalMs=1000) => {
+    for (;;) {
+        const job = await api(`/api/jobs/${jobId}`);
+        if (job.status === 'done') return job.result || {};
+        if (job.status === 'failed') throw new Error(job.error || 'job failed');
+        if (job.status === 'cancelled') throw new Error('job cancelled');
+        await new Promise(r => setTimeout(r, intervalMs));
+    }
+};
+
 function normPath(p){ return (p || '').replace(/\\/g, '/').replace(/\/\/+$/,''); }
 function lowerPath(p){ return normPath(p).toLowerCase(); }
 function parentDirPath(p){ const n = normPath(p); const idx = n.lastIndexOf('/'); return idx <= 0 ? '' : n.slice(0, idx); }
@@ -48,15 +59,27 @@ function logLine(text, cls='') {
 
 function sseConnect() {
     try {
-        const es = new EventSource('/api/events/stream');
+        const es = new EventSource('/api/events/stream?topics=scan,refresh');
         es.onmessage = (ev) => {
             try {
-                const data = JSON.parse(ev.data);
-                if (data && data.path) {
-                    if (data.status === 'start') logLine(`开始扫描: ${data.path}`);
-                    else if (data.status === 'done') logLine(`完成扫描: ${data.path}`, 'ok');
-                    else if (data.status === 'skip') logLine(`跳过: ${data.path} (${data.reason})`, 'warn');
-                    else logLine(JSON.stringify(data));
+                const parsed = JSON.parse(ev.data);
+                // the server batches events: data is one payload or a list of them
+                for (const data of (Array.isArray(parsed) ? parsed : [parsed])) {
+                    if (data && data.bus) {
+                        if (data.bus === 'dropped') logLine(`事件过多，已丢弃 ${data.count} 条`, 'warn');
+                    } else if (data && data.phase) {
+                        // refresh progress is coalesced per phase; keep the log to phase changes
+                        const btn = $('#refreshBtn');
+                        if (btn) btn.title = `刷新 ${data.phase}: ${data.done}/${data.total}`;
+                        if (data.phase !== 'stat' || data.done === data.total) {
+                            logLine(`刷新 ${data.phase}: 已检查 ${data.done}/${data.total} 删除=${data.removed} 变更=${data.changed}`);
+                        }
+                    } else if (data && data.path) {
+                        if (data.status === 'start') logLine(`开始扫描: ${data.path}`);
+                        else if (data.status === 'done') logLine(`完成扫描: ${data.path}`, 'ok');
+                        else if (data.status === 'skip') logLine(`跳过: ${data.path} (${data.reason})`, 'warn');
+                        else logLine(JSON.stringify(data));
+                    }
                 }
             } catch {}
         };
@@ -64,4 +87,4 @@ function sseConnect() {
     } catch {}
 }
 
-export { $, $$, fmt, fmtSize, api, normPath, lowerPath, parentDirPath, state, logLine, sseConnect };
+export { $, $$, fmt, fmtSize, api, waitJob, normPath, lowerPath, parentDirPath, state, logLine, sseConnect };
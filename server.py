@@ -4,6 +4,13 @@ Browser History Browser - Python Backend Server
 启动脚本
 """
 
+import os
+import time
+
+# startup timing baseline (see app/utils/startup.py); set before heavy imports
+os.environ.setdefault("MYREAD_T0", str(time.time()))
+
+import multiprocessing
 import uvicorn
 import sys
 
@@ -11,6 +18,9 @@ def main():
     """启动服务器"""
     # 检测是否为打包后的可执行文件
     is_packaged = getattr(sys, 'frozen', False)
+    # 多进程模式（APP_WORKERS>1）下子进程通过 spawn 启动，打包版本需要 freeze_support
+    multiprocessing.freeze_support()
+    workers = max(1, int(os.getenv("APP_WORKERS", "1")))
     
     print("🚀 启动 Browser History Browser 服务器...")
     print("📍 前端地址: http://127.0.0.1:8000")
@@ -19,15 +29,25 @@ def main():
     
     if is_packaged:
         print("📦 运行模式: 生产环境 (打包版本)")
+    elif workers > 1:
+        print("🔧 运行模式: 开发环境")
     else:
         print("🔧 运行模式: 开发环境 (自动重载)")
+    if workers > 1:
+        print(f"🧵 工作进程: {workers}")
     
     try:
+        if workers > 1:
+            # 结构升级只在父进程里做一次，工作进程启动时看到的已是最新版本
+            import asyncio
+            from app.db import init_db
+            asyncio.run(init_db())
         uvicorn.run(
             "app.main:app",
             host="127.0.0.1",
             port=8000,
-            reload=not is_packaged,  # 仅在非打包环境下启用自动重载
+            reload=not is_packaged and workers == 1,  # 仅在非打包、单进程时启用自动重载
+            workers=workers,
             access_log=True
         )
     except KeyboardInterrupt: